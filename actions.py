@@ -1,11 +1,14 @@
 import keyword
 import ast
 from copy import deepcopy
+import weakref
 
 import core_logic
 import make_nodes
 import operations
 import validators
+from yank_ring import YankRing
+from folds import foldable_types
 
 # TODO: Remove the current attr (Go back one)
 # TODO: Have a blank line on top of for and while
@@ -39,27 +42,29 @@ def has_string_value(node):
     return type(value) == str
 
 
-def rename(new_name, node, maybe_index):
+def rename(tree, new_name, node, maybe_index):
 
     if hasattr(node, "id"):
-        node.id = new_name
+        core_logic.set_field(tree, node, "id", new_name)
     # Only rename by asname if it's not empty
     elif hasattr(node, "asname") and node.asname is not None:
-        node.asname = new_name
+        core_logic.set_field(tree, node, "asname", new_name)
     elif hasattr(node, "name"):
-        node.name = new_name
+        core_logic.set_field(tree, node, "name", new_name)
     elif hasattr(node, "module"):
-        node.module = new_name
+        core_logic.set_field(tree, node, "module", new_name)
     elif hasattr(node, "attr"):
-        node.attr = new_name
+        core_logic.set_field(tree, node, "attr", new_name)
     elif hasattr(node, "arg"):
-        node.arg = new_name
+        core_logic.set_field(tree, node, "arg", new_name)
     elif has_string_value(node):
-        node.value = new_name
+        core_logic.set_field(tree, node, "value", new_name)
     # Must come after, otherwise imports, that have both names and a string value
     # will be renamed by index when they don't need to
     elif hasattr(node, "names"):
-        node.names[maybe_index] = new_name
+        names = list(node.names)
+        names[maybe_index] = new_name
+        core_logic.set_field(tree, node, "names", names)
     else:
         raise ValueError(
                 f"{node.__class__.__name__} node isn't renameable"
@@ -80,19 +85,20 @@ def is_identifier(ident: str) -> bool:
     return True
 
 
-def user_input_rename(node, get_user_input):
+def user_input_rename(cursor_trail, tree, get_user_input):
+    node = core_logic.get_node_at_cursor(cursor_trail, tree)
 
     # TODO: Enforce naming conventions
     # (like classes should start with a capital letter)
     if not is_renameable(node):
         print("Can't rename this type of node")
-        return [] 
+        return
 
     new_name = get_user_input("Rename to: ") 
 
     if not is_identifier(new_name):
         print("Invalid name")
-        return []
+        return
 
     # global and nonlocal keywords are annoying:
     # they have a list of identifiers instead of list of nodes,
@@ -103,34 +109,35 @@ def user_input_rename(node, get_user_input):
             index = int(get_user_input("Rename at index: "))
         except ValueError:
             print("Bad index")
-            return [] 
+            return
 
         if index >= len(node.names):
             print("Bad index")
-            return []
+            return
 
-        rename(new_name, node, index)
+        rename(tree, new_name, node, index)
 
     else:
-        rename(new_name, node, None)
-
-    # The [] means not to move the cursor
-    return [] 
+        rename(tree, new_name, node, None)
 
 
 # TODO: Skip moving through Expr nodes for a better moving experience: No repeated 
 # No repeated down presses without a visual change
-def move_cursor_down(node, _):
+def move_cursor_down(cursor_trail, tree, _):
+    node = core_logic.get_node_at_cursor(cursor_trail, tree)
     children = core_logic.list_children(node)
 
     # Ensure the selected node has children
     if children == []:
-        return []
+        return
+
+    # Going into a folded node unfolds it
+    core_logic.get_folds(tree).unfold(node, core_logic.get_index(tree))
 
     print(children[0].__class__.__name__)
 
     # Move the cursor down
-    return [0]
+    cursor_trail.append(0)
 
 
 def move_cursor_left(cursor_trail, ast, _):
@@ -165,6 +172,18 @@ def move_cursor_right(cursor_trail, ast, _):
     print(current_node.__class__.__name__)
 
 
+def toggle_fold(cursor_trail, tree, _):
+    """Folds the selected node, so the view only shows its first line
+    (or unfolds it)"""
+
+    selected_node = core_logic.get_node_at_cursor(cursor_trail, tree)
+    if not isinstance(selected_node, foldable_types):
+        print("Can't fold this node")
+        return
+
+    core_logic.get_folds(tree).toggle(selected_node, core_logic.get_index(tree))
+
+
 # TODO: Move to the inserted node (hopefully it's the first child)
 def insert(cursor_trail, tree, _):
     """Adds an element inside the node.
@@ -174,12 +193,19 @@ def insert(cursor_trail, tree, _):
     selected_node = core_logic.get_node_at_cursor(cursor_trail, tree)
     if hasattr(selected_node, "bases"):
         # Add a new base class to the class 
-        selected_node.bases.append(ast.Name(id="BaseClass", ctx=ast.Load()))
+        core_logic.insert_in_field(
+                tree,
+                selected_node,
+                "bases",
+                len(selected_node.bases),
+                ast.Name(id="BaseClass", ctx=ast.Load())
+                )
 
     # It doesn't make sense to insert into a body because they can't ever be empty
     # Except for the Module node
     elif isinstance(selected_node, ast.Module):
-        selected_node.body.append(make_nodes.make_pass())
+        core_logic.insert_in_field(
+                tree, selected_node, "body", len(selected_node.body), make_nodes.make_pass())
 
     elif isinstance(selected_node, ast.arguments):
 
@@ -188,7 +214,7 @@ def insert(cursor_trail, tree, _):
         # Make the name unique
         arg.arg = core_logic.get_unique_name(arg.arg, selected_node)
 
-        selected_node.args.append(arg)
+        core_logic.insert_in_field(tree, selected_node, "args", len(selected_node.args), arg)
         return [0]
 
     # Call has the args list as a list of expressions
@@ -196,12 +222,18 @@ def insert(cursor_trail, tree, _):
     # The grammar is really confusing when it comes to those "args"
     elif isinstance(selected_node, ast.Call):
         arg = make_nodes.make_expression()
-        selected_node.args.append(arg)
+        core_logic.insert_in_field(tree, selected_node, "args", len(selected_node.args), arg)
         return [0]
 
     elif hasattr(selected_node, "elts"):
         ctx = core_logic.get_immediate_context(cursor_trail, tree)
-        selected_node.elts.append(make_nodes.make_expression(ctx=ctx))
+        core_logic.insert_in_field(
+                tree,
+                selected_node,
+                "elts",
+                len(selected_node.elts),
+                make_nodes.make_expression(ctx=ctx)
+                )
 
         return [-1]
 
@@ -219,30 +251,38 @@ def append(cursor_trail, tree, _):
         return
 
     parent = core_logic.get_node_at_cursor(cursor_trail[:-1], tree)
-    fieldname, index = core_logic.get_field_name_for_child(parent, selected_node)
+    fieldname, index = core_logic.get_field_name_for_child(parent, selected_node, tree)
 
     if index is not None:
         children = getattr(parent, fieldname)
-        children.insert(index + 1, deepcopy(selected_node))
+        core_logic.insert_in_field(tree, parent, fieldname, index + 1, deepcopy(selected_node))
 
         # A dictionary should always have the same amount of keys and values
         # So let's be careful and keep them synced
         if type(parent) == ast.Dict:
             if fieldname == "keys":
-                parent.values.insert(index + 1, deepcopy(parent.values[index]))
+                core_logic.insert_in_field(
+                        tree, parent, "values", index + 1, deepcopy(parent.values[index]))
             if fieldname == "values":
-                parent.keys.insert(index + 1, deepcopy(parent.keys[index]))
+                core_logic.insert_in_field(
+                        tree, parent, "keys", index + 1, deepcopy(parent.keys[index]))
 
         # Comparisons are similar:
         # They should have the same number of comparators and comparands
         if type(parent) == ast.Compare:
-            parent.ops.insert(index + 1, deepcopy(parent.ops[index]))
+            core_logic.insert_in_field(
+                    tree, parent, "ops", index + 1, deepcopy(parent.ops[index]))
 
         # In the case we are within function arguments
         # two of them with the same name can break stuff.
         # So let's give the new one a different name 
         if type(selected_node) == ast.arg:
-            children[index + 1].arg = core_logic.get_unique_name(selected_node.arg, parent)
+            core_logic.set_field(
+                    tree,
+                    children[index + 1],
+                    "arg",
+                    core_logic.get_unique_name(selected_node.arg, parent)
+                    )
 
         return
 
@@ -250,8 +290,33 @@ def append(cursor_trail, tree, _):
     print("Can't append to this type of node")
        
 
-# TODO: Recalculate the index after deleting
-# to avoid the weird cursor jumps because of the wrapping around
+def why_cant_delete_from(parent, fieldname):
+    """Returns why an element of the list in the field can't be deleted
+    (None if it can)"""
+
+    children_list = getattr(parent, fieldname)
+
+    # A try block needs to have at least one of those not empty
+    if fieldname == "handlers" or fieldname == "finalbody":
+        if len(parent.handlers) + len(parent.finalbody)  == 1:
+            return "A Try block needs handlers or a finally"
+
+    if isinstance(parent, ast.BoolOp):
+        if len(children_list) < 3:
+            return "A boolean operation must have at least 2 operands"
+
+    # These kinds of nodes can't be empty
+    elif  (  fieldname == "names"
+        or fieldname == "body"
+        or fieldname == "items"
+        or fieldname == "targets"):
+
+        if len(children_list) < 2:
+            return "This can't be empty"
+
+    return None
+
+
 def delete(cursor_trail, tree, _):
 
     # Don't touch the module
@@ -260,47 +325,37 @@ def delete(cursor_trail, tree, _):
 
     selected_node = core_logic.get_node_at_cursor(cursor_trail, tree)
     parent = core_logic.get_node_at_cursor(cursor_trail[:-1], tree)
-    fieldname, index = core_logic.get_field_name_for_child(parent, selected_node)
+    fieldname, index = core_logic.get_field_name_for_child(parent, selected_node, tree)
 
     if index is not None:
         children_list = getattr(parent, fieldname)
+        position = cursor_trail[-1] % len(core_logic.list_children(parent))
 
-        # A try block needs to have at least one of those not empty
-        if fieldname == "handlers" or fieldname == "finalbody":
-            if len(parent.handlers) + len(parent.finalbody)  == 1:
-                print("A Try block needs handlers or a finally")
-                return
+        problem = why_cant_delete_from(parent, fieldname)
+        if problem is not None:
+            print(problem)
+            return
 
         if isinstance(parent, ast.Dict):
             # If it's a dictionary, keep the key value pairs synced
             # by deleting the correspondig key/value
             if fieldname == "keys":
-                parent.values.pop(index)
+                core_logic.pop_from_field(tree, parent, "values", index)
 
             if fieldname == "values":
-                parent.keys.pop(index)
-
-        if isinstance(parent, ast.BoolOp):
-            if len(children_list) < 3:
-                print("A boolean operation must have at least 2 operands")
-                return
-
-        # These kinds of nodes can't be empty
-        elif  (  fieldname == "names"
-            or fieldname == "body"
-            or fieldname == "items"
-            or fieldname == "targets"):
-
-            if len(children_list) < 2:
-                print("This can't be empty")
-                return
-        
-        children_list.pop(index)
+                core_logic.pop_from_field(tree, parent, "keys", index)
+
+        core_logic.pop_from_field(tree, parent, fieldname, index)
 
         # If there are no more children, move up
         if len(children_list) == 0:
             cursor_trail.pop()
 
+        # If it was the last child, select the one that's last now
+        # (Instead of wrapping around to the first one)
+        elif position >= len(core_logic.list_children(parent)):
+            cursor_trail[-1] = -1
+
     else:
         # setattr(parent, fieldname, None)
         pass
@@ -313,9 +368,9 @@ def insert_annotation(cursor_trail, tree, _):
     if hasattr(selected_node, "returns"):
         # Toggle the return annotation
         if selected_node.returns is None:
-            selected_node.returns = default_annotation 
+            core_logic.set_field(tree, selected_node, "returns", default_annotation)
         else:
-            selected_node.returns = None
+            core_logic.set_field(tree, selected_node, "returns", None)
 
     # The assignments must come befor the generic annotation case
     # Because otherwise the annotated assignment's annotation will be
@@ -346,9 +401,9 @@ def insert_annotation(cursor_trail, tree, _):
     elif hasattr(selected_node, "annotation"):
         # Toggle the annotation
         if selected_node.annotation is None:
-            selected_node.annotation = default_annotation
+            core_logic.set_field(tree, selected_node, "annotation", default_annotation)
         else:
-            selected_node.annotation = None
+            core_logic.set_field(tree, selected_node, "annotation", None)
 
     else:
         print("This node can't have type annotations")
@@ -402,33 +457,40 @@ def extend(cursor_trail, tree, _):
         
         # Toggle the else branch
         if selected_node.orelse == []:
-            selected_node.orelse = [ast.Pass()]
+            core_logic.set_field(tree, selected_node, "orelse", [ast.Pass()])
         else:
-            selected_node.orelse = []
+            core_logic.set_field(tree, selected_node, "orelse", [])
 
     elif hasattr(selected_node, "decorator_list"):
 
         # Toggle the decorator_list
         if selected_node.decorator_list == []:
-            selected_node.decorator_list = [ast.Name(id="decorator", ctx=ast.Load())]
+            core_logic.set_field(
+                    tree,
+                    selected_node,
+                    "decorator_list",
+                    [ast.Name(id="decorator", ctx=ast.Load())]
+                    )
         else:
-            selected_node.decorator_list = []
+            core_logic.set_field(tree, selected_node, "decorator_list", [])
 
     elif isinstance(selected_node, ast.Raise):
 
         # toggle the cause
         if selected_node.cause is None:
-            selected_node.cause = ast.Name(id="cause", ctx=ast.Load())
+            core_logic.set_field(
+                    tree, selected_node, "cause", ast.Name(id="cause", ctx=ast.Load()))
         else:
-            selected_node.cause = None
+            core_logic.set_field(tree, selected_node, "cause", None)
 
     elif isinstance(selected_node, ast.Assert):
 
         # toggle the message
         if selected_node.msg is None:
-            selected_node.msg = ast.Constant(value="message", kind=None)
+            core_logic.set_field(
+                    tree, selected_node, "msg", ast.Constant(value="message", kind=None))
         else:
-            selected_node.msg = None
+            core_logic.set_field(tree, selected_node, "msg", None)
 
     elif isinstance(selected_node, ast.Import):
 
@@ -456,23 +518,23 @@ def extend(cursor_trail, tree, _):
     elif isinstance(selected_node, ast.alias):
         # Toggle the asname
         if selected_node.asname is None:
-            selected_node.asname = "alias"
+            core_logic.set_field(tree, selected_node, "asname", "alias")
         else: 
-            selected_node.asname = None
+            core_logic.set_field(tree, selected_node, "asname", None)
     
     elif isinstance(selected_node, ast.comprehension):
         # Toggle the if clause
         if selected_node.ifs == []:
-            selected_node.ifs = [make_nodes.make_expression()]
+            core_logic.set_field(tree, selected_node, "ifs", [make_nodes.make_expression()])
         else: 
-            selected_node.ifs = []
+            core_logic.set_field(tree, selected_node, "ifs", [])
 
     elif isinstance(selected_node, ast.Yield):
         # Toggle the thing to yield
         if selected_node.value is None:
-            selected_node.value = make_nodes.make_expression()
+            core_logic.set_field(tree, selected_node, "value", make_nodes.make_expression())
         else: 
-            selected_node.value = None
+            core_logic.set_field(tree, selected_node, "value", None)
 
     elif isinstance(selected_node, ast.Name):
         # Make it into an ast.Starred
@@ -536,37 +598,75 @@ def extend(cursor_trail, tree, _):
     return []
 
 
+def get_yank_ring(tree):
+    return tree.states_for_actions.setdefault("yank_ring", YankRing())
+
+
 def yank(cursor_trail, tree, _):
     selected_node = core_logic.get_node_at_cursor(cursor_trail, tree)
-    # TODO: Multi level undo
-    tree.states_for_actions["yanked"] = deepcopy(selected_node)
+    get_yank_ring(tree).yank(selected_node, core_logic.get_index(tree))
+
+
+def yank_to_register(cursor_trail, tree, get_user_input):
+    selected_node = core_logic.get_node_at_cursor(cursor_trail, tree)
+    register = get_user_input("Yank to register: ")
+    get_yank_ring(tree).yank(selected_node, core_logic.get_index(tree), register)
     
 
 def put(cursor_trail, tree, _):
-    selected_node = core_logic.get_node_at_cursor(cursor_trail, tree)
+    put_yank(cursor_trail, tree, get_yank_ring(tree).latest())
 
-    try:
-        yanked = tree.states_for_actions["yanked"]
-    except KeyError:
+
+def put_from_register(cursor_trail, tree, get_user_input):
+    register = get_user_input("Put from register: ")
+    put_yank(cursor_trail, tree, get_yank_ring(tree).registers.get(register))
+
+
+def cycle_yanks(cursor_trail, tree, _):
+    """Makes the previous yank the one that gets put.
+    If what was just put is selected, it gets replaced with it"""
+
+    ring = get_yank_ring(tree)
+    if not ring.ring:
         print("No yanked node")
         return
 
+    ring.cycle()
+    print(ring.latest().node.__class__.__name__)
+
+    if (ring.last_put is not None
+            and ring.last_put() is core_logic.get_node_at_cursor(cursor_trail, tree)):
+        put(cursor_trail, tree, _)
+
+
+def can_paste(selected_node, yanked):
     # Or they have the same type
     # or they are both statements
     # or they are both expressions
     # or it's an expression being pasted into a statement
     # (In this case we'll wrap it into an Expr)
     # otherwise, we can't paste here
-    if not (
-               (type(selected_node) == type(yanked))
+    return (   (type(selected_node) == type(yanked))
             or (isinstance(selected_node, ast.stmt) and isinstance(yanked, ast.stmt))
             or (isinstance(selected_node, ast.stmt) and isinstance(yanked, ast.expr))
             or (isinstance(selected_node, ast.expr) and isinstance(yanked, ast.expr))
-           ):
+           )
+
 
+def put_yank(cursor_trail, tree, yank):
+    selected_node = core_logic.get_node_at_cursor(cursor_trail, tree)
+
+    if yank is None:
+        print("No yanked node")
+        return
+
+    if not can_paste(selected_node, yank.node):
          print("Cannot paste here, the type is different")
          return
 
+    # Only copied if the yanked node is still in the tree
+    yanked = yank.take(core_logic.get_index(tree))
+
     if isinstance(selected_node, ast.stmt) and isinstance(yanked, ast.expr):
         # Fix the type by wrapping the expression into an Expr
         # Making both into ast.stmt
@@ -575,6 +675,173 @@ def put(cursor_trail, tree, _):
     # TODO: Add the mirror logic for unwrapping an Expr into it's value
 
     core_logic.set_node_at_cursor(cursor_trail, tree, yanked)
+    get_yank_ring(tree).last_put = weakref.ref(yanked)
+
+
+def undo(cursor_trail, tree, _):
+    cursor = core_logic.undo(tree)
+    if cursor is None:
+        print("Nothing to undo")
+        return
+
+    # Go back to where the cursor was before the action
+    cursor_trail[:] = core_logic.get_cursor_trail(cursor, tree)
+
+
+def redo(cursor_trail, tree, _):
+    cursor = core_logic.redo(tree)
+    if cursor is None:
+        print("Nothing to redo")
+        return
+
+    cursor_trail[:] = core_logic.get_cursor_trail(cursor, tree)
+
+
+# Whether each action would do something at the cursor, without doing it
+# (They are all called with (cursor_trail, tree), and must not change anything)
+
+def can_move_down(cursor_trail, tree):
+    selected_node = core_logic.get_node_at_cursor(cursor_trail, tree)
+    return core_logic.list_children(selected_node) != []
+
+
+def can_move_up(cursor_trail, tree):
+    return cursor_trail != []
+
+
+def can_move_sideways(cursor_trail, tree):
+    if cursor_trail == []:
+        return False
+
+    # An only child has no siblings to move to
+    parent = core_logic.get_node_at_cursor(cursor_trail[:-1], tree)
+    return len(core_logic.list_children(parent)) > 1
+
+
+def can_toggle_fold(cursor_trail, tree):
+    selected_node = core_logic.get_node_at_cursor(cursor_trail, tree)
+    return isinstance(selected_node, foldable_types)
+
+
+def can_rename(cursor_trail, tree):
+    return is_renameable(core_logic.get_node_at_cursor(cursor_trail, tree))
+
+
+def get_slot_at_cursor(cursor_trail, tree):
+    """Returns (parent, field_name, index) of the selected node"""
+
+    selected_node = core_logic.get_node_at_cursor(cursor_trail, tree)
+    parent = core_logic.get_node_at_cursor(cursor_trail[:-1], tree)
+    fieldname, index = core_logic.get_field_name_for_child(parent, selected_node, tree)
+
+    return (parent, fieldname, index)
+
+
+def can_append(cursor_trail, tree):
+    if cursor_trail == []:
+        return False
+
+    parent, fieldname, index = get_slot_at_cursor(cursor_trail, tree)
+    return index is not None
+
+
+def can_insert(cursor_trail, tree):
+    selected_node = core_logic.get_node_at_cursor(cursor_trail, tree)
+
+    return (   hasattr(selected_node, "bases")
+            or isinstance(selected_node, ast.Module)
+            or isinstance(selected_node, ast.arguments)
+            or isinstance(selected_node, ast.Call)
+            or hasattr(selected_node, "elts")
+           )
+
+
+def can_delete(cursor_trail, tree):
+    if cursor_trail == []:
+        return False
+
+    parent, fieldname, index = get_slot_at_cursor(cursor_trail, tree)
+    return index is not None and why_cant_delete_from(parent, fieldname) is None
+
+
+def can_annotate(cursor_trail, tree):
+    selected_node = core_logic.get_node_at_cursor(cursor_trail, tree)
+
+    return (   hasattr(selected_node, "returns")
+            or isinstance(selected_node, ast.Assign)
+            or isinstance(selected_node, ast.AnnAssign)
+            or hasattr(selected_node, "annotation")
+           )
+
+
+def can_extend(cursor_trail, tree):
+    # The same cases as in extend
+    selected_node = core_logic.get_node_at_cursor(cursor_trail, tree)
+
+    if isinstance(selected_node, ast.Name):
+        parent = core_logic.get_node_at_cursor(cursor_trail[:-1], tree)
+
+        return (core_logic.core_is_within_field(cursor_trail, tree, ast.Assign, "targets")
+                and (isinstance(parent, ast.Tuple) or isinstance(parent, ast.List)))
+
+    return (   (hasattr(selected_node, "orelse") and not isinstance(selected_node, ast.IfExp))
+            or hasattr(selected_node, "decorator_list")
+            or isinstance(selected_node, ast.Raise)
+            or isinstance(selected_node, ast.Assert)
+            or isinstance(selected_node, ast.Import)
+            or isinstance(selected_node, ast.ImportFrom)
+            or isinstance(selected_node, ast.alias)
+            or isinstance(selected_node, ast.comprehension)
+            or isinstance(selected_node, ast.Yield)
+            or (isinstance(selected_node, ast.Starred)
+                and isinstance(selected_node.value, ast.Name))
+            or isinstance(selected_node, ast.Index)
+            or isinstance(selected_node, ast.Slice)
+           )
+
+
+def can_yank(cursor_trail, tree):
+    return True
+
+
+def can_put(cursor_trail, tree):
+    ring = tree.states_for_actions.get("yank_ring")
+    if cursor_trail == [] or ring is None or ring.latest() is None:
+        return False
+
+    selected_node = core_logic.get_node_at_cursor(cursor_trail, tree)
+    return can_paste(selected_node, ring.latest().node)
+
+
+def can_put_from_register(cursor_trail, tree):
+    # It depends on which register, so at least one has to fit
+    ring = tree.states_for_actions.get("yank_ring")
+    if cursor_trail == [] or ring is None:
+        return False
+
+    selected_node = core_logic.get_node_at_cursor(cursor_trail, tree)
+    return any(can_paste(selected_node, yank.node) for yank in ring.registers.values())
+
+
+def can_cycle_yanks(cursor_trail, tree):
+    ring = tree.states_for_actions.get("yank_ring")
+    return ring is not None and len(ring.ring) > 1
+
+
+def can_undo(cursor_trail, tree):
+    return len(core_logic.get_history(tree).undo_stack) > 0
+
+
+def can_redo(cursor_trail, tree):
+    return len(core_logic.get_history(tree).redo_stack) > 0
+
+
+def applicable_actions(cursor_trail, tree):
+    """Returns the names of the actions that would do something at the cursor.
+    It doesn't run them, so the tree stays the same"""
+
+    return {name for (name, can_apply) in applicability.items()
+            if can_apply(cursor_trail, tree)}
 
 
 # Local actions only interact with the current node and it's children
@@ -584,11 +851,11 @@ def put(cursor_trail, tree, _):
 # Simpler ones, like moving the cursor, coming first
 actions = {
     # "action"     : (function, is_local?)
-    "cursor_down"  : (move_cursor_down, True),
+    "cursor_down"  : (move_cursor_down, False),
     "cursor_up"    : (move_cursor_up, False),
     "cursor_right" : (move_cursor_right, False),
     "cursor_left"  : (move_cursor_left, False),
-    "rename"       : (user_input_rename, True),
+    "rename"       : (user_input_rename, False),
     "append"       : (append, False),
     "insert"       : (insert, False),
     "delete"       : (delete, False),
@@ -615,10 +882,62 @@ actions = {
     "or"        : operations.to_bool_op(ast.Or),
 
     "yank": (yank, False),
-    "put": (put, False)
+    "put": (put, False),
+    "yank_to_register": (yank_to_register, False),
+    "put_from_register": (put_from_register, False),
+    "cycle_yanks": (cycle_yanks, False),
+    "undo": (undo, False),
+    "redo": (redo, False),
+    "toggle_fold": (toggle_fold, False),
 }
 
 
 # Add the node making functions from the make_nodes file
 for key in make_nodes.nodes.keys():
     actions["make_" + key] = make_nodes.make_node(key)
+
+
+# See applicable_actions
+applicability = {
+    "cursor_down"  : can_move_down,
+    "cursor_up"    : can_move_up,
+    "cursor_right" : can_move_sideways,
+    "cursor_left"  : can_move_sideways,
+    "rename"       : can_rename,
+    "append"       : can_append,
+    "insert"       : can_insert,
+    "delete"       : can_delete,
+    "insert_int"          : validators.is_simple_expression,
+    "type_annotation"       : can_annotate,
+    "extend"      : can_extend,
+    # Binary operations
+    "add"        : operations.can_change_operation,
+    "subtract"        : operations.can_change_operation,
+    "multiply"        : operations.can_change_operation,
+    "divide"        : operations.can_change_operation,
+    "mod"        : operations.can_change_operation,
+    "pow"        : operations.can_change_operation,
+    # Comparisons
+    "equals"        : operations.can_change_operation,
+    "greater_than"        : operations.can_change_operation,
+    "greater_than_equals"        : operations.can_change_operation,
+    "less_than"        : operations.can_change_operation,
+    "less_than_equals"        : operations.can_change_operation,
+    "is"        : operations.can_change_operation,
+    "in"        : operations.can_change_operation,
+    # Boolean operation
+    "and"        : operations.can_change_operation,
+    "or"        : operations.can_change_operation,
+
+    "yank": can_yank,
+    "put": can_put,
+    "yank_to_register": can_yank,
+    "put_from_register": can_put_from_register,
+    "cycle_yanks": can_cycle_yanks,
+    "undo": can_undo,
+    "redo": can_redo,
+    "toggle_fold": can_toggle_fold,
+}
+
+for key in make_nodes.nodes.keys():
+    applicability["make_" + key] = make_nodes.can_make(key)
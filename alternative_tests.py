@@ -10,13 +10,13 @@ import ast
 
 
 def test_action_sequences(default_ast, max_action_sequence_length):
-    actions = list(act.actions.keys())
     to_test = queue.SimpleQueue()
 
     get_vim_input = lambda x: 'USER_INPUT'
 
     # Insert the initial set of actions
-    for action in actions:
+    # (Only the ones that would do something, the rest are dead branches)
+    for action in act.applicable_actions([], default_ast):
         to_test.put((deepcopy(default_ast), [], [], action))
 
     while (case_to_test := to_test.get()) if not to_test.empty() else False:
@@ -47,7 +47,7 @@ def test_action_sequences(default_ast, max_action_sequence_length):
         # This print makes it satisfying to watch the number of remainig checks going down
         print(to_test.qsize())
         if len(actions_performed) < max_action_sequence_length:
-            for action in actions:
+            for action in act.applicable_actions(cursor_trail_after, tree_after):
                 to_test.put((tree_after, cursor_trail_after, 
                     actions_performed + [action_name], action))
 
@@ -90,6 +90,9 @@ if __name__ == '__main__':
     with open('python_file_examples/sudoku.py', 'r') as f:
         tree = ast.parse(f.read())
 
+    # Actions may have state kept within this dict that's mutated
+    tree.states_for_actions = {}
+
     test_action_sequences(tree, 3)
     #copy = deepcopy(tree)
     #print(identical_nodes(tree, copy))
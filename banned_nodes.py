@@ -3,7 +3,8 @@ import ast
 # Those are reported as nodes by ast.iter_child_nodes(parent)
 # But cause trouble down the road
 # (AttributeErrors when navigating to them)
-banned_nodes = [
+# It's a set because it's checked for every child of every node we look at
+banned_nodes = frozenset([
         ast.Load,
         ast.Store,
         ast.Del,
@@ -19,6 +20,7 @@ banned_nodes = [
         ast.Is,
         ast.IsNot,
         ast.In,
+        ast.NotIn,
         ast.Add,
         ast.Sub,
         ast.Mult,
@@ -38,5 +40,5 @@ banned_nodes = [
         ast.Not,
         ast.UAdd,
         ast.USub,
-        ]
+        ])
 
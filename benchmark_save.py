@@ -0,0 +1,78 @@
+"""Times saving a big generated module like the editor used to
+(astor.to_source on the whole module), and in one process and in many
+like it does now, and checks that they all give the same text.
+It's also timed after the view was rendered, like when saving in the
+editor (The statements that didn't change are already rendered then)
+
+python benchmark_save.py [number of statements] [number of processes]"""
+
+import ast
+import os
+import sys
+import time
+
+import astor
+
+import renderers.standard
+from core_logic import get_index
+
+
+def generated_module(statement_count):
+    statements = []
+    for n in range(statement_count // 2):
+        statements.append(f"def function_{n}(a, b=({n}, 'x')):\n"
+                          f"    return [a * i + b[0] for i in range({n}) if i % 3]\n")
+        statements.append(f"value_{n} = {{'key': function_{n}(1), 'other': [{n}, {n + 1}]}}\n")
+
+    return ast.parse("\n".join(statements))
+
+
+def time_old_save(tree):
+    # What main.save did before the statements were rendered on their own
+    start = time.perf_counter()
+    source = astor.to_source(tree)
+    return (time.perf_counter() - start, source)
+
+
+def time_save(tree, processes, after_the_view=False):
+    # Nothing cached, like the first save after opening the file
+    renderers.standard.statement_cache = renderers.standard.StatementCache()
+    renderers.standard.save_processes = processes
+
+    if after_the_view:
+        for line in renderers.standard.render_view_lines(tree, None, 80):
+            pass
+
+    start = time.perf_counter()
+    source = renderers.standard.render_standard(tree)
+    return (time.perf_counter() - start, source)
+
+
+if __name__ == "__main__":
+    statement_count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    processes = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count()
+
+    tree = generated_module(statement_count)
+
+    # The editor indexes the tree when it opens the file, not when it saves
+    get_index(tree)
+
+    # So the first one doesn't pay for warming up
+    time_old_save(generated_module(1000))
+    time_save(generated_module(1000), 1)
+
+    old_seconds, old_source = time_old_save(tree)
+    print(f"{len(tree.body)} statements, {processes} processes")
+    print(f"astor.to_source (how it used to save): {old_seconds:.2f}s")
+
+    sources = [old_source]
+    for after_the_view in (False, True):
+        print("After rendering the view:" if after_the_view else "Nothing rendered before:")
+
+        for n in sorted({1, processes}):
+            seconds, source = time_save(tree, n, after_the_view)
+            sources.append(source)
+            print(f"  In {n} process{'es' if n > 1 else ''}: {seconds:.2f}s "
+                  f"({old_seconds / seconds:.1f}x as fast)")
+
+    print("Same text" if len(set(sources)) == 1 else "DIFFERENT TEXT")
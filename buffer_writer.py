@@ -0,0 +1,145 @@
+from array import array
+from difflib import SequenceMatcher
+from itertools import islice
+
+# How many lines go to the buffer at a time when everything is written
+# (Each write goes through vim, so writing them one by one would be slow)
+lines_per_write = 1000
+
+# If more lines than this changed, they are written in one go
+# instead of looking for the ranges that changed within them
+max_lines_to_match = 500
+
+
+def lines_of(pieces):
+    """Splits the text made of the pieces into lines as the pieces come,
+    so the whole text is never in one string. Gives the same lines
+    as "".join(pieces).split("\\n")"""
+
+    partial_line = []
+    for piece in pieces:
+        if "\n" not in piece:
+            partial_line.append(piece)
+            continue
+
+        lines = piece.split("\n")
+
+        partial_line.append(lines[0])
+        yield "".join(partial_line)
+
+        yield from lines[1:-1]
+        partial_line = [lines[-1]]
+
+    yield "".join(partial_line)
+
+
+class BufferWriter:
+    """Writes the rendered lines to a buffer, but only the ones that
+    changed since the last time. Each write makes vim redraw, highlight
+    and remember the lines for its undo, so a small change in the tree
+    should only touch a few lines"""
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        # The hashes of the lines in the buffer, to tell which lines changed
+        # without reading them back (or keeping a copy of the whole view)
+        # (8 bytes a line)
+        self.hashes = array("q", map(hash, buffer))
+        # Whether each line of the buffer was highlighted since it was written
+        self.highlighted = [False] * len(self.hashes)
+
+    def write(self, lines):
+        """Writes the lines from the iterable, going through it once.
+        The lines before the first one that changed aren't kept, and
+        the rest are only kept until they're written"""
+
+        # Something else changed the buffer, so it all gets written again
+        if len(self.buffer) != len(self.hashes):
+            self.write_all(lines)
+            return
+
+        lines = iter(lines)
+        hashes = array("q")
+        changed_lines = []
+
+        for line in lines:
+            hashes.append(hash(line))
+
+            position = len(hashes) - 1
+            if position >= len(self.hashes) or hashes[position] != self.hashes[position]:
+                changed_lines.append(line)
+                break
+
+        first_changed = len(hashes) - len(changed_lines)
+        changed_lines.extend(lines)
+        hashes.extend(map(hash, changed_lines[1:]))
+
+        for (old_start, old_end, new_start, new_end) in reversed(changed_ranges(self.hashes, hashes)):
+            # From the last one, so they don't move the lines of the others
+            self.buffer[old_start:old_end] = \
+                    changed_lines[new_start - first_changed:new_end - first_changed]
+            self.highlighted[old_start:old_end] = [False] * (new_end - new_start)
+
+        self.hashes = hashes
+
+    def write_all(self, lines):
+        """Replaces every line of the buffer with the lines from the
+        iterable, a few at a time as they are rendered"""
+
+        lines = iter(lines)
+        self.hashes = array("q")
+
+        while True:
+            chunk = list(islice(lines, lines_per_write))
+            if not chunk:
+                break
+
+            written = len(self.hashes)
+            self.buffer[written:written + len(chunk)] = chunk
+            self.hashes.extend(map(hash, chunk))
+
+        # The lines that were left from the last render
+        del self.buffer[len(self.hashes):]
+        self.highlighted = [False] * len(self.hashes)
+
+    def lines_to_highlight(self, first, last):
+        """The lines between first and last (included) that weren't
+        highlighted since they were written. They count as highlighted after this"""
+
+        last = min(last, len(self.hashes) - 1)
+        lines = [line for line in range(first, last + 1) if not self.highlighted[line]]
+        for line in lines:
+            self.highlighted[line] = True
+
+        return lines
+
+
+def changed_ranges(old_lines, new_lines):
+    """The (old start, old end, new start, new end) ranges of lines
+    that are different, in order (The lines can be their hashes)"""
+
+    # The lines at the start and at the end that stayed the same
+    start = 0
+    limit = min(len(old_lines), len(new_lines))
+    while start < limit and old_lines[start] == new_lines[start]:
+        start += 1
+
+    old_end = len(old_lines)
+    new_end = len(new_lines)
+    while old_end > start and new_end > start and old_lines[old_end - 1] == new_lines[new_end - 1]:
+        old_end -= 1
+        new_end -= 1
+
+    if old_end == start and new_end == start:
+        return []
+
+    if (old_end - start) + (new_end - start) > max_lines_to_match:
+        return [(start, old_end, start, new_end)]
+
+    # There might be a few separate changes in between
+    matcher = SequenceMatcher(
+            None, old_lines[start:old_end], new_lines[start:new_end], autojunk=False)
+
+    return [(start + i1, start + i2, start + j1, start + j2)
+            for (tag, i1, i2, j1, j2) in matcher.get_opcodes()
+            if tag != "equal"]
@@ -1,16 +1,15 @@
 import ast
-from functools import reduce
-from banned_nodes import banned_nodes
+from indexed_tree import IndexedTree, children_of, is_child
+from history import History
+from folds import Folds
+import validity
 
 
 def list_children(ast_node):
-
-    # Filter out the banned nodes
-    # (They cause errors when navigating)
-    return list(filter(
-                lambda x : type(x) not in banned_nodes,
-                ast.iter_child_nodes(ast_node)
-            ))
+    # The banned nodes are filtered out (They cause errors when navigating)
+    # The list is cached until one of the node's fields change,
+    # so it must not be modified
+    return children_of(ast_node)
 
 
 def get_nth_children_wrapping_around(node, n):
@@ -19,16 +18,74 @@ def get_nth_children_wrapping_around(node, n):
     return children[n % length]
 
 
+def get_index(tree):
+    """Returns the IndexedTree of the tree, building it the first time"""
+
+    index = getattr(tree, "indexed_tree", None)
+
+    # A (shallow) copy of the tree would still have the original's index
+    if index is None or index.tree is not tree:
+        index = tree.indexed_tree = IndexedTree(tree)
+
+    return index
+
+
+def get_history(tree):
+    """Returns the undo History of the tree, creating it the first time"""
+
+    history = getattr(tree, "history", None)
+    if history is None:
+        history = tree.history = History()
+
+    return history
+
+
+def get_folds(tree):
+    """Returns the Folds of the tree, creating them the first time"""
+
+    folds = getattr(tree, "folds", None)
+    if folds is None:
+        folds = tree.folds = Folds()
+
+    return folds
+
+
 def get_node_at_cursor(cursor_trail, full_ast):
-    return reduce(
-            get_nth_children_wrapping_around,
-            cursor_trail,
-            full_ast
-            )
+    return get_index(full_ast).resolve(cursor_trail)
 
 
-def get_field_name_for_child(parent, child): 
-    
+def get_handle_at_cursor(cursor_trail, tree):
+    """Returns a handle for the selected node.
+    Unlike the cursor trail, it keeps pointing to the same node after
+    things are inserted or deleted around it"""
+
+    index = get_index(tree)
+    return index.handle_of(index.resolve(cursor_trail))
+
+
+def get_cursor_trail(handle, tree):
+    """Returns the cursor trail to the node with the handle
+    (The Module's if the node isn't in the tree anymore)"""
+
+    index = get_index(tree)
+    node = index.node_of(handle)
+    if node is None:
+        return []
+
+    return index.trail_of(node)
+
+
+def get_field_name_for_child(parent, child, tree=None):
+    """Returns (field_name, index) of where the child is in the parent.
+    The index is None if the field isn't a list.
+    If the parent is within the tree, pass the tree to make it a lookup
+    instead of going through all of the parent's fields"""
+
+    if tree is not None:
+        slot = get_index(tree).slot_of(parent, child)
+        if slot is not None:
+            return slot
+
     fields = list(ast.iter_fields(parent))
 
     for (field_name, field_content) in fields:
@@ -42,15 +99,10 @@ def get_field_name_for_child(parent, child):
 
 
 def is_valid_ast(tree):
-    """Make sure an ast is valid by trying to compile it"""
-     
-    try:
-        ast.fix_missing_locations(tree)
-        compiled = compile(tree, "<test-ast>", "exec")
-    except (SyntaxError, ValueError, TypeError) as e:
-        return (False, e)
-    
-    return (True, None)
+    """Make sure an ast is valid by trying to compile it.
+    Only the parts that changed since the last check are compiled again"""
+
+    return validity.check_module(tree, get_index(tree))
 
 
 def core_act(action, is_local, cursor_trail, ast, get_vim_input):
@@ -59,18 +111,26 @@ def core_act(action, is_local, cursor_trail, ast, get_vim_input):
 
     selected_node = get_node_at_cursor(cursor_trail, ast)
 
-    if is_local:
-        # In this case the action will modify the node
-        cursor_movement = action(selected_node, get_vim_input)
-    else:
-        # In this case the action modifies the ast and the cursor_trail
-        # For functions with access to the full cursor trail
-        # There is no point using the cursor_movement variable
-        action(cursor_trail, ast, get_vim_input)
-        cursor_movement = []
-
-    # Move the cursor according to the action
-    cursor_trail = cursor_trail + cursor_movement
+    # Whatever the action changes goes in the history as a single step
+    history = get_history(ast)
+    history.start_action(get_handle_at_cursor(cursor_trail, ast))
+
+    try:
+        if is_local:
+            # In this case the action will modify the node
+            cursor_movement = action(selected_node, get_vim_input)
+        else:
+            # In this case the action modifies the ast and the cursor_trail
+            # For functions with access to the full cursor trail
+            # There is no point using the cursor_movement variable
+            action(cursor_trail, ast, get_vim_input)
+            cursor_movement = []
+
+        # Move the cursor according to the action
+        cursor_trail = cursor_trail + cursor_movement
+
+    finally:
+        history.finish_action(get_handle_at_cursor(cursor_trail, ast))
     
     return (cursor_trail, ast)
 
@@ -88,29 +148,241 @@ def set_node_at_cursor(cursor_trail, ast, node):
     # Maybe fail better somehow
     field_name, index = get_field_name_for_child(
             parent,
-            child)
+            child,
+            ast)
+
+    replace_child(ast, parent, field_name, index, node)
+
+
+# The tree must only be changed through these functions (and set_node_at_cursor)
+# so that its index and its history stay up to date.
+# The ctx of what gets placed is fixed, unless fixing_context is False
+# (Undoing doesn't need to fix anything, it puts things back how they were)
+
+def set_field(tree, node, field_name, value, fixing_context=True):
+    index = get_index(tree)
+    index.about_to_change(node)
+
+    old_value = getattr(node, field_name, None)
+    setattr(node, field_name, value)
+
+    get_history(tree).record(("field", node, field_name, None, old_value))
+
+    # Things like the ctx and the op aren't children (They are banned nodes)
+    # so changing them doesn't move anything around
+    if not (is_child(old_value) or is_child(value)):
+        index.attribute_changed(node)
+        return
+
+    removed = old_value if isinstance(old_value, list) else [old_value]
+    index.children_changed(node, removed)
+
+    if fixing_context:
+        for child in (value if isinstance(value, list) else [value]):
+            fix_context_in_slot(tree, node, field_name, child)
+
+
+def replace_child(tree, parent, field_name, index, node, fixing_context=True):
+    """Puts the node in place of the child in the field
+    (at the index, if the field is a list)"""
 
     if index is not None:
         # In this case it was within a list
-        list = getattr(parent, field_name)
-        list[index] = node
+        child = getattr(parent, field_name)[index]
+    else:
+        child = getattr(parent, field_name)
+
+    # Actions that change the node in place (like making a comprehension async)
+    # put it back where it was, and that doesn't change anything
+    if child is node:
+        return
+
+    tree_index = get_index(tree)
+    tree_index.about_to_change(parent)
+
+    if index is not None:
+        getattr(parent, field_name)[index] = node
     else:
         setattr(parent, field_name, node)
 
+    tree_index.children_changed(parent, removed=[child])
+    tree_index.node_replaced(child, node)
+    get_history(tree).record(("replace", parent, field_name, index, child))
 
-def core_is_within(cursor_trail, tree, ast_node_type): 
-    # A Module isn't within anything
-    if cursor_trail == []:
-        return False
+    if fixing_context:
+        fix_context_in_slot(tree, parent, field_name, node)
+
+
+def insert_in_field(tree, node, field_name, index, child, fixing_context=True):
+    get_index(tree).about_to_change(node)
+    getattr(node, field_name).insert(index, child)
+    get_index(tree).children_changed(node, removed=[])
+    get_history(tree).record(("insert", node, field_name, index, None))
+
+    if fixing_context:
+        fix_context_in_slot(tree, node, field_name, child)
+
+
+def pop_from_field(tree, node, field_name, index):
+    get_index(tree).about_to_change(node)
+    removed = getattr(node, field_name).pop(index)
+    get_index(tree).children_changed(node, removed=[removed])
+    get_history(tree).record(("pop", node, field_name, index, removed))
+
+    return removed
+
+
+# The edits in the history are (kind, node, field_name, index, value)
+# where the value is what was there before (or what was popped)
 
-    parent = get_node_at_cursor(cursor_trail[:-1], tree)
+def revert_edit(tree, edit):
+    kind, node, field_name, index, value = edit
 
-    # We are within the ast_node_type if our parent is of the type
-    # or our parent itself is within the ast_node_type
+    if kind == "field":
+        set_field(tree, node, field_name, value, fixing_context=False)
+    elif kind == "replace":
+        replace_child(tree, node, field_name, index, value, fixing_context=False)
+    elif kind == "insert":
+        pop_from_field(tree, node, field_name, index)
+    elif kind == "pop":
+        insert_in_field(tree, node, field_name, index, value, fixing_context=False)
+
+
+def revert_edits(tree, edits):
+    """Reverts the edits (the last one first).
+    Returns the edits that revert the reverting"""
+
+    history = get_history(tree)
+
+    recording = history.recording
+    history.recording = []
+
+    for edit in reversed(edits):
+        revert_edit(tree, edit)
+
+    reverting_edits = history.recording
+    history.recording = recording
+
+    return reverting_edits
+
+
+def undo(tree):
+    """Reverts the last action that changed the tree.
+    Returns the handle of the node that was selected before it
+    (None if there is nothing to undo)"""
+
+    history = get_history(tree)
+    if not history.undo_stack:
+        return None
+
+    cursor_before, cursor_after, edits = history.pop_undo()
+    history.push_redo((cursor_before, cursor_after, revert_edits(tree, edits)))
+
+    return cursor_before
+
+
+def redo(tree):
+    """Performs again the last undone action.
+    Returns the handle of the node that was selected after it
+    (None if there is nothing to redo)"""
+
+    history = get_history(tree)
+    if not history.redo_stack:
+        return None
+
+    cursor_before, cursor_after, edits = history.pop_redo()
+    history.push_undo((cursor_before, cursor_after, revert_edits(tree, edits)))
+
+    return cursor_after
+
+
+# The ctx of an expression depends only on where it is placed:
+# Assignment targets are Store, del targets are Del
+# and pretty much everything else is Load.
+# Lists, tuples and starred expressions pass their own ctx down to their elements
+store_fields = {
+    (ast.Assign, "targets"),
+    (ast.AugAssign, "target"),
+    (ast.AnnAssign, "target"),
+    (ast.For, "target"),
+    (ast.AsyncFor, "target"),
+    (ast.comprehension, "target"),
+    (ast.withitem, "optional_vars"),
+    (ast.NamedExpr, "target"),
+}
+
+del_fields = {
+    (ast.Delete, "targets"),
+}
+
+inheriting_fields = {
+    (ast.List, "elts"),
+    (ast.Tuple, "elts"),
+    (ast.Starred, "value"),
+}
+
+
+def get_context_for_slot(parent, field_name):
+    """Returns the ctx class that a node in that field of the parent must have"""
+
+    slot = (type(parent), field_name)
+
+    if slot in inheriting_fields:
+        return type(parent.ctx)
+
+    if slot in store_fields:
+        return ast.Store
+
+    if slot in del_fields:
+        return ast.Del
+
+    return ast.Load
+
+
+def fix_context(tree, node, ctx_class):
+    """Gives the node the ctx, along with the elements that inherit it.
+    Stops as soon as a node already has the right ctx, because then
+    everything below it is already right too. So the cost is only the
+    amount of nodes whose ctx actually changes"""
+
+    to_fix = [node]
+    while to_fix:
+        node = to_fix.pop()
+
+        # Nodes that don't have a ctx don't pass it down either
+        if "ctx" not in node._fields:
+            continue
+
+        if type(getattr(node, "ctx", None)) == ctx_class:
+            continue
+
+        set_field(tree, node, "ctx", ctx_class())
+
+        if isinstance(node, ast.List) or isinstance(node, ast.Tuple):
+            to_fix.extend(node.elts)
+        elif isinstance(node, ast.Starred):
+            to_fix.append(node.value)
+
+
+def fix_context_in_slot(tree, parent, field_name, node):
+    """Fixes the ctx of a node that is (or is about to be) placed
+    in the field of the parent"""
+
+    if isinstance(node, ast.AST):
+        fix_context(tree, node, get_context_for_slot(parent, field_name))
+
+
+def get_ancestor_path(cursor_trail, tree):
+    """The ancestors of the selected node (and the fields we went through)
+    Built once for each cursor position and shared by all the checks below"""
+    return get_index(tree).ancestor_path(cursor_trail)
+
+
+def core_is_within(cursor_trail, tree, ast_node_type): 
+    # We are within the ast_node_type if any of our ancestors is of the type
+    # (A Module isn't within anything)
     # TODO: Consider using isinstance instead of comparing the type
-    return (type(parent) == ast_node_type
-            or core_is_within(cursor_trail[:-1], tree, ast_node_type)
-            )
+    return get_ancestor_path(cursor_trail, tree).is_within(ast_node_type)
 
 
 def core_is_within_field(cursor_trail, tree, ast_node_type, fieldname): 
@@ -118,21 +390,9 @@ def core_is_within_field(cursor_trail, tree, ast_node_type, fieldname):
     parent of the specified type
     """
 
-    # A Module isn't within anything
-    if cursor_trail == []:
-        return False
-
-    parent = get_node_at_cursor(cursor_trail[:-1], tree)
-    child = get_node_at_cursor(cursor_trail, tree)
-
-    # We are within the ast_node_type if our parent is of the type
-    # and the fieldname is the specified one
-    # or our parent itself is within the ast_node_type with the right field
-
-    return (
-            (isinstance(parent, ast_node_type) and get_field_name_for_child(parent, child)[0] == fieldname) 
-            or core_is_within_field(cursor_trail[:-1], tree, ast_node_type, fieldname)
-            )
+    # We are within the ast_node_type if any of our ancestors is of the type
+    # and we went through the specified field to get here from it
+    return get_ancestor_path(cursor_trail, tree).is_within_field(ast_node_type, fieldname)
 
 
 def core_is_not_in_context(cursor_trail, tree, ctx):
@@ -146,15 +406,8 @@ def core_is_in_context(cursor_trail, tree, ctx):
 def get_immediate_context(cursor_trail, tree):
     """Returns the context of the closer parent that has one"""
 
-    # A Module is definetly not in a context
-    if cursor_trail == []:
-        return None
-
-    selected_node = get_node_at_cursor(cursor_trail, tree)
-    if getattr(selected_node, "ctx", False):
-        return selected_node.ctx 
-    else:
-        return get_immediate_context(cursor_trail[:-1], tree)
+    # (A Module is definetly not in a context)
+    return get_ancestor_path(cursor_trail, tree).context
 
 
 def get_unique_name(initial_name, arguments) -> str:
@@ -175,17 +428,7 @@ def is_being_assigned_to(cursor_trail, tree):
     """Finds out if the selected expression is
     in the left side of an assignment"""
 
-    # The module is not being assigned to
-    if cursor_trail == []:
-        return False
-    
-    selected_node = get_node_at_cursor(cursor_trail, tree)
-    parent = get_node_at_cursor(cursor_trail[:-1], tree)
-
-    if isinstance(parent, ast.Assign):
-        # If the parent is the assignment, let's check if we are in it's left side
-        fieldname, index = get_field_name_for_child(parent, selected_node)
-        return fieldname == "targets"
-
-    else:
-        return is_being_assigned_to(cursor_trail[:-1], tree)
+    # If we are within an assignment, let's check if we are in it's left side
+    # (The module is not being assigned to)
+    path = get_ancestor_path(cursor_trail, tree)
+    return path.field_within_closest(ast.Assign) == "targets"
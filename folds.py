@@ -0,0 +1,65 @@
+import ast
+import weakref
+
+# The nodes that can be folded (The ones with a body)
+foldable_types = (
+        ast.FunctionDef,
+        ast.AsyncFunctionDef,
+        ast.ClassDef,
+        ast.If,
+        ast.For,
+        ast.AsyncFor,
+        ast.While,
+        ast.With,
+        ast.AsyncWith,
+        ast.Try,
+        )
+
+# The fields that aren't shown when a node is folded
+body_fields = ("body", "orelse", "handlers", "finalbody")
+
+
+class Folds:
+    """The nodes that are folded in the view (They are shown as a single
+    line, without their body, which doesn't get rendered at all).
+    Folding is only about how the tree is shown, so it's not an edit
+    and doesn't go in the undo history"""
+
+    def __init__(self):
+        # Weak, so the nodes removed from the tree don't stay alive in here
+        self.folded = weakref.WeakSet()
+
+    def __deepcopy__(self, memo):
+        # A copy of the tree starts with everything unfolded
+        return None
+
+    def __contains__(self, node):
+        return node in self.folded
+
+    def toggle(self, node, index):
+        if node in self.folded:
+            self.unfold(node, index)
+        else:
+            self.folded.add(node)
+            # So what was rendered from it gets rendered again
+            index.touch(node)
+
+    def unfold(self, node, index):
+        if node in self.folded:
+            self.folded.discard(node)
+            index.touch(node)
+
+    def hides(self, node, index):
+        """Whether the node is within the body of a folded node"""
+
+        if not self.folded:
+            return False
+
+        parent = index.parent_of(node)
+        while parent is not None:
+            if parent in self.folded and index.slot_of(parent, node)[0] in body_fields:
+                return True
+
+            node, parent = parent, index.parent_of(parent)
+
+        return False
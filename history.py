@@ -0,0 +1,101 @@
+import ast
+from collections import deque
+
+# How many nodes the undo history can hold on to before it starts
+# forgetting the oldest actions (see size_of)
+default_max_nodes = 200000
+
+
+class History:
+    """The undo and redo stacks of a tree.
+
+    Instead of snapshots of the whole tree, each action keeps the list
+    of the edits it made (see core_logic.set_field, replace_child,
+    insert_in_field and pop_from_field). Each edit only holds on to the
+    nodes it touched, so the memory it takes depends on the size of the
+    edits, not on the size of the file. But deleting a whole class keeps
+    the whole class, so the limit is on the nodes kept, not on the edits.
+
+    An action is (cursor_before, cursor_after, edits), where the cursors
+    are handles (see IndexedTree.handle_of). The stacks keep its size
+    along with it"""
+
+    def __init__(self, max_nodes=default_max_nodes):
+        self.max_nodes = max_nodes
+
+        self.undo_stack = deque()
+        self.redo_stack = []
+
+        # The size of the actions on both stacks
+        self.size = 0
+
+        # The edits of the action being performed
+        # (None when nothing is being recorded)
+        self.recording = None
+        self.cursor_before = None
+
+    def __deepcopy__(self, memo):
+        # A copy of the tree starts without history
+        return None
+
+    def record(self, edit):
+        if self.recording is not None:
+            self.recording.append(edit)
+
+    def start_action(self, cursor):
+        self.recording = []
+        self.cursor_before = cursor
+
+    def finish_action(self, cursor):
+        edits = self.recording
+        self.recording = None
+
+        # Moving the cursor around doesn't go in the history
+        if not edits:
+            return
+
+        self.push_undo((self.cursor_before, cursor, edits))
+
+        # A new change makes the undone ones unreachable
+        self.size -= sum(size for (action, size) in self.redo_stack)
+        self.redo_stack.clear()
+
+    def push_undo(self, action):
+        size = size_of(action[2])
+        self.undo_stack.append((action, size))
+        self.size += size
+
+        # Forget the oldest actions when it gets too big
+        # (But keep at least the last one)
+        while self.size > self.max_nodes and len(self.undo_stack) > 1:
+            self.size -= self.undo_stack.popleft()[1]
+
+    def push_redo(self, action):
+        size = size_of(action[2])
+        self.redo_stack.append((action, size))
+        self.size += size
+
+    def pop_undo(self):
+        action, size = self.undo_stack.pop()
+        self.size -= size
+        return action
+
+    def pop_redo(self):
+        action, size = self.redo_stack.pop()
+        self.size -= size
+        return action
+
+
+def size_of(edits):
+    """Roughly how much the edits keep alive: one for each edit, and one
+    for each node in what they took out of the tree"""
+
+    size = 0
+    for kind, node, field_name, index, value in edits:
+        size += 1
+
+        for removed in (value if isinstance(value, list) else [value]):
+            if isinstance(removed, ast.AST):
+                size += sum(1 for _ in ast.walk(removed))
+
+    return size
@@ -0,0 +1,398 @@
+import ast
+import itertools
+import weakref
+
+from banned_nodes import banned_nodes
+
+
+def iter_child_slots(node):
+    """Like ast.iter_child_nodes, but also tells where each child lives:
+    the field name, and the index if the field is a list (None otherwise).
+    The banned nodes are skipped, like in core_logic.list_children"""
+
+    for field_name, field_content in ast.iter_fields(node):
+        if isinstance(field_content, ast.AST):
+            if type(field_content) not in banned_nodes:
+                yield (field_content, field_name, None)
+
+        elif isinstance(field_content, list):
+            for index, item in enumerate(field_content):
+                if isinstance(item, ast.AST) and type(item) not in banned_nodes:
+                    yield (item, field_name, index)
+
+
+# node -> its list of children (without the banned ones)
+# It's weak so that the nodes removed from the tree don't stay alive in here
+children_cache = weakref.WeakKeyDictionary()
+
+
+def is_child(value):
+    """Whether putting the value in a field adds to the children of the node
+    (Lists always might)"""
+
+    if isinstance(value, list):
+        return True
+
+    return isinstance(value, ast.AST) and type(value) not in banned_nodes
+
+
+def children_of(node):
+    """Returns the cached list of children of the node.
+    The list is shared, so don't modify it"""
+
+    try:
+        return children_cache[node]
+    except KeyError:
+        children = [child for (child, _, _) in iter_child_slots(node)]
+        children_cache[node] = children
+        return children
+
+
+def forget_children(node):
+    """Must be called whenever a field of the node changes"""
+    children_cache.pop(node, None)
+
+
+class IndexedTree:
+    """Bookkeeping built once on top of the ast, so that finding the
+    selected node doesn't need to walk down from the Module
+    on every keystroke.
+
+    The changes to the tree must go through the functions in core_logic
+    (set_node_at_cursor, set_field, insert_in_field and pop_from_field),
+    otherwise the index gets out of date"""
+
+    def __init__(self, tree):
+        self.tree = tree
+
+        # node -> the node it is a child of
+        self.parents = {}
+        # node -> the index it has in the list of children of its parent
+        # (That is, what goes in the cursor trail to get to it)
+        self.positions = {}
+        # node -> (field_name, index) of where it is within its parent
+        # (The same thing core_logic.get_field_name_for_child finds)
+        self.slots = {}
+
+        # The last cursor trail that was resolved, and the nodes along it.
+        # resolved_nodes[0] is the Module and resolved_nodes[i + 1]
+        # is the node resolved_trail[i] points to
+        self.resolved_trail = []
+        self.resolved_nodes = [tree]
+
+        # The AncestorPath of the last cursor trail that asked for one
+        self.cached_path = None
+
+        # node -> the number of the last edit made within it.
+        # Things computed from a node can be reused while its version stays the same
+        # (Weak, so removed nodes don't stay alive, but still have their version
+        # in case they come back)
+        self.versions = weakref.WeakKeyDictionary()
+        self.edit_count = 0
+
+        # node -> handle and handle -> node
+        # A handle is a number that keeps pointing to the same node
+        # while it is moved around, unlike a cursor trail (The indexes in it
+        # point to different nodes after something is inserted or deleted)
+        # They are only given to the nodes that ask for one
+        self.handles = weakref.WeakKeyDictionary()
+        self.handle_nodes = weakref.WeakValueDictionary()
+        self.handle_counter = itertools.count()
+
+        # node -> the functions to call right before something within it changes
+        # (Weak references to them, so they don't keep their owners alive)
+        self.watchers = weakref.WeakKeyDictionary()
+
+        self.index_subtree(tree)
+
+    def __deepcopy__(self, memo):
+        # A copy of the tree gets its own index the first time it's used
+        # (Copying this one would take longer than building a new one)
+        return None
+
+    def index_subtree(self, node):
+        # Not recursive, so deeply nested code doesn't hit the recursion limit
+        to_index = [node]
+        while to_index:
+            to_index.extend(self.index_children(to_index.pop()))
+
+    def index_children(self, parent):
+        """(Re)computes the parent, position and slot of each child,
+        and returns the children that weren't indexed yet"""
+
+        not_indexed = []
+        for position, (child, field_name, index) in enumerate(iter_child_slots(parent)):
+            if child not in self.parents:
+                not_indexed.append(child)
+
+            # A child that was already indexed was moved here from somewhere
+            # else, so the index is still right for everything below it
+            self.parents[child] = parent
+            self.positions[child] = position
+            self.slots[child] = (field_name, index)
+
+        return not_indexed
+
+    def forget_subtree(self, node, parent):
+        to_forget = [(node, parent)]
+        while to_forget:
+            node, parent = to_forget.pop()
+
+            # If the node was moved to another parent it's still in the tree
+            if self.parents.get(node) is not parent:
+                continue
+
+            del self.parents[node]
+            del self.positions[node]
+            del self.slots[node]
+            to_forget.extend((child, node) for child in children_of(node))
+
+    def children_changed(self, parent, removed):
+        """Must be called after the children of parent change.
+        removed has whatever was taken out of the parent's fields"""
+
+        forget_children(parent)
+        self.cached_path = None
+        self.touch(parent)
+
+        for child in self.index_children(parent):
+            self.index_subtree(child)
+
+        # What was taken out might have been put back in the parent
+        # (like a field set to a list with some of the same nodes in it)
+        kept = {id(child) for child in children_of(parent)} if removed else ()
+
+        for node in removed:
+            if isinstance(node, ast.AST) and id(node) not in kept:
+                self.forget_subtree(node, parent)
+
+        # The resolved nodes below the parent might not be there anymore
+        for depth, resolved_node in enumerate(self.resolved_nodes):
+            if resolved_node is parent:
+                del self.resolved_trail[depth:]
+                del self.resolved_nodes[depth + 1:]
+                break
+
+    def watch(self, node, method):
+        """Calls the method (with the node) right before something
+        within the node changes. It's only called once"""
+        self.watchers.setdefault(node, []).append(weakref.WeakMethod(method))
+
+    def about_to_change(self, node):
+        """Must be called right before a field of the node changes"""
+
+        if not self.watchers:
+            return
+
+        while node is not None:
+            for weak_method in self.watchers.pop(node, []):
+                method = weak_method()
+                if method is not None:
+                    method(node)
+
+            node = self.parents.get(node)
+
+    def attribute_changed(self, node):
+        """Must be called after something that isn't a child
+        (like the ctx or a name) changes in a node"""
+
+        # The ancestor path has the closest ctx in it
+        self.cached_path = None
+        self.touch(node)
+
+    def touch(self, node):
+        """Gives a new version to the node and all of its ancestors"""
+
+        self.edit_count += 1
+        while node is not None:
+            self.versions[node] = self.edit_count
+            node = self.parents.get(node)
+
+    def version_of(self, node):
+        return self.versions.get(node, 0)
+
+    def resolve(self, cursor_trail):
+        """Returns the node the cursor trail points to, reusing as much
+        as possible of the last resolved trail"""
+
+        common = 0
+        limit = min(len(cursor_trail), len(self.resolved_trail))
+        while common < limit and cursor_trail[common] == self.resolved_trail[common]:
+            common += 1
+
+        # Asking for an ancestor of the last resolved node
+        # (like validators do all the time) is just a lookup
+        if common == len(cursor_trail):
+            return self.resolved_nodes[common]
+
+        del self.resolved_trail[common:]
+        del self.resolved_nodes[common + 1:]
+
+        node = self.resolved_nodes[-1]
+        for n in cursor_trail[common:]:
+            children = children_of(node)
+            node = children[n % len(children)]
+
+            self.resolved_trail.append(n)
+            self.resolved_nodes.append(node)
+
+        return node
+
+    def ancestor_path(self, cursor_trail):
+        """Returns the AncestorPath for the cursor trail.
+        It's only built once for each cursor position
+        (and again after the tree changes)"""
+
+        path = self.cached_path
+        if path is None or path.cursor_trail != cursor_trail:
+            path = self.cached_path = AncestorPath(self, cursor_trail)
+
+        return path
+
+    def handle_of(self, node):
+        handle = self.handles.get(node)
+        if handle is None:
+            handle = self.handles[node] = next(self.handle_counter)
+            self.handle_nodes[handle] = node
+
+        return handle
+
+    def node_of(self, handle):
+        """Returns the node with the handle, or None if it isn't in the tree anymore"""
+
+        node = self.handle_nodes.get(handle)
+        if node is None or not self.contains(node):
+            return None
+
+        return node
+
+    def contains(self, node):
+        # Only the nodes within the tree have a parent in the index
+        return node in self.parents or node is self.tree
+
+    def trail_of(self, node):
+        """Returns the cursor trail that points to the node
+        (None if the node isn't in the tree).
+        It goes up from the node, so it takes as long as the node is deep"""
+
+        trail = []
+        while node is not self.tree:
+            position = self.positions.get(node)
+            if position is None:
+                return None
+
+            trail.append(position)
+            node = self.parents[node]
+
+        trail.reverse()
+        return trail
+
+    def node_replaced(self, old_node, new_node):
+        """Hands the handle of a node that was taken out of the tree
+        to the node that took its place, so marks on it follow the replacement"""
+
+        handle = self.handles.get(old_node)
+        if (handle is None
+                or old_node in self.parents
+                or new_node in self.handles):
+            return
+
+        del self.handles[old_node]
+        self.handles[new_node] = handle
+        self.handle_nodes[handle] = new_node
+
+    def parent_of(self, node):
+        return self.parents.get(node)
+
+    def position_of(self, node):
+        return self.positions.get(node)
+
+    def slot_of(self, parent, child):
+        """Returns the (field_name, index) of the child within the parent,
+        or None if the index doesn't know about the child being there"""
+
+        if self.parents.get(child) is not parent:
+            return None
+
+        return self.slots[child]
+
+
+class AncestorPath:
+    """The nodes from the Module down to the selected one,
+    along with the field each step went through and the closest ctx.
+    The within and context checks answer from it instead of resolving
+    every prefix of the cursor trail again"""
+
+    def __init__(self, index, cursor_trail):
+        self.cursor_trail = list(cursor_trail)
+
+        index.resolve(cursor_trail)
+        # nodes[0] is the Module and nodes[-1] the selected node
+        self.nodes = index.resolved_nodes[:len(cursor_trail) + 1]
+
+        # fields[i] is the field of nodes[i] that has nodes[i + 1] in it
+        self.fields = []
+        for parent, child in zip(self.nodes, self.nodes[1:]):
+            slot = index.slot_of(parent, child)
+            if slot is None:
+                # The index doesn't know where it is (It might be in more
+                # than one place), so look for it
+                slot = next((field_name, i) for (node, field_name, i)
+                            in iter_child_slots(parent) if node is child)
+
+            self.fields.append(slot[0])
+
+        # The ctx of the closest node that has one (The Module doesn't count)
+        self.context = None
+        for node in reversed(self.nodes[1:]):
+            ctx = getattr(node, "ctx", False)
+            if ctx:
+                self.context = ctx
+                break
+
+        self.selected_type = type(self.nodes[-1])
+        self.context_type = type(self.context)
+
+        # Only computed if something asks for the signature
+        self.ancestor_types = None
+        self.ancestor_fields = None
+        self.cached_signature = None
+
+    def signature(self):
+        """Everything about the path that the validators look at.
+        Paths with the same signature pass the same validators"""
+
+        if self.cached_signature is None:
+            self.ancestor_types = frozenset(map(type, self.nodes[:-1]))
+            self.ancestor_fields = frozenset(
+                    (type(node), field) for (node, field) in self.ancestors())
+
+            self.cached_signature = (
+                    self.selected_type,
+                    self.ancestor_types,
+                    self.ancestor_fields,
+                    self.context_type,
+                    )
+
+        return self.cached_signature
+
+    def ancestors(self):
+        """The (ancestor, field) pairs, from the parent up to the Module"""
+        return zip(reversed(self.nodes[:-1]), reversed(self.fields))
+
+    def is_within(self, ast_node_type):
+        return any(type(node) == ast_node_type for node in self.nodes[:-1])
+
+    def is_within_field(self, ast_node_type, fieldname):
+        return any(isinstance(node, ast_node_type) and field == fieldname
+                   for (node, field) in self.ancestors())
+
+    def field_within_closest(self, ast_node_type):
+        """The field we are under in the closest ancestor of the type
+        (None if there isn't one)"""
+
+        for node, field in self.ancestors():
+            if isinstance(node, ast_node_type):
+                return field
+
+        return None
@@ -0,0 +1,127 @@
+import time
+from contextlib import contextmanager
+
+# A keystroke under this much of the budget leaves room for better rendering
+headroom = 0.5
+
+# How many keystrokes in a row have to be within the headroom
+# before a cheaper mode is turned off again
+keystrokes_to_recover = 30
+
+
+class LatencyBudget:
+    """Times the stages of each keystroke (like resolving the cursor,
+    validating the action, changing the tree or rendering), and when a
+    keystroke takes longer than the budget, turns on the next of the
+    cheaper modes. After enough keystrokes with room to spare, the last
+    mode that was turned on is turned off again. Every switch is logged
+    with the reason for it.
+
+    The modes go from the one that costs the least quality to turn on
+    to the one that costs the most"""
+
+    def __init__(self, budget_seconds, modes, log=print):
+        # None means there's no budget, and nothing gets switched
+        self.budget = budget_seconds
+        self.modes = modes
+        self.log = log
+
+        # How many of the modes are on (the first ones)
+        self.level = 0
+
+        # stage -> seconds it took in the current keystroke
+        self.times = {}
+        # The times of the last keystroke that finished
+        self.last_times = {}
+
+        # How many keystrokes in a row were within the headroom
+        self.fast_keystrokes = 0
+
+    def is_on(self, mode):
+        return mode in self.modes[:self.level]
+
+    def start(self):
+        self.times = {}
+
+    @contextmanager
+    def stage(self, name):
+        # (The time of the stages timed within this one isn't counted twice)
+        others_before = sum(self.times.values())
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            others = sum(self.times.values()) - others_before
+            self.record(name, time.perf_counter() - start - others)
+
+    def timed(self, name, iterable):
+        """Gives what the iterable gives, timing how long it takes
+        to make the items as the stage (like rendering lines as
+        they are written)"""
+
+        iterator = iter(iterable)
+        seconds = 0
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    seconds += time.perf_counter() - start
+
+                yield item
+        finally:
+            self.record(name, seconds)
+
+    def record(self, name, seconds):
+        self.times[name] = self.times.get(name, 0) + seconds
+
+    def finish(self, rendered=True):
+        """Switches a mode if the keystroke went over the budget, or if it
+        had room to spare for long enough. Only the keystrokes that rendered
+        count for turning them off, moving the cursor around is always cheap"""
+
+        self.last_times = self.times
+        if self.budget is None:
+            return
+
+        total = sum(self.times.values())
+
+        if total > self.budget:
+            self.fast_keystrokes = 0
+            if self.level < len(self.modes):
+                slowest = max(self.times, key=self.times.get)
+                self.switch(+1, f"a keystroke took {total * 1000:.1f}ms "
+                                f"({slowest} took {self.times[slowest] * 1000:.1f}ms)")
+
+        elif total < self.budget * headroom and rendered:
+            self.fast_keystrokes += 1
+            if self.fast_keystrokes >= keystrokes_to_recover and self.level > 0:
+                self.fast_keystrokes = 0
+                self.switch(-1, f"the last {keystrokes_to_recover} keystrokes took "
+                                f"less than {self.budget * headroom * 1000:.1f}ms")
+
+        elif rendered:
+            self.fast_keystrokes = 0
+
+    def switch(self, direction, reason):
+        if direction > 0:
+            mode = self.modes[self.level]
+            self.level += 1
+        else:
+            self.level -= 1
+            mode = self.modes[self.level]
+
+        state = "on" if direction > 0 else "off"
+        self.log(f"{time.strftime('%H:%M:%S')} {mode} {state}: {reason} "
+                 f"(the budget is {self.budget * 1000:.0f}ms)")
+
+    def report(self):
+        """How long each stage of the last keystroke took"""
+
+        stages = ", ".join(f"{name} {seconds * 1000:.1f}ms"
+                           for (name, seconds) in self.last_times.items())
+        modes = ", ".join(self.modes[:self.level]) or "none"
+        return f"{stages} (cheaper modes on: {modes})"
@@ -17,16 +17,165 @@ sys.path.append(current_folder)
 
 # Finally import it
 from core_logic import *
+from history import History
+from buffer_writer import BufferWriter
+from prerender import Prerenderer
+from latency_budget import LatencyBudget
 import actions
 import renderer
+import validators
 
 
-def render_view_to_buffer():
-    selected_node = get_node_at_cursor(cursor_trail, ast)
-    rendered_text = renderer.render_view(ast, selected_node, adjust_width(window.width))
+def render_view_to_buffer(move_cursor=True):
+    global cursor_in_text
 
-    # Write the text to the buffer
-    buffer[:] = rendered_text.split("\n")
+    selected_node = current_node()
+
+    # If the renderer knows where the node ends up, the cursor is a
+    # highlight on top of the text, otherwise it goes in the text itself
+    with latency_budget.stage("cursor"):
+        span = renderer.span_of(ast, selected_node)
+    cursor_in_text = span is None
+
+    width = view_width()
+    shown_lines = viewport()
+
+    # The view might have been rendered while vim was waiting for the key
+    lines = None
+    if cursor_in_text:
+        lines = prerenderer.view_of(ast, selected_node, width, shown_lines)
+
+    if lines is None:
+        lines = renderer.render_view_lines(
+                ast,
+                selected_node if cursor_in_text else None,
+                width,
+                shown_lines)
+
+    # Only the lines that changed get written
+    # (The lines are rendered as they are written, but they're timed apart)
+    with latency_budget.stage("write"):
+        buffer_writer.write(latency_budget.timed("render", lines))
+
+    if ast_highlighting:
+        if latency_budget.is_on("deferred_highlighting"):
+            vim.command("call timer_start(0, 'HighlightLater')")
+        else:
+            with latency_budget.stage("highlight"):
+                highlight_shown_lines()
+
+    with latency_budget.stage("cursor"):
+        show_cursor(span, move_cursor)
+
+    # Moving the cursor only needs a new view if the cursor is in the text
+    if speculative_rendering and cursor_in_text:
+        prerenderer.start(ast, get_cursor_trail(cursor, ast), width, shown_lines)
+        vim.command("call timer_start(0, 'PrerenderNext')")
+    else:
+        prerenderer.forget()
+
+
+def prerender_next():
+    """Renders one of the views the next cursor movement might need,
+    and leaves the rest for later if there are more (see Prerenderer).
+    It stops if there's a key waiting, so it never makes it wait"""
+
+    if int(vim.eval("getchar(1)")):
+        return
+
+    if prerenderer.render_next(ast, view_width(), viewport()):
+        vim.command("call timer_start(0, 'PrerenderNext')")
+
+
+def highlight_shown_lines():
+    highlight(*(viewport() or (0, len(buffer_writer.hashes) - 1)))
+
+
+def window_scrolled():
+    # Only the lines around the window are rendered, so there are new ones to render
+    if viewport() is not None:
+        # (It's timed on its own, not as part of the last keystroke)
+        latency_budget.start()
+
+        # (Without moving the cursor, or it would scroll back)
+        render_view_to_buffer(move_cursor=False)
+        latency_budget.finish()
+
+
+def highlight(first_line, last_line):
+    """Highlights the lines between first_line and last_line (from 0)
+    that changed since they were last highlighted, with the tokens the
+    renderer found in them (see renderer.tokens_of_line)"""
+
+    line_numbers = []
+    tokens = []
+    for line in buffer_writer.lines_to_highlight(first_line, last_line):
+        line_numbers.append(line + 1)
+
+        # Lines with the cursor markers (or blank lines outside
+        # of the viewport) don't have the text the tokens are for
+        line_tokens = renderer.tokens_of_line(ast, line)
+        if line_tokens is None or hash(line_tokens[0]) != buffer_writer.hashes[line]:
+            continue
+
+        tokens.extend([line + 1, start + 1, end + 1, category]
+                      for (start, end, category) in line_tokens[1]
+                      if category in highlighted_categories)
+
+    if line_numbers:
+        ast_highlight(buffer.number, line_numbers, tokens)
+
+
+def show_cursor(span, move_cursor=True):
+    """Highlights the span of the selected node (if there's one)
+    and moves the vim cursor to its start"""
+
+    global cursor_match
+
+    if cursor_match is not None:
+        vim.command(f"silent! call matchdelete({cursor_match}, {window_id})")
+        cursor_match = None
+
+    if span is None:
+        return
+
+    cursor_match = int(vim.eval(f"matchadd(g:cursor_highlight, '{span_pattern(span)}', "
+                                f"10, -1, {{'window': {window_id}}})"))
+
+    if move_cursor:
+        window.cursor = (span[0] + 1, span[1])
+
+
+def span_pattern(span):
+    """A vim pattern that matches the characters in the span"""
+
+    # Vim counts lines and columns from 1, and \%>Nc means after column N
+    start_line, start_column, end_line, end_column = span
+    start_line += 1
+    end_line += 1
+
+    if start_line == end_line:
+        return rf"\%{start_line}l\%>{start_column}c\%<{end_column + 1}c."
+
+    return (rf"\%{start_line}l\%>{start_column}c."
+            + rf"\|\%>{start_line}l\%<{end_line}l."
+            + rf"\|\%{end_line}l\%<{end_column + 1}c.")
+
+
+def viewport():
+    """The lines shown in the window (from 0), with a window's
+    worth of margin on each side. None if g:viewport_rendering is off
+    (and the latency budget didn't turn it on)"""
+
+    if not (int(vim.eval("g:viewport_rendering"))
+            or latency_budget.is_on("viewport_only")):
+        return None
+
+    # (The editor's window, which might not be the current one)
+    first_line = int(vim.eval(f"line('w0', {window_id})")) - 1
+    last_line = int(vim.eval(f"line('w$', {window_id})")) - 1
+
+    return (max(0, first_line - window.height), last_line + window.height)
 
 
 def get_vim_input(message):
@@ -37,7 +186,7 @@ def get_vim_input(message):
 
 
 def current_node():
-    return get_node_at_cursor(cursor_trail, ast)
+    return get_node_at_cursor(get_cursor_trail(cursor, ast), ast)
 
 
 def save():
@@ -46,6 +195,25 @@ def save():
         f.write(renderer.render_standard(ast))
 
 
+def compare_backends():
+    """Prints how long each renderer takes on the current buffer,
+    and whether what it would save parses back to the same code"""
+
+    for (name, view_seconds, save_seconds, round_trips) in renderer.time_backends(
+            ast, adjust_width(window.width)):
+
+        print(f"{name}: view {view_seconds * 1000:.0f}ms, save {save_seconds * 1000:.0f}ms"
+              + ("" if round_trips else ", doesn't round trip"))
+
+
+def view_width():
+    # Laying out the lines to fit the window takes a while in some renderers
+    if latency_budget.is_on("flat_layout"):
+        return float("inf")
+
+    return adjust_width(window.width)
+
+
 def adjust_width(window_width):
     """Subtracts the width by 3 in case the numbers option is set,
     because the line numbers takes 3 columns from the screen's space"""
@@ -60,42 +228,133 @@ def adjust_width(window_width):
 def act(action_name):
 
     # Make reassigning these variables work
-    global cursor_trail
+    global cursor
     global ast
 
     action, is_local = actions.actions[action_name]
-    
-    cursor_trail, ast = core_act(
-                action,
-                is_local,
-                cursor_trail,
-                ast,
-                get_vim_input
-            )
+
+    tree_before = ast
+    edit_count_before = get_index(ast).edit_count
+
+    latency_budget.start()
+
+    with latency_budget.stage("resolve"):
+        cursor_trail = get_cursor_trail(cursor, ast)
+
+    # (The validators the action runs are timed apart, as the "validate" stage)
+    with latency_budget.stage("mutate"):
+        cursor_trail, ast = core_act(
+                    action,
+                    is_local,
+                    cursor_trail,
+                    ast,
+                    get_vim_input
+                )
+
+        cursor = get_handle_at_cursor(cursor_trail, ast)
+
+    # Just moving the cursor around doesn't need to render anything
+    # (Unless the cursor is in the text)
+    if (ast is tree_before
+            and get_index(ast).edit_count == edit_count_before
+            and not cursor_in_text):
+
+        with latency_budget.stage("cursor"):
+            span = renderer.span_of(ast, current_node())
+            if span is not None:
+                show_cursor(span)
+
+        if span is not None:
+            latency_budget.finish(rendered=False)
+            return
 
     render_view_to_buffer()
+    latency_budget.finish()
 
 
 # It's important to save the buffer because the currently selected buffer
 # might stop being the python code one
 # Useful info: https://vimhelp.org/if_pyth.txt.html#python-buffer
 window = vim.current.window
+# (For the vim functions that take a window, it doesn't change like its number)
+window_id = int(vim.eval("win_getid()"))
 buffer = vim.current.buffer
 filename = buffer.name
 
+# Writes the view to the buffer, remembering what's there
+buffer_writer = BufferWriter(buffer)
+
+# Whether the view is highlighted with the tokens the renderer finds
+# (Instead of vim's syntax highlighting, see plugin.vim)
+ast_highlighting = int(vim.eval("g:ast_highlighting"))
+highlighted_categories = set(vim.eval("keys(g:ast_highlight_groups)"))
+ast_highlight = vim.Function("AstHighlight")
+
+# What renders the view and the saved file (see renderer.backends)
+renderer.use_backends(vim.eval("g:view_backend"), vim.eval("g:save_backend"))
+
+# The other renderers don't know the tokens, so vim highlights the view
+if ast_highlighting and not renderer.view_knows_spans():
+    vim.command("setlocal syntax=python")
+    ast_highlighting = 0
+
+# Renders the views around the cursor while vim waits for a key
+# (Only when the cursor is in the text, otherwise moving doesn't render)
+prerenderer = Prerenderer()
+speculative_rendering = int(vim.eval("g:speculative_rendering"))
+
+# Keeps the keystrokes within g:latency_budget_ms, by switching to
+# cheaper ways of rendering when they take longer (0 means no budget)
+cheaper_modes = []
+if ast_highlighting:
+    cheaper_modes.append("deferred_highlighting")
+if (not int(vim.eval("g:viewport_rendering"))
+        and int(vim.eval("exists('##WinScrolled')"))):
+    cheaper_modes.append("viewport_only")
+if renderer.view_uses_width():
+    cheaper_modes.append("flat_layout")
+
+latency_budget = LatencyBudget(
+        int(vim.eval("g:latency_budget_ms")) / 1000 or None,
+        cheaper_modes)
+validators.time_checks_with(latency_budget.stage)
+
+# Big modules are saved in as many processes as there are cpus (by default)
+renderer.save_in_processes(int(vim.eval("g:save_processes")) or os.cpu_count() or 1)
+
+# The huge literals are only shown in full when the cursor goes into them
+renderer.elide_beyond(
+        int(vim.eval("g:max_shown_elements")),
+        int(vim.eval("g:max_shown_characters")))
+
 # The original ast
 ast = ast.parse("\n".join(buffer[:]))
 
+# Index it once, so that getting to the selected node
+# doesn't need to walk down from the Module every time
+get_index(ast)
+
+# The undo history, which forgets the oldest actions
+# when they hold on to more than g:undo_max_nodes nodes
+ast.history = History(max_nodes=int(vim.eval("g:undo_max_nodes")))
+
 # Set the initial action state dict
 # Stores stuff like the copy and pasted node
 ast.states_for_actions = {}
 
-# Set the initial view
-buffer[:] = renderer.render_view(ast, ast, adjust_width(window.width)).split("\n")
-
-# Stores the path to the editing cursor
+# The selected node (A handle to it, see IndexedTree.handle_of)
+# The actions get the path to it (the cursor trail) when they run:
 # An int n means the nth child of the current node
 # n is used modulo the number of children, so negative number and huge
 # numbers are allowed (They will wrap around)
-cursor_trail = []
+cursor = get_handle_at_cursor([], ast)
+
+# The id of the match that highlights the selected node (None if there's none)
+cursor_match = None
+# Whether the cursor is rendered in the text (with <<< and >>>)
+# instead of highlighted
+cursor_in_text = False
+
+# Set the initial view
+render_view_to_buffer()
 
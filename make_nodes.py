@@ -43,6 +43,16 @@ def make_node(node_name):
     return (action, False)
 
 
+def can_make(node_name):
+    """Returns a validator that tells if the make_ action for the node
+    would do something at the cursor"""
+
+    validator, creator = nodes[node_name]
+
+    # Never touch the module
+    return v.validate_both(v.is_not_instance_of(ast.Module), validator)
+
+
 def make_class():
     """ClassDef(identifier name,
              expr* bases,
@@ -184,7 +194,7 @@ def make_attribute(cursor_trail, tree):
     parent = core_logic.get_node_at_cursor(cursor_trail[:-1], tree)
     if isinstance(parent, ast.AnnAssign):
         # TODO: Can we use False? (The grammar says int)
-        parent.simple = 0
+        core_logic.set_field(tree, parent, "simple", 0)
 
     # Get the context from the node that was already here
     ctx = getattr(selected_expr, "ctx", ast.Load())
@@ -200,7 +210,7 @@ def make_attribute(cursor_trail, tree):
 
     # Set it's new context if the child was an expression
     if selected_expr is not None:
-        recursively_fix_context(generated_attribute, selected_expr)
+        core_logic.fix_context_in_slot(tree, generated_attribute, "value", selected_expr)
 
     return generated_attribute
 
@@ -349,7 +359,7 @@ def make_async(cursor_trail, tree):
 
     if isinstance(definition, ast.comprehension):
         # Toggle the async
-        definition.is_async = 0 if definition.is_async == 1 else 1
+        core_logic.set_field(tree, definition, "is_async", 0 if definition.is_async == 1 else 1)
         return definition
 
 
@@ -419,7 +429,7 @@ def make_tuple(cursor_trail, tree):
     created_tuple = ast.Tuple(elts=elts, ctx=ctx) 
 
     if selected_expr is not None: 
-        recursively_fix_context(created_tuple, selected_expr)
+        core_logic.fix_context_in_slot(tree, created_tuple, "elts", selected_expr)
 
     return created_tuple
 
@@ -438,7 +448,7 @@ def make_list(cursor_trail, tree):
 
     # If we have children, fix their contexts
     if selected_expr is not None:
-        recursively_fix_context(created_list, selected_expr)
+        core_logic.fix_context_in_slot(tree, created_list, "elts", selected_expr)
 
     return created_list
 
@@ -454,7 +464,7 @@ def make_subscript(cursor_trail, tree):
     selected_expr = selected_expr if isinstance(selected_expr, ast.expr) else make_expression()
 
     subscript = ast.Subscript(value=selected_expr, slice=make_slice(), ctx=ctx)
-    recursively_fix_context(subscript, selected_expr)
+    core_logic.fix_context_in_slot(tree, subscript, "value", selected_expr)
 
     return subscript
 
@@ -468,16 +478,6 @@ def make_slice():
     return ast.Index(value=ast.Constant(value=0))
 
 
-def recursively_fix_context(parent, node):
-    # Fix the node's ctx
-    node.ctx = get_context_for_child(parent, node)()
-
-    # Fix the node's children's ctx
-    for child in core_logic.list_children(node):
-        if hasattr(child, "ctx"):
-            recursively_fix_context(node, child)
-
-
 def make_name(cursor_trail, tree):
     """Name(identifier id, expr_context ctx).
     This function must be dependent because of the context
@@ -489,30 +489,6 @@ def make_name(cursor_trail, tree):
     return ast.Name(id="x", ctx=ctx)
 
 
-# TODO: Move this to core_logic
-def get_context_for_child(parent, child):
-    parent_ctx = getattr(parent, "ctx", None)
-    if isinstance(parent_ctx, ast.Load):
-        return ast.Load
-
-    if parent_ctx is None:
-        # TODO: Named Expressions too i think
-        print("parent is none")
-        if isinstance(parent, ast.Assign) and core_logic.get_field_name_for_child(parent, child) == "targets":
-            return ast.Store
-        else:
-            return ast.Load
-
-    if isinstance(parent, ast.Attribute): return ast.Load
-    if isinstance(parent, ast.Subscript): return ast.Load
-    if isinstance(parent, ast.List): return type(parent_ctx)
-    if isinstance(parent, ast.Tuple): return type(parent_ctx)
-    if isinstance(parent, ast.Starred): return type(parent_ctx)
-
-    # Unknown context otherwise
-    # (Just return None)
-
-
 def make_string(get_user_input):
     string = get_user_input("str: ")
     return ast.Constant(value=string, kind=None)
@@ -2,6 +2,16 @@ import ast
 
 import core_logic
 import make_nodes
+import validators as v
+
+
+# The binary operations, comparisons and boolean operations
+# can be turned into each other, so all of them apply to the same nodes
+can_change_operation = v.validate_one_of(
+        v.is_instance_of(ast.BinOp),
+        v.is_instance_of(ast.Compare),
+        v.is_instance_of(ast.BoolOp),
+        )
 
 
 # TODO: Handle nested comparisons using the lists 
@@ -33,7 +43,7 @@ def to_operation(new_operation):
             return 
 
         # Set the operation to an instance of the supplied class
-        selected_node.op = new_operation()
+        core_logic.set_field(tree, selected_node, "op", new_operation())
 
     # (function, is_local?)
     return (change_operation, False)
@@ -70,7 +80,7 @@ def to_comparison(new_comparison):
             return
 
         # Set the operation to an instance of the supplied class
-        selected_node.ops = [new_comparison()]
+        core_logic.set_field(tree, selected_node, "ops", [new_comparison()])
 
     return (change_comparison, False)
 
@@ -104,7 +114,7 @@ def to_bool_op(new_bool_op):
 
 
         # Set the operation to an instance of the supplied class
-        selected_node.op = new_bool_op()
+        core_logic.set_field(tree, selected_node, "op", new_bool_op())
 
     # The false means it's not a local action
     return (change_bool_op, False)
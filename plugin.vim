@@ -5,15 +5,148 @@ endif
 
 " The path of the main python file
 let g:path = fnamemodify(resolve(expand('<sfile>:p')), ':h') . '/main.py'
+
+" How many nodes the undo history can hold on to, counting the ones
+" the edits took out of the tree (The oldest actions are forgotten first)
+if !exists('g:undo_max_nodes')
+  let g:undo_max_nodes = 200000
+endif
+
+" How the selected node is highlighted
+if !exists('g:cursor_highlight')
+  let g:cursor_highlight = 'Visual'
+endif
+
+" Only render the statements around the window (The rest are blank lines
+" until they are scrolled to, so it needs vim to tell when that happens)
+if !exists('g:viewport_rendering')
+  let g:viewport_rendering = exists('##WinScrolled')
+endif
+
+" What renders the view and what renders the saved file: astor, strender
+" or unparse (With python 3.9+). :CompareBackends times them on the buffer
+if !exists('g:view_backend')
+  let g:view_backend = 'astor'
+endif
+
+if !exists('g:save_backend')
+  let g:save_backend = 'astor'
+endif
+
+" While waiting for a key, render the views that moving the cursor would show
+" (Only needed when the cursor can't be shown as a highlight)
+if !exists('g:speculative_rendering')
+  let g:speculative_rendering = has('timers')
+endif
+
+" How many processes render the file when saving a big module
+" (0 is one for each cpu, 1 renders it in vim's process)
+if !exists('g:save_processes')
+  let g:save_processes = 0
+endif
+
+" How long a keystroke can take, in milliseconds. When they take longer,
+" cheaper ways of rendering get turned on until there's room again
+" (They are logged in :messages, and :LatencyReport shows the last keystroke)
+if !exists('g:latency_budget_ms')
+  let g:latency_budget_ms = 16
+endif
+
+" How many elements of a list, tuple, set or dict and how many characters
+" of a string are shown, unless the cursor is in them (0 shows them whole)
+if !exists('g:max_shown_elements')
+  let g:max_shown_elements = 50
+endif
+
+if !exists('g:max_shown_characters')
+  let g:max_shown_characters = 5000
+endif
+
+" Highlight the view with the tokens the renderer finds in it, instead
+" of vim's syntax highlighting (Only the lines that change get highlighted again)
+if !exists('g:ast_highlighting')
+  let g:ast_highlighting = has('textprop')
+endif
+
+" The highlight group for each kind of token (The ones not in here aren't highlighted)
+if !exists('g:ast_highlight_groups')
+  let g:ast_highlight_groups = {
+        \ 'keyword': 'Statement',
+        \ 'definition': 'Function',
+        \ 'string': 'String',
+        \ 'number': 'Number',
+        \ 'operator': 'Operator',
+        \ }
+endif
+
+if g:ast_highlighting
+  setlocal syntax=OFF
+
+  for [s:category, s:group] in items(g:ast_highlight_groups)
+    " (Without syntax highlighting on, the groups might not be there yet)
+    if !hlexists(s:group)
+      execute 'highlight default ' . s:group . ' term=NONE'
+    endif
+
+    if empty(prop_type_get('ast_' . s:category))
+      call prop_type_add('ast_' . s:category, {'highlight': s:group})
+    endif
+  endfor
+endif
+
+function! HighlightLater(timer)
+  py3 highlight_shown_lines()
+endfunction
+
+function! PrerenderNext(timer)
+  py3 prerender_next()
+endfunction
+
+" Replaces the highlighting of the lines of the buffer with the tokens,
+" which are [line, start column, end column, category] (Counting from 1)
+function! AstHighlight(buffer, lines, tokens)
+  for l:line in a:lines
+    call prop_clear(l:line, l:line, {'bufnr': a:buffer})
+  endfor
+
+  for [l:line, l:start, l:end, l:category] in a:tokens
+    call prop_add(l:line, l:start,
+          \ {'end_col': l:end, 'type': 'ast_' . l:category, 'bufnr': a:buffer})
+  endfor
+endfunction
 " echo g:path
 
 execute 'py3file ' . g:path
 
+" Only for the editor's buffer, and in a group so sourcing the plugin
+" again for the same buffer doesn't add them twice
+augroup ast_editor
+  autocmd! * <buffer>
+
+  " The view is laid out again for the new width
+  " (The renderer keeps what it built, so only the line breaks change)
+  autocmd VimResized <buffer> py3 render_view_to_buffer(move_cursor=False)
+  autocmd OptionSet <buffer>
+        \ if index(['number', 'relativenumber'], expand('<amatch>')) >= 0 |
+        \   exec 'py3 render_view_to_buffer(move_cursor=False)' |
+        \ endif
+  if exists('##WinResized')
+    autocmd WinResized <buffer> py3 render_view_to_buffer(move_cursor=False)
+  endif
+
+  " (The latency budget might turn viewport rendering on later)
+  if exists('##WinScrolled')
+    autocmd WinScrolled <buffer> py3 window_scrolled()
+  endif
+augroup END
+
 command! -buffer -nargs=0 CursorDown exec 'py3 act("cursor_down")'
 command! -buffer -nargs=0 CursorUp exec 'py3 act("cursor_up")'
 command! -buffer -nargs=0 CursorLeft exec 'py3 act("cursor_left")'
 command! -buffer -nargs=0 CursorRight exec 'py3 act("cursor_right")'
 command! -buffer -nargs=0 Save exec 'py3 save()'
+command! -buffer -nargs=0 CompareBackends exec 'py3 compare_backends()'
+command! -buffer -nargs=0 LatencyReport exec 'py3 print(latency_budget.report())'
 
 " Actions
 command! -buffer -nargs=0 Rename exec 'py3 act("rename")'
@@ -42,6 +175,12 @@ command! -buffer -nargs=0 Or exec 'py3 act("or")'
 command! -buffer -nargs=0 Extend exec 'py3 act("extend")'
 command! -buffer -nargs=0 Yank exec 'py3 act("yank")'
 command! -buffer -nargs=0 Put exec 'py3 act("put")'
+command! -buffer -nargs=0 YankToRegister exec 'py3 act("yank_to_register")'
+command! -buffer -nargs=0 PutFromRegister exec 'py3 act("put_from_register")'
+command! -buffer -nargs=0 CycleYanks exec 'py3 act("cycle_yanks")'
+command! -buffer -nargs=0 Undo exec 'py3 act("undo")'
+command! -buffer -nargs=0 Redo exec 'py3 act("redo")'
+command! -buffer -nargs=0 ToggleFold exec 'py3 act("toggle_fold")'
 command! -buffer -nargs=0 MakeInvert exec 'py3 act("make_invert")'
 command! -buffer -nargs=0 MakeNot exec 'py3 act("make_not")'
 command! -buffer -nargs=0 MakeUAdd exec 'py3 act("make_uadd")'
@@ -108,6 +247,13 @@ nnoremap <buffer> ~ :MakeInvert<Enter>
 nnoremap <buffer> -- :MakeUSub<Enter>
 nnoremap <buffer> y :Yank<Enter>
 nnoremap <buffer> p :Put<Enter>
+nnoremap <buffer> Y :YankToRegister<Enter>
+nnoremap <buffer> P :PutFromRegister<Enter>
+nnoremap <buffer> <C-p> :CycleYanks<Enter>
+nnoremap <buffer> u :Undo<Enter>
+nnoremap <buffer> <C-r> :Redo<Enter>
+" Like vim's za (Going down into a folded node unfolds it too)
+nnoremap <buffer> za :ToggleFold<Enter>
 
 " TODO: Is this Actions comment in the right place?
 " Actions
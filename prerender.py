@@ -0,0 +1,86 @@
+import weakref
+
+import core_logic
+import renderer
+
+
+class Prerenderer:
+    """Renders ahead of time the views the next cursor movement will
+    likely need: with the first child, the siblings or the parent of the
+    selected node selected. They are rendered one at a time (while vim
+    waits for a key), and are only good for the tree and the window
+    they were rendered for"""
+
+    def __init__(self):
+        # What the views were rendered for (see key_of)
+        self.key = None
+        # node -> the lines of the view with the node selected
+        self.views = {}
+        # The nodes whose views are left to render, the most likely first
+        self.pending = []
+
+    def start(self, tree, cursor_trail, window_width, viewport):
+        """Forgets the views, and lines up the ones around the cursor"""
+
+        self.key = key_of(tree, window_width, viewport)
+        self.views = {}
+        self.pending = neighbours_of(cursor_trail, tree)
+
+    def forget(self):
+        self.key = None
+        self.views = {}
+        self.pending = []
+
+    def render_next(self, tree, window_width, viewport):
+        """Renders one of the pending views. Returns whether there are more"""
+
+        if key_of(tree, window_width, viewport) != self.key:
+            self.forget()
+
+        if self.pending:
+            node = self.pending.pop(0)
+            self.views[node] = list(renderer.render_view_lines(
+                    tree, node, window_width, viewport))
+
+        return bool(self.pending)
+
+    def view_of(self, tree, node, window_width, viewport):
+        """The lines of the view with the node selected, or None if it
+        wasn't rendered (or the tree or the window changed since)"""
+
+        if key_of(tree, window_width, viewport) != self.key:
+            return None
+
+        return self.views.get(node)
+
+
+def key_of(tree, window_width, viewport):
+    # Any edit changes the edit count, so the views get rendered again
+    # (and so does changing how the view is rendered)
+    index = core_logic.get_index(tree)
+    return (weakref.ref(index), index.edit_count, window_width, viewport,
+            renderer.view_settings())
+
+
+def neighbours_of(cursor_trail, tree):
+    """The nodes j, l, h and k would select, in that order"""
+
+    trails = []
+    selected_node = core_logic.get_node_at_cursor(cursor_trail, tree)
+    if core_logic.list_children(selected_node):
+        trails.append(cursor_trail + [0])
+
+    if cursor_trail:
+        parent_trail = cursor_trail[:-1]
+        trails.append(parent_trail + [cursor_trail[-1] + 1])
+        trails.append(parent_trail + [cursor_trail[-1] - 1])
+        trails.append(parent_trail)
+
+    nodes = []
+    for trail in trails:
+        node = core_logic.get_node_at_cursor(trail, tree)
+        # An only child is its own sibling
+        if node is not selected_node and node not in nodes:
+            nodes.append(node)
+
+    return nodes
@@ -1,20 +1,168 @@
+import ast
+import time
+from copy import deepcopy
+
 import renderers.standard
+import renderers.strender
+
+# The renderers the view and the saved files can be rendered with.
+# They all have render_view, render_view_lines and render_standard.
+# Only the standard one (astor) knows where the nodes end up in the view
+# (span_of and tokens_of_line), so with the others the cursor goes in the text
+# and there's no AST highlighting. It's also the only one that folds and elides
+backends = {
+    "astor": renderers.standard,
+    "strender": renderers.strender,
+}
+
+# ast.unparse is new in python 3.9 (And showing the cursor needs the
+# private parts of it that renderers.unparse hooks into)
+if hasattr(ast, "unparse"):
+    import renderers.unparse
+    backends["unparse"] = renderers.unparse
+
+view_backend = renderers.standard
+save_backend = renderers.standard
+
+
+def view_uses_width():
+    """Whether the view backend lays out the lines to fit in the window
+    (Giving it an infinite width makes it skip that)"""
+    return view_backend is renderers.strender
+
+
+def view_knows_spans():
+    """Whether the view backend knows where the nodes end up in the view
+    (see span_of and tokens_of_line). Only that one folds and elides too"""
+    return view_backend is renderers.standard
+
+
+def use_backends(view_backend_name, save_backend_name):
+    """Picks the backends the view and the saved files are rendered with
+    (The names are the keys of backends)"""
+
+    global view_backend
+    global save_backend
+
+    for name in (view_backend_name, save_backend_name):
+        if name not in backends:
+            print(f"There's no {name} renderer, the options are: {', '.join(backends)}")
+            return
+
+    view_backend = backends[view_backend_name]
+    save_backend = backends[save_backend_name]
+
+    if view_backend_name == "unparse" and not renderers.unparse.has_hooks():
+        print("The unparse renderer can't show the cursor with this python")
+
+    if not view_knows_spans():
+        print(f"With the {view_backend_name} renderer, the cursor is shown in the text, "
+              "and the view isn't folded, elided or highlighted from the AST")
+
+
+def time_backends(tree, window_width):
+    """Renders the tree with each backend, to see which one is the fastest.
+    Returns (name, seconds to render the view, seconds to render the
+    saved file, whether the saved file parses back to the same tree)
+    for each one. They all render a copy of the tree, so nothing they
+    have cached from it makes them look faster"""
+
+    results = []
+    for name, backend in backends.items():
+        copy = deepcopy(tree)
+        start = time.perf_counter()
+        for line in backend.render_view_lines(copy, None, window_width):
+            pass
+        view_seconds = time.perf_counter() - start
+
+        copy = deepcopy(tree)
+        start = time.perf_counter()
+        source = backend.render_standard(copy)
+        save_seconds = time.perf_counter() - start
+
+        try:
+            round_trips = ast.dump(ast.parse(source)) == ast.dump(tree)
+        except SyntaxError:
+            round_trips = False
+
+        results.append((name, view_seconds, save_seconds, round_trips))
+
+    return results
 
 
-def render_view(tree, selected_node):
+def render_view(tree, selected_node, window_width, viewport=None):
     """Shows the ast with the current_node selected. This renderer
     can be altered according to the user's preferences about how
     the code should look like (Like indentation, casing, etc),
     because those are not properties of the code, just of the render.
-    Doesn't need to return valid python code, just readable code."""
+    Doesn't need to return valid python code, just readable code.
+
+    The viewport (first line, last line) is where the user is looking,
+    the lines outside of it don't need to be rendered (but have to be there)"""
     
-    return renderers.standard.render_view(tree, selected_node)
+    return view_backend.render_view(tree, selected_node, window_width, viewport)
+
+
+def render_view_lines(tree, selected_node, window_width, viewport=None):
+    """Same as render_view, but yields the lines one by one,
+    so the whole text doesn't have to be in memory at once"""
+
+    return view_backend.render_view_lines(
+            tree, selected_node, window_width, viewport)
+
+
+def span_of(tree, node):
+    """Where the node is in the view rendered without a selected node,
+    as (start line, start column, end line, end column), so the cursor
+    can be shown without changing the text. None if the renderer can't
+    tell, and the node has to be selected in the text instead"""
+
+    if not view_knows_spans():
+        return None
+
+    return renderers.standard.span_of(tree, node)
+
+
+def tokens_of_line(tree, line):
+    """The text of a line of the view rendered without a selected node,
+    and its tokens: (start column, end column, category), so it can be
+    highlighted. None if the renderer doesn't know them"""
+
+    if not view_knows_spans():
+        return None
+
+    return renderers.standard.tokens_of_line(tree, line)
+
+
+def elide_beyond(max_elements, max_characters):
+    """Makes the view only show the first max_elements of each container
+    and max_characters of each string (0 shows them whole), except for
+    the ones the cursor is in. render_standard still shows everything.
+    What was rendered with other limits is forgotten"""
+
+    renderers.standard.elide_beyond(max_elements, max_characters)
+
+
+def view_settings():
+    """What the view depends on, besides the tree, the selected node
+    and the window (Views rendered with other settings are stale)"""
+
+    return (view_backend,
+            renderers.standard.max_shown_elements,
+            renderers.standard.max_shown_characters)
+
+
+def save_in_processes(processes):
+    """Makes render_standard render big modules in that many
+    processes (1 renders them in this one). Only astor does it"""
+
+    renderers.standard.save_processes = processes
 
 
 def render_standard(tree):
     """Render the ast in the most standard python. Should not be 
     altered by the user."""
 
-    return renderers.standard.render_standard(tree)
+    return save_backend.render_standard(tree)
 
 
@@ -0,0 +1,160 @@
+import ast
+import io
+import keyword
+import tokenize
+import weakref
+from collections import deque
+from itertools import zip_longest
+from folds import body_fields
+
+
+def relative_spans(statement, text, folds=()):
+    """Where each node of the statement is in its rendered text, found
+    by parsing the text and walking both trees side by side.
+    The bodies of the nodes in folds aren't in the text, so they're skipped.
+
+    Returns node -> (start line, start column, end line, end column),
+    with the lines counted from the start of the text and the columns
+    in bytes (like vim's). The end is exclusive.
+    Returns None if the text isn't the same statement"""
+
+    try:
+        parsed = ast.parse(text).body
+    except SyntaxError:
+        return None
+
+    if len(parsed) != 1:
+        return None
+
+    spans = weakref.WeakKeyDictionary()
+
+    # Like ast.walk, but on both of them at once
+    to_walk = deque([(statement, parsed[0])])
+    while to_walk:
+        node, parsed_node = to_walk.popleft()
+        if type(node) is not type(parsed_node):
+            return None
+
+        if node in folds:
+            children = zip_longest(header_nodes(node), header_nodes(parsed_node))
+        else:
+            children = zip_longest(ast.iter_child_nodes(node), ast.iter_child_nodes(parsed_node))
+
+        to_walk.extend(children)
+
+        if getattr(parsed_node, "end_lineno", None) is None:
+            continue
+
+        start = (parsed_node.lineno - 1, parsed_node.col_offset)
+
+        # The decorators go before the def (or class)
+        decorators = getattr(parsed_node, "decorator_list", None)
+        if decorators:
+            start = (decorators[0].lineno - 1, decorators[0].col_offset - 1)
+
+        spans[node] = start + (parsed_node.end_lineno - 1, parsed_node.end_col_offset)
+
+    return spans
+
+
+def header_nodes(node):
+    """The children of the node that aren't in its body"""
+
+    for field_name, field_content in ast.iter_fields(node):
+        if field_name in body_fields:
+            continue
+
+        if isinstance(field_content, ast.AST):
+            yield field_content
+        elif isinstance(field_content, list):
+            yield from (item for item in field_content if isinstance(item, ast.AST))
+
+
+def span_within(node, spans, index):
+    """The span of the node. Nodes that don't have one (like the arguments)
+    get the span of their children, or else the one of their parent"""
+
+    while node is not None:
+        span = spans.get(node)
+        if span is not None:
+            return span
+
+        children = [spans[child] for child in ast.walk(node) if child in spans]
+        if children:
+            start = min(span[:2] for span in children)
+            end = max(span[2:] for span in children)
+            return start + end
+
+        node = index.parent_of(node)
+
+    return None
+
+
+# The operators that are highlighted (Not brackets, commas, colons or dots)
+punctuation = set("()[]{},:.;")
+
+
+def line_tokens(text):
+    """The tokens in each line of the rendered text of a statement, for
+    highlighting. Returns a list with (line text, tokens) for each line,
+    where a token is (start column, end column, category), with the
+    columns in bytes. The categories are keyword, definition, name,
+    string, number and operator. Returns None if the text can't be tokenized"""
+
+    lines = text.split("\n")
+    tokens = [[] for line in lines]
+
+    previous = None
+    try:
+        for token in tokenize.generate_tokens(io.StringIO(text).readline):
+            category = token_category(token, previous)
+            if token.type != tokenize.NL and token.type != tokenize.NEWLINE:
+                previous = token
+
+            if category is None:
+                continue
+
+            (start_line, start_column), (end_line, end_column) = token.start, token.end
+
+            # Tokens like multiline strings go in every line they are in
+            for line in range(start_line - 1, end_line):
+                start = start_column if line == start_line - 1 else 0
+                end = end_column if line == end_line - 1 else len(lines[line])
+                tokens[line].append((byte_column(lines[line], start),
+                                     byte_column(lines[line], end),
+                                     category))
+
+    except (tokenize.TokenError, SyntaxError):
+        return None
+
+    return list(zip(lines, tokens))
+
+
+def token_category(token, previous):
+    if token.type == tokenize.NAME:
+        if previous is not None and previous.string in ("def", "class"):
+            return "definition"
+
+        if keyword.iskeyword(token.string):
+            return "keyword"
+
+        return "name"
+
+    if token.type == tokenize.STRING:
+        return "string"
+
+    if token.type == tokenize.NUMBER:
+        return "number"
+
+    if token.type == tokenize.OP and token.string not in punctuation:
+        return "operator"
+
+    return None
+
+
+def byte_column(line, column):
+    # Vim counts the columns in bytes
+    if line.isascii():
+        return column
+
+    return len(line[:column].encode())
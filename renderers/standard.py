@@ -1,20 +1,666 @@
 import ast
 import astor
-from core_logic import get_node_at_cursor
+import weakref
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from astor.code_gen import set_precedence, Precedence
+from collections import OrderedDict
+from itertools import repeat
+from copy import copy
+from core_logic import get_node_at_cursor, get_index, get_folds
+from folds import body_fields
+from buffer_writer import lines_of
+from renderers.spans import relative_spans, span_within, line_tokens
+from bisect import bisect_right
 
 
-def render_view(tree, selected_node, _):
+# How many characters of rendered statements to keep around
+max_cached_characters = 8 * 1024 * 1024
+
+# Saving renders the statements that aren't cached in this many processes
+# (1 renders them all in vim's process), if there are at least
+# min_statements_for_processes of them
+save_processes = 1
+min_statements_for_processes = 2000
+statements_per_chunk = 500
+
+# The view only shows this many elements of a list, tuple, set or dict
+# and this many characters of a string, unless the cursor is in it (0 shows them whole)
+max_shown_elements = 50
+max_shown_characters = 5000
+
+
+def render_view(tree, selected_node, window_width, viewport=None):
+    return "\n".join(render_view_lines(tree, selected_node, window_width, viewport))
+
+
+def render_view_lines(tree, selected_node, _, viewport=None):
+    """Same as render_view, but yields the lines one by one
+    as each statement is rendered.
+
+    If there's a viewport (first line, last line), only the statements
+    in those lines get rendered. The rest are blank lines, as many as
+    the statement would take"""
     # Ignore thw window width, astor is not that smart
 
-    generator_class = cursor_highlighter_of(selected_node)
-    return astor.to_source(
-            tree,
-            source_generator_class=generator_class
-            )
+    if not isinstance(tree, ast.Module) or selected_node is tree:
+        generator_class = cursor_highlighter_of(selected_node)
+        yield from lines_of([astor.to_source(
+                tree,
+                source_generator_class=generator_class
+                )])
+        return
+
+    # Only the statement with the cursor in it (and the ones that changed)
+    # get rendered again, the rest come from the cache
+    index = get_index(tree)
+    selected_statement = top_level_statement_of(selected_node, index)
+
+    if viewport is not None:
+        yield from viewport_lines(tree, index, selected_node, selected_statement, viewport)
+        return
+
+    yield from lines_of(statement_pieces(
+            statement_cache.render(
+                statement,
+                index,
+                selected_node if statement is selected_statement else None)
+            for statement in tree.body
+            ))
+
+
+def viewport_lines(tree, index, selected_node, selected_statement, viewport):
+    """The lines of the module, but the statements outside of the viewport
+    are blank lines (Their heights come from the cache, so they are only
+    rendered the first time)"""
+
+    first_line, last_line = viewport
+
+    # The line the next statement starts in, and the newlines
+    # the last one wants after it (see join_statements)
+    line = 0
+    newlines_after = None
+
+    for statement in tree.body:
+        if statement is selected_statement:
+            rendered = statement_cache.render(statement, index, selected_node)
+            newlines_before, text, next_newlines_after = rendered
+            line_count = text.count("\n") + 1
+        else:
+            text = None
+            newlines_before, line_count, next_newlines_after = \
+                    statement_cache.height_of(statement, index)
+
+        if newlines_after is not None:
+            blank_lines = max(newlines_after, newlines_before) - 1
+            yield from repeat("", blank_lines)
+            line += blank_lines
+
+        newlines_after = next_newlines_after
+        end = line + line_count - 1
+
+        # The selected statement is always rendered
+        if text is None and line <= last_line and end >= first_line:
+            text = statement_cache.render(statement, index, None)[1]
+
+        if text is None:
+            yield from repeat("", line_count)
+        else:
+            yield from text.split("\n")
+
+        line = end + 1
+
+    # The newline at the end leaves an empty last line
+    # (and an empty module is a single empty line)
+    yield ""
 
 
 def render_standard(tree):
-    return astor.to_source(tree)
+    if not isinstance(tree, ast.Module):
+        return astor.to_source(tree)
+
+    index = get_index(tree)
+
+    rendered_in_processes = {}
+    if save_processes > 1:
+        rendered_in_processes = render_in_processes(tree, index)
+
+    # Nothing is elided in here, it's what gets saved
+    return join_statements(
+            rendered_in_processes.get(statement)
+            or statement_cache.render(statement, index, None, elide=False)
+            for statement in tree.body
+            )
+
+
+# The statements the processes render. They get them when they are forked,
+# so the statements don't have to be pickled and sent to them
+statements_to_render = []
+
+
+def render_in_processes(tree, index):
+    """Renders the statements of the module that aren't cached in
+    save_processes processes, statements_per_chunk at a time.
+    Returns statement -> rendered statement (see render_statement).
+    Each statement is rendered on its own either way, so joining
+    them gives the same text as rendering them here"""
+
+    global statements_to_render
+
+    missing = [statement for statement in tree.body
+               if statement_cache.whole_of(statement, index) is None]
+
+    # Starting the processes takes longer than rendering a few statements,
+    # and they need to be forked to get the statements
+    if (len(missing) < min_statements_for_processes
+            or "fork" not in multiprocessing.get_all_start_methods()):
+        return {}
+
+    chunks = [(start, start + statements_per_chunk)
+              for start in range(0, len(missing), statements_per_chunk)]
+
+    statements_to_render = missing
+    try:
+        with ProcessPoolExecutor(
+                save_processes, mp_context=multiprocessing.get_context("fork")) as pool:
+
+            rendered = [rendered_statement
+                        for rendered_chunk in pool.map(render_chunk, chunks)
+                        for rendered_statement in rendered_chunk]
+    finally:
+        statements_to_render = []
+
+    return dict(zip(missing, rendered))
+
+
+def render_chunk(chunk):
+    # (This runs in the processes)
+    start, end = chunk
+    return [render_statement(statement, None)[0]
+            for statement in statements_to_render[start:end]]
+
+
+def span_of(tree, node):
+    """Where the node is in the view rendered without a selected node:
+    (start line, start column, end line, end column), where the columns
+    are in bytes and the end is exclusive.
+    None if the renderer can't tell (and the cursor has to go in the text)"""
+
+    if not isinstance(tree, ast.Module):
+        return None
+
+    index = get_index(tree)
+    line_count, start_lines = statement_starts(tree, index)
+
+    # The whole view
+    if node is tree:
+        return (0, 0, line_count, 0)
+
+    statement = top_level_statement_of(node, index)
+    if statement is None:
+        return None
+
+    # It's not in the view
+    if get_folds(tree).hides(node, index):
+        return None
+
+    spans = statement_cache.spans_of(statement, index)
+    if spans is None:
+        return None
+
+    start_line, start_column, end_line, end_column = span_within(node, spans, index)
+    first_line = start_lines[index.slot_of(tree, statement)[1]]
+
+    return (first_line + start_line, start_column, first_line + end_line, end_column)
+
+
+def tokens_of_line(tree, line):
+    """The (text, tokens) of a line of the view rendered without a selected
+    node (see spans.line_tokens). None if the renderer doesn't know them"""
+
+    if not isinstance(tree, ast.Module):
+        return None
+
+    index = get_index(tree)
+    line_count, start_lines = statement_starts(tree, index)
+
+    position = bisect_right(start_lines, line) - 1
+    if position < 0:
+        return None
+
+    tokens = statement_cache.tokens_of(tree.body[position], index)
+    line -= start_lines[position]
+
+    # The blank lines between the statements don't have any
+    if tokens is None or line >= len(tokens):
+        return None
+
+    return tokens[line]
+
+
+# ((index, version of the module), (number of lines, the line each statement
+#   starts in, in order)). Nothing in it keeps the tree alive
+# The starts only change when the module does, so moving the cursor around reuses them
+cached_starts = (None, None)
+
+
+def statement_starts(tree, index):
+    global cached_starts
+
+    version = (weakref.ref(index), index.version_of(tree))
+    if cached_starts[0] == version:
+        return cached_starts[1]
+
+    start_lines = []
+    line = 0
+    newlines_after = None
+
+    for statement in tree.body:
+        newlines_before, line_count, next_newlines_after = \
+                statement_cache.height_of(statement, index)
+
+        if newlines_after is not None:
+            line += max(newlines_after, newlines_before) - 1
+
+        start_lines.append(line)
+        line += line_count
+        newlines_after = next_newlines_after
+
+    cached_starts = (version, (line, start_lines))
+    return cached_starts[1]
+
+
+def top_level_statement_of(node, index):
+    """The statement in the Module's body that has the node in it"""
+
+    parent = index.parent_of(node)
+    while parent is not None and parent is not index.tree:
+        node, parent = parent, index.parent_of(parent)
+
+    return node if parent is not None else None
+
+
+class StatementCache:
+    """The rendered top level statements, along with the version
+    they had in the index when they got rendered.
+    The least recently used ones are forgotten once there are more
+    than max_cached_characters in it"""
+
+    def __init__(self):
+        # (statement, selected node or None) -> ((index, version), rendered statement)
+        # (The version is only meaningful within the same index)
+        # The nodes and the index are weak references (see key_of and
+        # weak_version), so a tree that's gone doesn't stay alive in here.
+        # What was rendered from it is forgotten like the rest, oldest first
+        self.rendered = OrderedDict()
+        self.characters = 0
+
+        # statement -> (version, (newlines before, number of lines, newlines after))
+        # of the statement rendered without a selected node.
+        # They are tiny, so they stay after the text is forgotten
+        self.heights = weakref.WeakKeyDictionary()
+
+        # statement -> (version, the spans of the nodes within it, see relative_spans)
+        # Only computed for the statements the cursor goes to. The spans are
+        # weak too, or having the statement in them would keep it alive
+        self.spans = weakref.WeakKeyDictionary()
+
+        # statement -> (version, the tokens in each of its lines, see line_tokens)
+        # Only computed for the statements that get highlighted
+        self.tokens = weakref.WeakKeyDictionary()
+
+    def render(self, statement, index, selected_node, elide=True):
+        """The rendered statement. The long containers and strings the
+        cursor isn't in are elided and the folded nodes are folded,
+        unless elide is False (see ElidingGenerator)"""
+
+        rendered, complete = self.render_once(
+                key_of(statement, selected_node), statement, index, selected_node, True)
+
+        # Most statements don't have anything to elide,
+        # so the whole one is only rendered for the ones that do
+        if complete or elide:
+            return rendered
+
+        return self.render_once(
+                key_of(statement, selected_node, "whole"), statement, index, selected_node, False)[0]
+
+    def render_once(self, key, statement, index, selected_node, elide):
+        """(rendered statement, whether nothing was elided), only
+        rendered once for each version of the statement"""
+
+        cached = self.cached(key, statement, index)
+        if cached is not None:
+            return cached
+
+        if key in self.rendered:
+            self.forget(key)
+
+        open_nodes = None
+        folds = None
+        if elide:
+            open_nodes = ancestors_of(selected_node, index)
+            folds = get_folds(index.tree)
+
+        rendered, complete = render_statement(statement, selected_node, open_nodes, folds)
+        self.rendered[key] = (self.weak_version(statement, index), (rendered, complete))
+        self.characters += len(rendered[1])
+
+        if selected_node is None and elide:
+            newlines_before, text, newlines_after = rendered
+            self.heights[statement] = (
+                    self.weak_version(statement, index),
+                    (newlines_before, text.count("\n") + 1, newlines_after))
+
+        while self.characters > max_cached_characters and len(self.rendered) > 1:
+            self.forget(next(iter(self.rendered)))
+
+        return (rendered, complete)
+
+    def cached(self, key, statement, index):
+        """What render_once would return, if it doesn't have to render it"""
+
+        cached = self.rendered.get(key)
+        if cached is None or cached[0] != self.weak_version(statement, index):
+            return None
+
+        self.rendered.move_to_end(key)
+        return cached[1]
+
+    def whole_of(self, statement, index):
+        """The statement rendered without eliding anything (like
+        render(..., elide=False)), or None if it would have to be rendered"""
+
+        for key in (key_of(statement, None), key_of(statement, None, "whole")):
+            cached = self.cached(key, statement, index)
+            if cached is not None and cached[1]:
+                return cached[0]
+
+        return None
+
+    def height_of(self, statement, index):
+        """(newlines before, number of lines, newlines after) of the statement"""
+
+        cached = self.heights.get(statement)
+        if cached is not None and cached[0] == self.weak_version(statement, index):
+            return cached[1]
+
+        self.render(statement, index, None)
+        return self.heights[statement][1]
+
+    def spans_of(self, statement, index):
+        """The spans of the nodes within the statement
+        (None if they can't be found, see relative_spans)"""
+
+        return self.cached_from_text(
+                self.spans, statement, index,
+                lambda text: weak_spans(relative_spans(statement, text, get_folds(index.tree))))
+
+    def tokens_of(self, statement, index):
+        """The tokens in each line of the statement (see line_tokens)"""
+        return self.cached_from_text(self.tokens, statement, index, line_tokens)
+
+    def cached_from_text(self, cache, statement, index, compute):
+        """Computes something from the text of the statement (rendered
+        without a selected node), only once for each version of it"""
+
+        version = self.weak_version(statement, index)
+
+        cached = cache.get(statement)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+        result = compute(self.render(statement, index, None)[1])
+        cache[statement] = (version, result)
+        return result
+
+    def weak_version(self, statement, index):
+        # A weak reference to the index, so the cache doesn't keep the tree alive
+        return (weakref.ref(index), index.version_of(statement))
+
+    def forget(self, key):
+        version, (rendered, complete) = self.rendered.pop(key)
+        self.characters -= len(rendered[1])
+
+
+def weak_spans(spans):
+    return None if spans is None else weakref.WeakKeyDictionary(spans)
+
+
+def key_of(statement, selected_node, *rest):
+    """The key of the rendered statement in StatementCache.rendered, with
+    weak references to the nodes (They are equal while the nodes are alive)"""
+
+    return (weakref.ref(statement),
+            None if selected_node is None else weakref.ref(selected_node)) + rest
+
+
+statement_cache = StatementCache()
+
+
+def elide_beyond(max_elements, max_characters):
+    """Changes max_shown_elements and max_shown_characters. The cache
+    doesn't know what they were when something got rendered,
+    so it starts over when they change"""
+
+    global max_shown_elements
+    global max_shown_characters
+    global statement_cache
+    global cached_starts
+
+    if (max_elements, max_characters) == (max_shown_elements, max_shown_characters):
+        return
+
+    max_shown_elements = max_elements
+    max_shown_characters = max_characters
+
+    statement_cache = StatementCache()
+    cached_starts = (None, None)
+
+
+def render_statement(statement, selected_node, open_nodes=None, folds=None):
+    """Renders a top level statement on its own.
+    Returns ((newlines before, text, newlines after), whether nothing
+    was elided), because astor puts as many blank lines between two
+    statements as the one that wants the most (see join_statements).
+    The long containers and strings that aren't in open_nodes are
+    elided, and so are the bodies of the folds (None doesn't elide
+    anything, see ElidingGenerator)"""
+
+    if selected_node is None:
+        generator_class = ElidingGenerator
+    else:
+        generator_class = cursor_highlighter_of(selected_node)
+
+    generator = generator_class(" " * 4)
+    generator.open_nodes = open_nodes
+    generator.folds = folds
+    generator.selected_node = selected_node
+    generator.visit(statement)
+
+    result = generator.result
+    newlines_before = 0
+    if result and is_all_newlines(result[0]):
+        newlines_before = len(result[0])
+        result = result[1:]
+
+    # The newline at the end makes astor finish the last line
+    text = astor.code_gen.pretty_source(result + ["\n"])[:-1]
+
+    return ((newlines_before, text, generator.new_lines), not generator.elided)
+
+
+def ancestors_of(node, index):
+    """The node and the nodes it is within"""
+
+    ancestors = set()
+    while node is not None:
+        ancestors.add(node)
+        node = index.parent_of(node)
+
+    return ancestors
+
+
+def join_statements(rendered_statements):
+    """Joins the rendered statements like astor.to_source would"""
+    return "".join(statement_pieces(rendered_statements))
+
+
+def statement_pieces(rendered_statements):
+    """The pieces of text that join_statements joins"""
+
+    newlines_after = None
+
+    for (newlines_before, text, next_newlines_after) in rendered_statements:
+        if newlines_after is not None:
+            yield "\n" * max(newlines_after, newlines_before)
+
+        yield text
+        newlines_after = next_newlines_after
+
+    # An empty module is rendered as nothing
+    if newlines_after is not None:
+        yield "\n"
+
+
+class ElidingGenerator(astor.SourceGenerator):
+    """Only renders the first max_shown_elements of the containers and
+    max_shown_characters of the strings, followed by how many more there
+    are (Which isn't valid python, but it's only for the view).
+    Huge literals take astor long to render and make the buffer unusable.
+    The ones in open_nodes (where the cursor is) are rendered whole,
+    and so is everything if open_nodes is None.
+
+    The nodes in folds only get their first line rendered, unless the
+    selected node is within them"""
+
+    open_nodes = None
+    folds = None
+    selected_node = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        # How many containers and strings were elided
+        self.elided = 0
+
+    def should_elide(self, node, length, limit):
+        if (self.open_nodes is None
+                or not limit
+                or length <= limit
+                or node in self.open_nodes):
+            return False
+
+        self.elided += 1
+        return True
+
+    def write_elided(self, count, things):
+        self.write(f"... {count:,} more {things}")
+
+    def visit_List(self, node):
+        if not self.should_elide(node, len(node.elts), max_shown_elements):
+            return super().visit_List(node)
+
+        with self.delimit("[]"):
+            self.elided_elements(node.elts)
+
+    def visit_Set(self, node):
+        if not self.should_elide(node, len(node.elts), max_shown_elements):
+            return super().visit_Set(node)
+
+        with self.delimit("{}"):
+            self.elided_elements(node.elts)
+
+    def visit_Tuple(self, node):
+        if not self.should_elide(node, len(node.elts), max_shown_elements):
+            return super().visit_Tuple(node)
+
+        with self.delimit(node):
+            self.elided_elements(node.elts)
+
+    def elided_elements(self, elements):
+        self.comma_list(elements[:max_shown_elements])
+        self.write(", ")
+        self.write_elided(len(elements) - max_shown_elements, "elements")
+
+    def visit_Dict(self, node):
+        if not self.should_elide(node, len(node.keys), max_shown_elements):
+            return super().visit_Dict(node)
+
+        # Like astor's visit_Dict
+        keys = node.keys[:max_shown_elements]
+        values = node.values[:max_shown_elements]
+        set_precedence(Precedence.Comma, *values)
+
+        with self.delimit("{}"):
+            for (key, value) in zip(keys, values):
+                self.write(key if key else "", ": " if key else "**", value, ", ")
+
+            self.write_elided(len(node.keys) - max_shown_elements, "elements")
+
+    def visit_Constant(self, node):
+        value = node.value
+        if (not isinstance(value, (str, bytes))
+                or not self.should_elide(node, len(value), max_shown_characters)):
+            return super().visit_Constant(node)
+
+        if isinstance(value, str):
+            self._handle_string_constant(node, value[:max_shown_characters])
+        else:
+            self.write(repr(value[:max_shown_characters]))
+
+        self.write(" ")
+        self.write_elided(len(value) - max_shown_characters, "characters")
+
+    def folded(self, node):
+        """A copy of the node without its body if it's folded,
+        otherwise the node itself"""
+
+        if (self.folds is None
+                or node not in self.folds
+                or (node in self.open_nodes and node is not self.selected_node)):
+            return node
+
+        self.elided += 1
+
+        folded = copy(node)
+        for field in body_fields:
+            if hasattr(folded, field):
+                setattr(folded, field, [])
+
+        folded.body = [FoldedBody()]
+
+        return folded
+
+    def visit_FoldedBody(self, node):
+        self.write(" ...")
+
+    # (The async versions go through these too)
+
+    def visit_FunctionDef(self, node, is_async=False):
+        super().visit_FunctionDef(self.folded(node), is_async)
+
+    def visit_ClassDef(self, node):
+        super().visit_ClassDef(self.folded(node))
+
+    def visit_If(self, node):
+        super().visit_If(self.folded(node))
+
+    def visit_For(self, node, is_async=False):
+        super().visit_For(self.folded(node), is_async)
+
+    def visit_While(self, node):
+        super().visit_While(self.folded(node))
+
+    def visit_With(self, node, is_async=False):
+        super().visit_With(self.folded(node), is_async)
+
+    def visit_Try(self, node):
+        super().visit_Try(self.folded(node))
+
+
+class FoldedBody(ast.AST):
+    """Stands for the body of a folded node"""
 
 
 def cursor_highlighter_of(ast_node):
@@ -26,7 +672,7 @@ def cursor_highlighter_of(ast_node):
     # TODO: The f strings look weird
     # TODO: Empty sets become {1}.__class__
     # TODO: The starting cursor appears twice when selecting a comprehension
-    class CursorHighlighter(astor.SourceGenerator):
+    class CursorHighlighter(ElidingGenerator):
         
         cursor_start = "<<<"
         cursor_end = ">>>"
@@ -1,4 +1,10 @@
 import ast
+import weakref
+from collections import OrderedDict
+
+from buffer_writer import lines_of
+from core_logic import get_index
+from renderers.standard import top_level_statement_of
 
 SPACES_PER_INDENTATION_LEVEL = 4
 
@@ -9,138 +15,1184 @@ CURSOR_END = ">>>"
 # intermediate rendering functions don't have to worry about it
 # so I think the global variable is worth it
 selected_node = None
-def render_view(tree, new_selected_node, window_width):
+def render_view(tree, new_selected_node, window_width, viewport=None):
+    # (Every line gets laid out, the viewport doesn't save anything here)
+    return layout(document_of(tree, new_selected_node), window_width)
+
+
+def render_view_lines(tree, new_selected_node, window_width, viewport=None):
+    """Same as render_view, but yields the lines one by one as they are laid out"""
+    return lines_of(layout_pieces(document_of(tree, new_selected_node), window_width))
+
+
+# The width of the saved files
+SAVE_WIDTH = 79
+
+
+def render_standard(tree):
+    return layout(document_of(tree, None), SAVE_WIDTH)
+
+
+# Building the document doesn't depend on the width, only laying it out does.
+# So the documents are kept, and a new width (like when the window is resized)
+# only needs a new layout
+
+# How many documents of top level statements to keep around
+max_cached_documents = 100000
+
+# ((index, version of the tree, selected node), document) of the last render
+# (With weak references to the index and the node)
+last_document = (None, None)
+
+# statement -> ((index, version), document) of the top level statements
+# that don't have the selected node in them (the least recently used first)
+# The statements are weak references, and they leave when the statement is gone
+statement_documents = OrderedDict()
+
+
+def document_of(tree, new_selected_node):
+    """The document of the tree, built again only if the tree
+    or the selected node changed since the last time"""
+
     global selected_node
+    global last_document
     selected_node = new_selected_node
-    return render(tree, cols_left=window_width)
 
+    index = get_index(tree)
+    key = (weakref.ref(index),
+           index.version_of(tree),
+           None if new_selected_node is None else weakref.ref(new_selected_node))
+    if last_document[0] == key:
+        return last_document[1]
 
-def render(node, indentation_spaces=0, cols_left=80):
-    class_name = type(node).__name__
-    render_function = globals().get('render_' + class_name, not_implemented_render)
+    if isinstance(tree, ast.Module) and new_selected_node is not tree:
+        document = module_document(tree, index)
+    else:
+        document = render(tree)
 
-    # indentation is how many levels indented the node should draw itself
-    # cols-left is the amount of room it will have left on the line to draw itself
-    # given that it will draw the indentation first
-    rendered_node = render_function(node, indentation_spaces, cols_left)
+    last_document = (key, document)
+    return document
 
-    if selected_node is node:
-        return CURSOR_START + rendered_node + CURSOR_END
 
-    return rendered_node
+def module_document(tree, index):
+    """Like render(tree), but only the statements that changed
+    (and the one with the selected node) are built again"""
 
+    selected_statement = top_level_statement_of(selected_node, index)
 
-def not_implemented_render(node, indentation, cols_left):
-    return indent(indentation, "NOT IMPLEMENTED")
+    def statement_document(statement):
+        if statement is selected_statement:
+            return render(statement)
 
+        version = (weakref.ref(index), index.version_of(statement))
 
-def render_Module(node, indentation, cols_left):
-    end_of_imports = first_matching(node.body, lambda x: not is_import(x))
-    imports, rest = node.body[:end_of_imports], node.body[end_of_imports:]
+        key = weakref.ref(statement)
+        cached = statement_documents.get(key)
+        if cached is None:
+            key = weakref.ref(statement, forget_document)
 
-    return (
-            # The docstring
-            # TODO: :)
-            # Start with the imports
-            newline_join(map(lambda x : render(x, indentation, cols_left), imports))
-            # Some space
-            + '\n\n\n' 
-            # Then the definitions separated by two newlines
-            + '\n\n\n'.join(map(lambda x: render(x, indentation, cols_left), rest))
-            # Then a trailing newline
-            + '\n'
-           )
+        if cached is None or cached[0] != version:
+            cached = statement_documents[key] = (version, render(statement))
 
+        statement_documents.move_to_end(key)
+        if len(statement_documents) > max_cached_documents:
+            statement_documents.popitem(last=False)
 
-def render_Import(node, indentation, cols_left):
-    initial_cols_left = cols_left
+        return cached[1]
 
-    import_str = "import "
+    return render_Module(tree, statement_document)
 
-    # Remove the indentation size
-    # And the size of the import keyword string
-    cols_left = cols_left - len(import_str)
 
-    full_import = ( import_str 
-                    + render_aliases(node.names, indentation, initial_cols_left, cols_left)
-                  )
+def forget_document(statement_reference):
+    # (The statement is gone)
+    statement_documents.pop(statement_reference, None)
 
-    return indent(indentation, full_import)
 
+# The rendering functions don't build strings, they build documents that
+# say where the lines could be broken. Then layout picks the line breaks so
+# that the lines fit in the window (Like in Wadler's "prettier printer")
+#
+# A document is one of:
+# - A string, printed as is
+# - A list of documents, printed one after the other
+# - A Line: A line break, or its flat text if the group it's in fits in the line
+# - A Choice: Its flat text if the group it's in fits in the line, its broken text otherwise
+# - A Nest: The line breaks within it get one more level of indentation
+# - A Group: Printed flat if it fits in what's left of the line, along with
+#   what follows it up to where the line can be broken. Broken otherwise
+#
+# Each group measures how wide it is once, when it's built, without going
+# into the groups inside of it (They already know their width), so both
+# building and laying out the document take linear time. What follows a
+# group is only measured up to what's left of the line
 
-def render_ImportFrom(node, indentation, cols_left):
-    initial_cols_left = cols_left
-    # Default level to 0
-    level = node.level if node.level is not None else 0 
+INFINITE_WIDTH = float("inf")
+
+
+class Line:
+    __slots__ = ("flat",)
+
+    def __init__(self, flat):
+        # None means it can't be flat
+        self.flat = flat
+
+
+LINE = Line(" ")
+SOFTLINE = Line("")
+HARDLINE = Line(None)
+
+
+class Choice:
+    __slots__ = ("flat", "broken")
+
+    def __init__(self, flat, broken):
+        self.flat = flat
+        self.broken = broken
+
+
+class Nest:
+    __slots__ = ("document",)
+
+    def __init__(self, document):
+        self.document = document
+
+
+class Group:
+    __slots__ = ("document", "width")
+
+    def __init__(self, document):
+        self.document = document
+        self.width = flat_width(document)
+
+
+def flat_width(document):
+    """How wide the document is when printed in a single line"""
+
+    width = 0
+    to_measure = [document]
+    while to_measure:
+        document = to_measure.pop()
+        kind = type(document)
+
+        if kind is str:
+            if "\n" in document:
+                return INFINITE_WIDTH
+            width += len(document)
+        elif kind is list:
+            to_measure.extend(document)
+        elif kind is Group:
+            width += document.width
+        elif kind is Nest:
+            to_measure.append(document.document)
+        elif document.flat is None:
+            return INFINITE_WIDTH
+        else:
+            width += len(document.flat)
+
+    return width
+
+
+def layout(document, width):
+    """Prints the document, breaking the groups that don't fit in the width"""
+    return "".join(layout_pieces(document, width))
+
+
+def layout_pieces(document, width):
+    """Same as layout, but yields the text in pieces as it's printed"""
+
+    column = 0
+    # The indentation is only written before some text,
+    # so that blank lines don't have trailing spaces
+    pending_indentation = None
 
-    from_str = "from "
-    module_str = "." * level + (node.module if node.module is not None else "")
-    import_str = " import "
+    # (indentation, document), only of the documents that aren't flat
+    to_print = [(0, document)]
+    while to_print:
+        indentation, document = to_print.pop()
+        kind = type(document)
 
-    cols_left = cols_left - len(from_str + module_str + import_str)
-    aliases_str = render_aliases(node.names, indentation, initial_cols_left, cols_left)
+        if kind is list:
+            to_print.extend([(indentation, part) for part in reversed(document)])
+            continue
 
-    return from_str + module_str + import_str + aliases_str
+        if kind is Nest:
+            to_print.append((indentation + SPACES_PER_INDENTATION_LEVEL, document.document))
+            continue
 
+        if kind is Line:
+            yield "\n"
+            pending_indentation = column = indentation
+            continue
 
-def render_aliases(aliases, indentation, initial_cols_left, cols_left):
-     
-    rendered_aliases = list(map(render, aliases))
+        if kind is Group:
+            room = width - column - document.width
+            if room < 0 or width_before_break(to_print, room) > room:
+                to_print.append((indentation, document.document))
+                continue
+            if not document.width:
+                continue
+        elif kind is Choice:
+            document = document.broken
+            if not document:
+                continue
+        elif not document:
+            continue
 
-    # len + 2 because of the ", " in between
-    # Except for the last one (so -2 in the end)
-    if not sum(map(lambda x: len(x) + 2, rendered_aliases)) -2 > cols_left:
-        # If drawing all of them doesn't go off screen, just render them inline
-        return render_simple_group(indentation, rendered_aliases)
+        if pending_indentation is not None:
+            yield " " * pending_indentation
+            pending_indentation = None
 
-    # Grouping recovers the initial amount of cols left
-    # but requires one more indentation level
-    cols_left = initial_cols_left - SPACES_PER_INDENTATION_LEVEL 
+        if kind is Group:
+            yield from flat_pieces(document.document)
+            column += document.width
+        else:
+            yield document
+
+            last_newline = document.rfind("\n")
+            if last_newline == -1:
+                column += len(document)
+            else:
+                column = len(document) - last_newline - 1
+
+
+NO_MORE_PARTS = object()
+
+
+def width_before_break(to_print, room):
+    """How wide what's left to print is up to the first place the line can be
+    broken (Like the rest of the stream in Wadler's fits). The groups in it
+    haven't been decided yet, and they can break at their first line.
+    It stops measuring once it's wider than room"""
 
-    # Group them such that no group goes off screen
-    alias_groups = [[rendered_aliases[0]]]
-    for alias in rendered_aliases[1:]:
-        current_group_len = sum(map(lambda x: len(x) +2, alias_groups[-1]))
+    width = 0
+    # Iterators over the parts of the documents being measured
+    parts = []
+    position = len(to_print)
 
-        # If adding this alias and a " ," overflows
-        if current_group_len + len(alias) + 2 > cols_left:
-            # Make a new group
-            alias_groups.append([alias])
-        
-        # Otherwise add it to the last group
+    while width <= room:
+        if parts:
+            document = next(parts[-1], NO_MORE_PARTS)
+            if document is NO_MORE_PARTS:
+                parts.pop()
+                continue
+        elif position:
+            position -= 1
+            document = to_print[position][1]
         else:
-            alias_groups[-1].append(alias)
-    
-    # render_simple_group takes care of indentation
-    return "(\n" + ",\n".join(map(
-                lambda x: render_simple_group(indentation+SPACES_PER_INDENTATION_LEVEL, x),
-                alias_groups)
-            ) + "\n)" 
+            break
+
+        kind = type(document)
+        if kind is str:
+            newline = document.find("\n")
+            if newline != -1:
+                return width + newline
+            width += len(document)
+        elif kind is list:
+            parts.append(iter(document))
+        elif kind is Group or kind is Nest:
+            parts.append(iter((document.document,)))
+        elif kind is Choice:
+            parts.append(iter((document.broken,)))
+        else:
+            # A Line
+            break
+
+    return width
+
+
+def flat_pieces(document):
+    # Everything in it fits in the line, so there's nothing to decide
+    to_print = [document]
+    while to_print:
+        document = to_print.pop()
+        kind = type(document)
+
+        if kind is str:
+            yield document
+        elif kind is list:
+            to_print.extend(reversed(document))
+        elif kind is Group or kind is Nest:
+            to_print.append(document.document)
+        else:
+            yield document.flat
+
+
+def join(separator, documents):
+    joined = []
+    for document in documents:
+        if joined:
+            joined.append(separator)
+        joined.append(document)
+
+    return joined
+
+
+def comma_group(documents, opening="", closing=""):
+    """The documents separated by commas. If they don't fit in the line,
+    each one goes in its own line, indented between the opening and closing"""
+
+    if not documents:
+        return [opening, closing]
+
+    return Group([
+        opening,
+        Nest([SOFTLINE, join([",", LINE], documents)]),
+        SOFTLINE,
+        closing
+        ])
+
+
+def render(node):
+    return with_cursor(node, renderers_by_type.get(type(node), fallback_render)(node))
+
+
+def with_cursor(node, document):
+    if selected_node is node:
+        return [CURSOR_START, document, CURSOR_END]
+
+    return document
+
+
+def fallback_render(node):
+    # For the nodes of newer python versions
+    return ast.unparse(node)
+
+
+# Statements
+
+def render_Module(node, render_statement=render):
+    if not node.body:
+        return []
+
+    return [render_statements(node.body, 2, render_statement), HARDLINE]
+
+
+def render_statements(statements, blank_lines_around_definitions=1, render_statement=render):
+    documents = []
+    previous = None
+
+    for statement in statements:
+        if previous is not None:
+            documents.append(HARDLINE)
+
+            if is_definition(previous) or is_definition(statement):
+                documents.extend([HARDLINE] * blank_lines_around_definitions)
+            # A blank line after the imports
+            elif is_import(previous) and not is_import(statement):
+                documents.append(HARDLINE)
+
+        documents.append(render_statement(statement))
+        previous = statement
+
+    return documents
+
+
+def render_body(statements):
+    """The indented block of statements after a colon"""
+    return [":", Nest([HARDLINE, render_statements(statements)])]
+
+
+def render_else(keyword, statements):
+    if not statements:
+        return []
 
+    return [HARDLINE, keyword, render_body(statements)]
 
-def render_simple_group(indentation_spaces, group):
-    return indent(indentation_spaces, ", ".join(group))
 
-# Doesn't care about indentaion or cols left, just draws itself
-# The parent should take care of that
-def render_alias(node, _, __):
+def render_decorators(decorators):
+    return [["@", render_expression(decorator, NAMED_EXPR), HARDLINE]
+            for decorator in decorators]
+
+
+def render_FunctionDef(node, keyword="def"):
+    returns = [] if node.returns is None else [" -> ", render_expression(node.returns, TEST)]
+
+    return [
+        render_decorators(node.decorator_list),
+        keyword, " ", node.name, "(", render(node.args), ")",
+        returns,
+        render_body(node.body),
+        ]
+
+
+def render_AsyncFunctionDef(node):
+    return render_FunctionDef(node, keyword="async def")
+
+
+def render_ClassDef(node):
+    arguments = ([render_expression(base, TEST) for base in node.bases]
+                 + [render(keyword) for keyword in node.keywords])
+
+    return [
+        render_decorators(node.decorator_list),
+        "class ", node.name,
+        comma_group(arguments, "(", ")") if arguments else [],
+        render_body(node.body),
+        ]
+
+
+def render_Return(node):
+    if node.value is None:
+        return "return"
+
+    return ["return ", render_expression(node.value, TUPLE)]
+
+
+def render_Delete(node):
+    return ["del ", join(", ", [render_expression(target, TEST) for target in node.targets])]
+
+
+def render_Assign(node):
+    return [
+        [[render_expression(target, TUPLE), " = "] for target in node.targets],
+        render_expression(node.value, STATEMENT_VALUE),
+        ]
+
+
+def render_AugAssign(node):
+    return [
+        render_expression(node.target, TEST),
+        " ", binary_operators[type(node.op)][0], "= ",
+        render_expression(node.value, STATEMENT_VALUE),
+        ]
+
+
+def render_AnnAssign(node):
+    target = render_expression(node.target, TEST)
+    # simple is 0 for names that had parentheses around them
+    if not node.simple and isinstance(node.target, ast.Name):
+        target = ["(", target, ")"]
+
+    value = [] if node.value is None else [" = ", render_expression(node.value, STATEMENT_VALUE)]
+
+    return [target, ": ", render_expression(node.annotation, TEST), value]
+
+
+def render_For(node, keyword="for"):
+    return [
+        keyword, " ", render_expression(node.target, TUPLE),
+        " in ", render_expression(node.iter, TUPLE),
+        render_body(node.body),
+        render_else("else", node.orelse),
+        ]
+
+
+def render_AsyncFor(node):
+    return render_For(node, keyword="async for")
+
+
+def render_While(node):
+    return [
+        "while ", render_expression(node.test, NAMED_EXPR),
+        render_body(node.body),
+        render_else("else", node.orelse),
+        ]
+
+
+def render_If(node):
+    documents = ["if ", render_expression(node.test, NAMED_EXPR), render_body(node.body)]
+
+    # An else with only an if in it is an elif
+    # (Unless that if is selected, so the cursor has something to go around)
+    while (len(node.orelse) == 1
+            and isinstance(node.orelse[0], ast.If)
+            and node.orelse[0] is not selected_node):
+
+        node = node.orelse[0]
+        documents.extend([
+            HARDLINE, "elif ", render_expression(node.test, NAMED_EXPR),
+            render_body(node.body)
+            ])
+
+    documents.append(render_else("else", node.orelse))
+    return documents
+
+
+def render_With(node, keyword="with"):
+    return [
+        keyword, " ", join(", ", [render(item) for item in node.items]),
+        render_body(node.body),
+        ]
+
+
+def render_AsyncWith(node):
+    return render_With(node, keyword="async with")
+
+
+def render_withitem(node):
+    if node.optional_vars is None:
+        return render_expression(node.context_expr, TEST)
+
+    return [
+        render_expression(node.context_expr, TEST),
+        " as ", render_expression(node.optional_vars, TEST),
+        ]
+
+
+def render_Raise(node):
+    documents = ["raise"]
+
+    if node.exc is not None:
+        documents.extend([" ", render_expression(node.exc, TEST)])
+
+    if node.cause is not None:
+        documents.extend([" from ", render_expression(node.cause, TEST)])
+
+    return documents
+
+
+def render_Try(node, keyword="except"):
+    return [
+        "try", render_body(node.body),
+        [[HARDLINE, with_cursor(handler, render_handler(handler, keyword))]
+         for handler in node.handlers],
+        render_else("else", node.orelse),
+        render_else("finally", node.finalbody),
+        ]
+
+
+def render_TryStar(node):
+    return render_Try(node, keyword="except*")
+
+
+def render_handler(node, keyword):
+    # The keyword depends on the try the handler is in
+    return [
+        keyword,
+        [] if node.type is None else [" ", render_expression(node.type, TEST)],
+        [] if node.name is None else [" as ", node.name],
+        render_body(node.body),
+        ]
+
+
+def render_ExceptHandler(node):
+    return render_handler(node, "except")
+
+
+def render_Assert(node):
+    message = [] if node.msg is None else [", ", render_expression(node.msg, TEST)]
+    return ["assert ", render_expression(node.test, TEST), message]
+
+
+def render_Import(node):
+    # The names can't go in parentheses, so they all stay in the same line
+    return ["import ", join(", ", [render(alias) for alias in node.names])]
+
+
+def render_ImportFrom(node):
+    # Default level to 0
+    level = node.level if node.level is not None else 0
+    module = "." * level + (node.module if node.module is not None else "")
+
+    aliases = [render(alias) for alias in node.names]
+
+    # A * can't go in parentheses
+    if any(alias.name == "*" for alias in node.names):
+        return ["from ", module, " import ", join(", ", aliases)]
+
+    return [
+        "from ", module, " import ",
+        # The parentheses are only needed if the names don't fit in the line
+        comma_group(aliases, Choice("", "("), Choice("", ")")),
+        ]
+
+
+def render_alias(node):
     as_str = "" if node.asname is None else f" as {node.asname}"
     return node.name + as_str
 
 
-def indent(indentation_spaces, string):
-    return " " * indentation_spaces + string
+def render_Global(node):
+    return "global " + ", ".join(node.names)
 
 
-def is_import(node):
-    return isinstance(node, ast.Import) or isinstance(node, ast.ImportFrom)
+def render_Nonlocal(node):
+    return "nonlocal " + ", ".join(node.names)
+
+
+def render_Expr(node):
+    value = node.value
+
+    # Docstrings (and other multiline strings) look better with triple quotes
+    if (isinstance(value, ast.Constant)
+            and type(value.value) == str
+            and "\n" in value.value
+            and value is not selected_node
+            and can_triple_quote(value.value)):
+
+        return '"""' + value.value + '"""'
+
+    return render_expression(value, STATEMENT_VALUE)
+
+
+def can_triple_quote(string):
+    return ('"""' not in string
+            and "\\" not in string
+            and not string.endswith('"')
+            and string.replace("\n", "").isprintable())
+
+
+def render_Pass(node):
+    return "pass"
+
+
+def render_Break(node):
+    return "break"
+
+
+def render_Continue(node):
+    return "continue"
+
+
+def render_Match(node):
+    return [
+        "match ", render_expression(node.subject, TUPLE), ":",
+        Nest([[HARDLINE, render(case)] for case in node.cases]),
+        ]
+
+
+def render_match_case(node):
+    guard = [] if node.guard is None else [" if ", render_expression(node.guard, NAMED_EXPR)]
+    return ["case ", render(node.pattern), guard, render_body(node.body)]
+
 
+# Patterns (of the match statement)
 
-def first_matching(iterable, predicate):
-    for index, item in enumerate(iterable):
-        if predicate(item):
-            return index
-    return None
+def render_MatchValue(node):
+    return render_expression(node.value, TEST)
+
+
+def render_MatchSingleton(node):
+    return repr(node.value)
+
+
+def render_MatchSequence(node):
+    return comma_group([render(pattern) for pattern in node.patterns], "[", "]")
+
+
+def render_MatchMapping(node):
+    items = [[render_expression(key, TEST), ": ", render(pattern)]
+             for (key, pattern) in zip(node.keys, node.patterns)]
+
+    if node.rest is not None:
+        items.append("**" + node.rest)
+
+    return comma_group(items, "{", "}")
+
+
+def render_MatchClass(node):
+    arguments = ([render(pattern) for pattern in node.patterns]
+                 + [[name, "=", render(pattern)]
+                    for (name, pattern) in zip(node.kwd_attrs, node.kwd_patterns)])
+
+    return [render_expression(node.cls, ATOM), comma_group(arguments, "(", ")")]
+
+
+def render_MatchStar(node):
+    return "*" + (node.name if node.name is not None else "_")
+
+
+def render_MatchAs(node):
+    if node.pattern is None:
+        return node.name if node.name is not None else "_"
+
+    pattern = render(node.pattern)
+    if isinstance(node.pattern, ast.MatchOr):
+        pattern = ["(", pattern, ")"]
+
+    return [pattern, " as ", node.name]
+
+
+def render_MatchOr(node):
+    alternatives = []
+    for pattern in node.patterns:
+        document = render(pattern)
+
+        if isinstance(pattern, ast.MatchAs) and pattern.pattern is not None:
+            document = ["(", document, ")"]
+
+        alternatives.append(document)
+
+    return join(" | ", alternatives)
+
+
+# Expressions
+#
+# Each expression is rendered with the precedence its place requires,
+# and gets parentheses if its own precedence is lower
+
+NAMED_EXPR = 0
+TUPLE = 1
+YIELD = 2
+TEST = 3
+OR = 4
+AND = 5
+NOT = 6
+CMP = 7
+BOR = 8
+BXOR = 9
+BAND = 10
+SHIFT = 11
+ARITH = 12
+TERM = 13
+FACTOR = 14
+POWER = 15
+AWAIT = 16
+ATOM = 17
+
+# The value of an expression statement or of an assignment,
+# the only places where a yield doesn't need parentheses
+STATEMENT_VALUE = -1
+
+# operator -> (symbol, precedence)
+binary_operators = {
+    ast.Add: ("+", ARITH),
+    ast.Sub: ("-", ARITH),
+    ast.Mult: ("*", TERM),
+    ast.MatMult: ("@", TERM),
+    ast.Div: ("/", TERM),
+    ast.FloorDiv: ("//", TERM),
+    ast.Mod: ("%", TERM),
+    ast.Pow: ("**", POWER),
+    ast.LShift: ("<<", SHIFT),
+    ast.RShift: (">>", SHIFT),
+    ast.BitOr: ("|", BOR),
+    ast.BitXor: ("^", BXOR),
+    ast.BitAnd: ("&", BAND),
+}
+
+unary_operators = {
+    ast.Not: ("not ", NOT),
+    ast.Invert: ("~", FACTOR),
+    ast.UAdd: ("+", FACTOR),
+    ast.USub: ("-", FACTOR),
+}
+
+boolean_operators = {
+    ast.And: (" and ", AND),
+    ast.Or: (" or ", OR),
+}
+
+comparison_operators = {
+    ast.Eq: " == ",
+    ast.NotEq: " != ",
+    ast.Lt: " < ",
+    ast.LtE: " <= ",
+    ast.Gt: " > ",
+    ast.GtE: " >= ",
+    ast.Is: " is ",
+    ast.IsNot: " is not ",
+    ast.In: " in ",
+    ast.NotIn: " not in ",
+}
+
+precedences = {
+    ast.NamedExpr: NAMED_EXPR,
+    ast.Yield: YIELD,
+    ast.YieldFrom: YIELD,
+    ast.Lambda: TEST,
+    ast.IfExp: TEST,
+    ast.Compare: CMP,
+    ast.Await: AWAIT,
+}
+
+
+def precedence_of(node):
+    node_type = type(node)
+
+    if node_type == ast.BinOp:
+        return binary_operators[type(node.op)][1]
+    if node_type == ast.UnaryOp:
+        return unary_operators[type(node.op)][1]
+    if node_type == ast.BoolOp:
+        return boolean_operators[type(node.op)][1]
+    if node_type == ast.Tuple:
+        return TUPLE if node.elts else ATOM
+
+    return precedences.get(node_type, ATOM)
+
+
+def render_expression(node, precedence):
+    if isinstance(node, ast.Yield) or isinstance(node, ast.YieldFrom):
+        needs_parentheses = precedence != STATEMENT_VALUE
+    else:
+        needs_parentheses = precedence_of(node) < max(precedence, TUPLE)
+
+    if not needs_parentheses:
+        return render(node)
+
+    # A tuple has its own parentheses when it's broken into lines
+    if isinstance(node, ast.Tuple):
+        return with_cursor(node, render_tuple(node, "(", ")"))
+
+    return ["(", render(node), ")"]
+
+
+def render_BoolOp(node):
+    operator, precedence = boolean_operators[type(node.op)]
+    return join(operator, [render_expression(value, precedence + 1) for value in node.values])
+
+
+def render_NamedExpr(node):
+    return [render_expression(node.target, ATOM), " := ", render_expression(node.value, TEST)]
+
+
+def render_BinOp(node):
+    operator, precedence = binary_operators[type(node.op)]
+
+    # Power is right associative, everything else is left associative
+    if isinstance(node.op, ast.Pow):
+        left_precedence, right_precedence = precedence + 1, precedence
+    else:
+        left_precedence, right_precedence = precedence, precedence + 1
+
+    return [
+        render_expression(node.left, left_precedence),
+        " ", operator, " ",
+        render_expression(node.right, right_precedence),
+        ]
+
+
+def render_UnaryOp(node):
+    operator, precedence = unary_operators[type(node.op)]
+    return [operator, render_expression(node.operand, precedence)]
+
+
+def render_Lambda(node):
+    arguments = with_cursor(node.args, render_lambda_arguments(node.args))
+    return [
+        "lambda", " " if flat_width(arguments) else "", arguments, ": ",
+        render_expression(node.body, TEST),
+        ]
+
+
+def render_IfExp(node):
+    return [
+        render_expression(node.body, TEST + 1),
+        " if ", render_expression(node.test, TEST + 1),
+        " else ", render_expression(node.orelse, TEST),
+        ]
+
+
+def render_Dict(node):
+    items = []
+    for key, value in zip(node.keys, node.values):
+        # A None key is a **dictionary unpacking
+        if key is None:
+            items.append(["**", render_expression(value, BOR)])
+        else:
+            items.append([render_expression(key, TEST), ": ", render_expression(value, TEST)])
+
+    return comma_group(items, "{", "}")
+
+
+def render_Set(node):
+    # {} is an empty dictionary
+    if not node.elts:
+        return "{*()}"
+
+    return comma_group([render_expression(element, TEST) for element in node.elts], "{", "}")
+
+
+def render_comprehension_body(element, generators, opening, closing):
+    return Group([
+        opening,
+        Nest([SOFTLINE, element, [[LINE, render(generator)] for generator in generators]]),
+        SOFTLINE,
+        closing,
+        ])
+
+
+def render_ListComp(node):
+    return render_comprehension_body(
+            render_expression(node.elt, TEST), node.generators, "[", "]")
+
+
+def render_SetComp(node):
+    return render_comprehension_body(
+            render_expression(node.elt, TEST), node.generators, "{", "}")
+
+
+def render_GeneratorExp(node):
+    return render_comprehension_body(
+            render_expression(node.elt, TEST), node.generators, "(", ")")
+
+
+def render_DictComp(node):
+    element = [render_expression(node.key, TEST), ": ", render_expression(node.value, TEST)]
+    return render_comprehension_body(element, node.generators, "{", "}")
+
+
+def render_comprehension(node):
+    return [
+        "async for " if node.is_async else "for ",
+        render_expression(node.target, TUPLE),
+        " in ", render_expression(node.iter, TEST + 1),
+        [[" if ", render_expression(condition, TEST + 1)] for condition in node.ifs],
+        ]
+
+
+def render_Await(node):
+    return ["await ", render_expression(node.value, ATOM)]
+
+
+def render_Yield(node):
+    if node.value is None:
+        return "yield"
+
+    return ["yield ", render_expression(node.value, TUPLE)]
+
+
+def render_YieldFrom(node):
+    return ["yield from ", render_expression(node.value, TEST)]
+
+
+def render_Compare(node):
+    documents = [render_expression(node.left, CMP + 1)]
+
+    for operator, comparator in zip(node.ops, node.comparators):
+        documents.extend([
+            comparison_operators[type(operator)],
+            render_expression(comparator, CMP + 1)
+            ])
+
+    return documents
+
+
+def render_Call(node):
+    arguments = ([render_expression(argument, TEST) for argument in node.args]
+                 + [render(keyword) for keyword in node.keywords])
+
+    return [render_expression(node.func, ATOM), comma_group(arguments, "(", ")")]
+
+
+def render_keyword(node):
+    if node.arg is None:
+        return ["**", render_expression(node.value, TEST)]
+
+    return [node.arg, "=", render_expression(node.value, TEST)]
+
+
+def render_JoinedStr(node):
+    parts = fstring_parts(node)
+
+    # Before python 3.12 the expressions in an f-string can't use its
+    # quotes (or backslashes), so the quotes must be ones they don't use
+    expressions = [part for (is_expression, part) in parts if is_expression]
+    quote = next((quote for quote in ["'", '"', "'''", '"""']
+                  if not any(quote in expression for expression in expressions)),
+                 "'")
+
+    return "f" + quote + "".join(
+            part if is_expression else escape(part, quote)
+            for (is_expression, part) in parts) + quote
+
+
+def render_FormattedValue(node):
+    # Only happens if it's rendered on its own
+    return render_JoinedStr(ast.JoinedStr(values=[node]))
+
+
+def fstring_parts(node):
+    """The (is_expression, text) parts of the inside of an f-string
+    (The cursor goes in the text too)"""
+
+    parts = []
+    for value in node.values:
+        if isinstance(value, ast.Constant):
+            value_parts = [(False, value.value.replace("{", "{{").replace("}", "}}"))]
+
+        else:
+            expression = layout(render_expression(value.value, TEST + 1), INFINITE_WIDTH)
+            # {{ would be a brace
+            if expression.startswith("{"):
+                expression = " " + expression
+
+            value_parts = [(True, "{" + expression)]
+
+            if value.conversion != -1:
+                value_parts.append((True, "!" + chr(value.conversion)))
+
+            if value.format_spec is not None:
+                value_parts.append((True, ":"))
+                value_parts.extend(
+                        with_cursor_parts(value.format_spec, fstring_parts(value.format_spec)))
+
+            value_parts.append((True, "}"))
+
+        parts.extend(with_cursor_parts(value, value_parts))
+
+    return parts
+
+
+def with_cursor_parts(node, parts):
+    if selected_node is node:
+        return [(True, CURSOR_START)] + parts + [(True, CURSOR_END)]
+
+    return parts
+
+
+def escape(text, quote):
+    escaped = []
+    for character in text:
+        if character == "\\" or character in quote:
+            escaped.append("\\" + character)
+        elif character == "\n" and len(quote) == 3:
+            escaped.append(character)
+        elif character.isprintable():
+            escaped.append(character)
+        else:
+            escaped.append(repr(character)[1:-1])
+
+    return "".join(escaped)
+
+
+def render_Constant(node):
+    value = node.value
+
+    if value is Ellipsis:
+        return "..."
+
+    if isinstance(value, float) or isinstance(value, complex):
+        # Infinity doesn't have a literal, but a big enough number overflows into it
+        return repr(value).replace("inf", "1e309")
+
+    prefix = "u" if getattr(node, "kind", None) == "u" else ""
+    return prefix + repr(value)
+
+
+def render_Attribute(node):
+    value = render_expression(node.value, ATOM)
+
+    # Otherwise the dot would be read as a decimal point
+    if isinstance(node.value, ast.Constant) and type(node.value.value) == int:
+        value = ["(", value, ")"]
+
+    return [value, ".", node.attr]
+
+
+def render_Subscript(node):
+    # A tuple in a subscript doesn't need parentheses (It can't have
+    # them if there are slices in it), the brackets are enough
+    if isinstance(node.slice, ast.Tuple) and node.slice.elts:
+        index = with_cursor(node.slice, render_tuple(node.slice, "", ""))
+    else:
+        index = render_expression(node.slice, TUPLE)
+
+    return [render_expression(node.value, ATOM), "[", index, "]"]
+
+
+def render_Starred(node):
+    return ["*", render_expression(node.value, BOR)]
+
+
+def render_Name(node):
+    return node.id
+
+
+def render_List(node):
+    return comma_group([render_expression(element, TEST) for element in node.elts], "[", "]")
+
+
+def render_Tuple(node):
+    # The parentheses are only needed if the elements don't fit in the line
+    return render_tuple(node, Choice("", "("), Choice("", ")"))
+
+
+def render_tuple(node, opening, closing):
+    if not node.elts:
+        return "()"
+
+    elements = [render_expression(element, TEST) for element in node.elts]
+
+    # A single element needs a comma to be a tuple
+    if len(elements) == 1:
+        return [opening, elements[0], ",", closing]
+
+    return comma_group(elements, opening, closing)
+
+
+def render_Slice(node):
+    documents = [
+        [] if node.lower is None else render_expression(node.lower, TEST),
+        ":",
+        [] if node.upper is None else render_expression(node.upper, TEST),
+        ]
+
+    if node.step is not None:
+        documents.extend([":", render_expression(node.step, TEST)])
+
+    return documents
+
+
+# Arguments
+
+def render_arguments(node):
+    return comma_group(argument_documents(node, with_annotations=True))
+
+
+def render_lambda_arguments(node):
+    # Lambdas can't have annotations (and can't be broken into lines)
+    return join(", ", argument_documents(node, with_annotations=False))
+
+
+def argument_documents(node, with_annotations):
+    def argument(arg, default=None):
+        document = render(arg) if with_annotations else with_cursor(arg, arg.arg)
+        if default is None:
+            return document
+
+        # PEP 8 puts spaces around the = only if there's an annotation
+        has_annotation = with_annotations and arg.annotation is not None
+        equals = " = " if has_annotation else "="
+        return [document, equals, render_expression(default, TEST)]
+
+    positional = node.posonlyargs + node.args
+    defaults = [None] * (len(positional) - len(node.defaults)) + node.defaults
+
+    documents = []
+    for index, (arg, default) in enumerate(zip(positional, defaults)):
+        documents.append(argument(arg, default))
+
+        if index == len(node.posonlyargs) - 1:
+            documents.append("/")
+
+    if node.vararg is not None:
+        documents.append(["*", argument(node.vararg)])
+    elif node.kwonlyargs:
+        # The keyword only arguments go after a lonely *
+        documents.append("*")
+
+    for arg, default in zip(node.kwonlyargs, node.kw_defaults):
+        documents.append(argument(arg, default))
+
+    if node.kwarg is not None:
+        documents.append(["**", argument(node.kwarg)])
+
+    return documents
+
+
+def render_arg(node):
+    if node.annotation is None:
+        return node.arg
+
+    return [node.arg, ": ", render_expression(node.annotation, TEST)]
+
+
+def is_definition(node):
+    return (isinstance(node, ast.FunctionDef)
+            or isinstance(node, ast.AsyncFunctionDef)
+            or isinstance(node, ast.ClassDef))
+
+
+def is_import(node):
+    return isinstance(node, ast.Import) or isinstance(node, ast.ImportFrom)
 
 
-def newline_join(iterable): return '\n'.join(iterable) 
+# node type -> the function that renders it
+# (Built once, instead of looking up the function by name for every node)
+renderers_by_type = {
+    getattr(ast, name[len("render_"):]): function
+    for (name, function) in list(globals().items())
+    if name.startswith("render_") and isinstance(getattr(ast, name[len("render_"):], None), type)
+}
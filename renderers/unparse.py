@@ -0,0 +1,121 @@
+import ast
+import inspect
+from copy import deepcopy
+
+from buffer_writer import lines_of
+
+CURSOR_START = "<<<"
+CURSOR_END = ">>>"
+
+# CursorUnparser hooks into these methods of ast's unparser, which is private.
+# Without them (or if they take other arguments) the view is plain
+# ast.unparse, without the cursor in it
+hooks = {
+        "traverse": ["self", "node"],
+        "fill": ["self", "text"],
+        "write": ["self", "text"],
+        "get_type_comment": ["self", "node"],
+        }
+
+
+def has_hooks():
+    unparser = getattr(ast, "_Unparser", None)
+
+    try:
+        return all(list(inspect.signature(getattr(unparser, name)).parameters) == parameters
+                   for (name, parameters) in hooks.items())
+    except (AttributeError, TypeError, ValueError):
+        return False
+
+
+def render_view(tree, selected_node, _, viewport=None):
+    # Ignore the window width, ast.unparse doesn't break the lines
+    return unparse(tree, selected_node)
+
+
+def render_view_lines(tree, selected_node, window_width, viewport=None):
+    """Same as render_view, but yields the lines as each top level
+    statement is unparsed"""
+
+    if not isinstance(tree, ast.Module) or selected_node is tree:
+        return iter(render_view(tree, selected_node, window_width).split("\n"))
+
+    return lines_of(statement_pieces(tree, selected_node))
+
+
+def statement_pieces(tree, selected_node):
+    """The text of the module, unparsed a top level statement at a time"""
+
+    for position, statement in enumerate(tree.body):
+        if position == 0:
+            # (It might be the docstring)
+            yield unparse(ast.Module(body=[statement], type_ignores=tree.type_ignores),
+                          selected_node)
+            continue
+
+        # After a statement, ast.unparse puts a newline before the next one
+        # (and a blank line before a definition), so it goes after a pass
+        # that's taken out afterwards
+        text = unparse(ast.Module(body=[ast.Pass(), statement], type_ignores=tree.type_ignores),
+                       selected_node)
+        yield text[len("pass"):]
+
+
+def render_standard(tree):
+    source = unparse(tree)
+
+    # Like astor, the file ends with a newline
+    return source + "\n" if source else source
+
+
+def unparse(tree, selected_node=None):
+    if CursorUnparser is None:
+        # (ast.unparse needs the line numbers the editor's nodes don't have)
+        return ast.unparse(ast.fix_missing_locations(deepcopy(tree)))
+
+    return CursorUnparser(selected_node).visit(tree)
+
+
+if has_hooks():
+    class CursorUnparser(ast._Unparser):
+        """ast.unparse, but with the selected node between the cursor markers
+        (and it doesn't need the nodes to have line numbers)"""
+
+        def __init__(self, selected_node=None, **kwargs):
+            # (The f-strings are unparsed with one of these of their own, without a selected node)
+            super().__init__(**kwargs)
+            self.selected_node = selected_node
+
+            # Statements start with a newline and the indentation,
+            # so their marker waits for the next fill
+            self.cursor_pending = False
+
+        def traverse(self, node):
+            if node is not self.selected_node or isinstance(node, list):
+                return super().traverse(node)
+
+            if isinstance(node, (ast.stmt, ast.excepthandler, ast.match_case)):
+                self.cursor_pending = True
+            else:
+                self.write(CURSOR_START)
+
+            super().traverse(node)
+            self.write(CURSOR_END)
+
+        def fill(self, text=""):
+            if self.cursor_pending:
+                self.cursor_pending = False
+                text = CURSOR_START + text
+
+            super().fill(text)
+
+        def get_type_comment(self, node):
+            # The nodes made by the editor don't have line numbers,
+            # which is what ast.unparse looks for the type ignores with
+            if getattr(node, "lineno", None) is None:
+                comment = getattr(node, "type_comment", None)
+                return None if comment is None else f" # type: {comment}"
+
+            return super().get_type_comment(node)
+else:
+    CursorUnparser = None
@@ -2,11 +2,30 @@ from copy import deepcopy
 from hypothesis import strategies as st
 from hypothesis import given, settings, example
 import ast
+import gc
+import time
+import keyword
+import weakref
 from os import listdir
 
 import renderer
 import actions
+import make_nodes
 import core_logic
+import validity
+import validators
+from indexed_tree import IndexedTree
+from banned_nodes import banned_nodes
+from renderers import strender
+import renderers.standard
+import astor
+import buffer_writer
+from folds import foldable_types
+import prerender
+from prerender import Prerenderer
+from history import History, size_of as history_size_of
+import latency_budget
+from latency_budget import LatencyBudget
 
 
 example_python_files = listdir("python_file_examples")
@@ -25,10 +44,33 @@ for name, tree in trees:
 [f.close() for (name, f) in files]
 
 
+def example_tree(name, source):
+    tree = ast.parse(source)
+    tree.states_for_actions = {}
+    return (name, tree)
+
+
 def get_action_info(action_name):
     return actions.actions[action_name]
 
 
+def apply_actions(tree, list_of_action_names, cursor_trail=None):
+    """Does the actions one after the other, with "USER_INPUT" as
+    whatever they ask the user for. Returns the cursor trail and the
+    tree (Which some actions replace)"""
+
+    get_vim_input = lambda x : "USER_INPUT"
+    if cursor_trail is None:
+        cursor_trail = []
+
+    for action_name in list_of_action_names:
+        action_function, is_local = get_action_info(action_name)
+        cursor_trail, tree = core_logic.core_act(
+                action_function, is_local, cursor_trail, tree, get_vim_input)
+
+    return cursor_trail, tree
+
+
 list_of_action_names_strategy = st.lists(
                 st.sampled_from(list(actions.actions)),
             )
@@ -86,9 +128,784 @@ def action_sequence_keeps_ast_valid(file, list_of_action_names):
         raise exception
 
 
+# The index is kept up to date as the tree changes, so after every action
+# it has to be the same as indexing the tree from scratch
+@settings(max_examples=300, deadline=None)
+@given(st.builds(deepcopy, st.sampled_from(trees)), list_of_action_names_strategy)
+# Making a comprehension async puts the same node back where it was
+@example(example_tree("async_comprehension.py", "async def f():\n    y = [x for x in z]\n"),
+         ["cursor_down", "cursor_down", "cursor_right", "cursor_down", "cursor_right",
+          "cursor_down", "cursor_right", "make_async", "cursor_down", "rename"])
+# Parsing shares the op nodes, which is why they aren't children
+@example(example_tree("shared_op.py", "a not in b\nc not in d\n"), ["cursor_down", "delete"])
+def index_matches_a_fresh_walk(file, list_of_action_names):
+    name, tree = file
+
+    cursor_trail = []
+
+    for action_name in list_of_action_names:
+        cursor_trail, tree = apply_actions(tree, [action_name], cursor_trail)
+
+        index = core_logic.get_index(tree)
+        fresh = IndexedTree(tree)
+        assert index.parents == fresh.parents, action_name
+        assert index.positions == fresh.positions, action_name
+
+        # The handle of the selected node has to lead back to it
+        selected_node = core_logic.get_node_at_cursor(cursor_trail, tree)
+        handle = core_logic.get_handle_at_cursor(cursor_trail, tree)
+        assert core_logic.get_node_at_cursor(
+                core_logic.get_cursor_trail(handle, tree), tree) is selected_node, action_name
+
+
+# The child lists are cached, so after every action they have to be
+# the same as listing the children again
+@settings(max_examples=200, deadline=None)
+@given(st.builds(deepcopy, st.sampled_from(trees)), list_of_action_names_strategy)
+def children_match_listing_them_again(file, list_of_action_names):
+    name, tree = file
+
+    cursor_trail = []
+
+    for action_name in list_of_action_names:
+        cursor_trail, tree = apply_actions(tree, [action_name], cursor_trail)
+
+        for node in ast.walk(tree):
+            children = [child for child in ast.iter_child_nodes(node)
+                        if type(child) not in banned_nodes]
+            assert core_logic.list_children(node) == children, action_name
+
+
+# The index remembers the field and the index of every child,
+# so after every action it has to be where going through the fields finds it
+@settings(max_examples=200, deadline=None)
+@given(st.builds(deepcopy, st.sampled_from(trees)), list_of_action_names_strategy)
+def slots_match_going_through_the_fields(file, list_of_action_names):
+    name, tree = file
+
+    cursor_trail = []
+
+    for action_name in list_of_action_names:
+        cursor_trail, tree = apply_actions(tree, [action_name], cursor_trail)
+
+        index = core_logic.get_index(tree)
+        for parent in ast.walk(tree):
+            for child in core_logic.list_children(parent):
+                # (Without the tree, get_field_name_for_child goes through the fields)
+                assert (index.slot_of(parent, child)
+                        == core_logic.get_field_name_for_child(parent, child)), action_name
+
+
+# The within and context checks answer from the ancestor path kept for the
+# cursor, so after every action they have to say what going up from the
+# selected node again says
+@settings(max_examples=200, deadline=None)
+@given(st.builds(deepcopy, st.sampled_from(trees)), list_of_action_names_strategy)
+def ancestor_checks_match_going_up_again(file, list_of_action_names):
+    name, tree = file
+
+    cursor_trail = []
+
+    for action_name in list_of_action_names:
+        cursor_trail, tree = apply_actions(tree, [action_name], cursor_trail)
+
+        nodes = [tree]
+        for n in cursor_trail:
+            nodes.append(core_logic.get_nth_children_wrapping_around(nodes[-1], n))
+
+        fields = [core_logic.get_field_name_for_child(parent, child)[0]
+                  for (parent, child) in zip(nodes, nodes[1:])]
+
+        types = set(map(type, nodes)) | {ast.Assign, ast.For, ast.FunctionDef, ast.Lambda}
+        for node_type in types:
+            assert (core_logic.core_is_within(cursor_trail, tree, node_type)
+                    == uncompiled_check(("is_within", node_type), nodes)), action_name
+
+        type_fields = set(zip(map(type, nodes), fields)) | {(ast.Assign, "targets"), (ast.For, "target")}
+        for node_type, field in type_fields:
+            assert (core_logic.core_is_within_field(cursor_trail, tree, node_type, field)
+                    == uncompiled_check(("is_within_field", node_type, field), nodes)), action_name
+
+        context = next((node.ctx for node in reversed(nodes[1:])
+                        if getattr(node, "ctx", False)), None)
+        assert core_logic.get_immediate_context(cursor_trail, tree) is context, action_name
+
+        # The closest assignment decides if it's being assigned to
+        closest_assign_field = next((field for (node, field) in reversed(list(zip(nodes, fields)))
+                                     if isinstance(node, ast.Assign)), None)
+        assert (core_logic.is_being_assigned_to(cursor_trail, tree)
+                == (closest_assign_field == "targets")), action_name
+
+
+# is_valid_ast only compiles what changed since the last check,
+# so check it after every action against compiling a copy of the whole thing
+@settings(max_examples=300, deadline=None)
+@given(st.builds(deepcopy, st.sampled_from(trees)), list_of_action_names_strategy)
+# A global in the body of an if still relates it to the statements before it
+@example(example_tree("global_in_if.py", "global_var = 1\nif c:\n    pass\n"),
+         ["cursor_down", "cursor_right", "cursor_down", "cursor_right", "make_global"])
+def incremental_validity_matches_compiling(file, list_of_action_names):
+    name, tree = file
+
+    cursor_trail = []
+
+    for action_name in list_of_action_names:
+        cursor_trail, tree = apply_actions(tree, [action_name], cursor_trail)
+
+        was_valid, _ = core_logic.is_valid_ast(tree)
+        should_be_valid, _ = validity.compile_check(deepcopy(tree))
+        assert was_valid == should_be_valid, action_name
+
+
+def contexts(tree):
+    return [(type(node).__name__, type(node.ctx).__name__)
+            for node in ast.walk(tree) if hasattr(node, "ctx")]
+
+
+def fix_every_context(tree):
+    """A copy of the tree with the ctx of every node set again from its slot,
+    going down from the Module (So the lists and tuples have theirs
+    before their elements inherit it)"""
+
+    # (Only the nodes, not the index and the history of the tree)
+    tree = ast.Module(body=deepcopy(tree.body), type_ignores=[])
+
+    to_fix = [tree]
+    while to_fix:
+        parent = to_fix.pop()
+        for field_name, value in ast.iter_fields(parent):
+            for child in (value if isinstance(value, list) else [value]):
+                if not isinstance(child, ast.AST):
+                    continue
+
+                if "ctx" in child._fields:
+                    child.ctx = core_logic.get_context_for_slot(parent, field_name)()
+                to_fix.append(child)
+
+    return tree
+
+
+# The ctx of every node is kept right as the tree changes, so after
+# each action it has to be the same as fixing every ctx in the tree
+@settings(max_examples=200, deadline=None)
+@given(st.builds(deepcopy, st.sampled_from(trees)), list_of_action_names_strategy)
+# A tuple put as an assignment target stores its elements too
+@example(example_tree("tuple_target.py", "a = (b, c)\n"),
+         ["cursor_down", "cursor_down", "cursor_right", "yank", "cursor_left", "put"])
+def contexts_match_fixing_all_of_them(file, list_of_action_names):
+    name, tree = file
+
+    cursor_trail = []
+
+    for action_name in list_of_action_names:
+        cursor_trail, tree = apply_actions(tree, [action_name], cursor_trail)
+
+        assert contexts(tree) == contexts(fix_every_context(tree)), action_name
+
+
+# The ctx of every node is kept right as the tree changes,
+# so after each action it has to be the ctx parsing the code gives
+@settings(max_examples=100, deadline=None)
+@given(st.builds(deepcopy, st.sampled_from(trees)), list_of_action_names_strategy)
+# An assignment target that becomes the value of an attribute or a subscript is loaded
+@example(example_tree("attribute_target.py", "x = 1\n"),
+         ["cursor_down", "cursor_down", "make_attribute"])
+@example(example_tree("subscript_target.py", "x = 1\n"),
+         ["cursor_down", "cursor_down", "make_subscript"])
+def contexts_match_parsing(file, list_of_action_names):
+    name, tree = file
+
+    cursor_trail = []
+
+    for action_name in list_of_action_names:
+        cursor_trail, tree = apply_actions(tree, [action_name], cursor_trail)
+
+        parsed = ast.parse(renderer.render_standard(tree))
+        assert contexts(tree) == contexts(parsed), action_name
+
+
+# Undoing every action should give back the original tree,
+# and redoing them all should give back the edited one
+@settings(max_examples=500, deadline=None)
+@given(st.builds(deepcopy, st.sampled_from(trees)), list_of_action_names_strategy)
+def undo_and_redo_restore_the_tree(file, list_of_action_names):
+    name, tree = file
+
+    original = ast.dump(tree)
+
+    cursor_trail, tree = apply_actions(tree, list_of_action_names)
+
+    def act(action_name):
+        nonlocal cursor_trail, tree
+        cursor_trail, tree = apply_actions(tree, [action_name], cursor_trail)
+
+    # (The actions might have undone something themselves)
+    while tree.history.redo_stack:
+        act("redo")
+
+    edited = ast.dump(tree)
+
+    while tree.history.undo_stack:
+        act("undo")
+
+    assert ast.dump(tree) == original
+
+    while tree.history.redo_stack:
+        act("redo")
+
+    assert ast.dump(tree) == edited
+
+
+# The history forgets the oldest actions once the nodes they hold
+# on to go over the limit (Deleting a big node counts all of it)
+@settings(max_examples=300, deadline=None)
+@given(st.builds(deepcopy, st.sampled_from(trees)),
+       list_of_action_names_strategy,
+       st.integers(min_value=1, max_value=200))
+def history_keeps_to_its_size(file, list_of_action_names, max_nodes):
+    name, tree = file
+
+    tree.history = History(max_nodes=max_nodes)
+    cursor_trail, tree = apply_actions(tree, list_of_action_names)
+
+    history = tree.history
+    stacks = list(history.undo_stack) + history.redo_stack
+    assert history.size == sum(history_size_of(action[2]) for action, size in stacks)
+
+    undo_size = sum(size for action, size in history.undo_stack)
+    assert undo_size <= max_nodes or len(history.undo_stack) == 1
+
+
+# Yanking doesn't copy, so make sure that what's in the yank ring
+# stays the same no matter what happens to the tree afterwards
+@settings(max_examples=500, deadline=None)
+@given(st.builds(deepcopy, st.sampled_from(trees)),
+       st.lists(st.sampled_from(list(actions.actions) + ["yank", "put"] * 5)))
+def yanked_nodes_dont_change(file, list_of_action_names):
+    name, tree = file
+
+    cursor_trail = []
+
+    # Yank -> how it looked when it got yanked
+    yanked = {}
+
+    for action_name in ["cursor_down"] + list_of_action_names:
+        cursor_trail, tree = apply_actions(tree, [action_name], cursor_trail)
+
+        if action_name in ("yank", "yank_to_register"):
+            yank = tree.states_for_actions["yank_ring"].latest()
+            yanked[yank] = ast.dump(yank.node)
+
+    for yank, dump in yanked.items():
+        assert ast.dump(yank.node) == dump
+
+
+# The actions that applicable_actions leaves out must not do anything
+# (The exhaustive tests skip them)
+@settings(max_examples=1000, deadline=None)
+@given(st.builds(deepcopy, st.sampled_from(trees)),
+       list_of_action_names_strategy,
+       st.sampled_from(list(actions.actions)))
+def inapplicable_actions_do_nothing(file, list_of_action_names, last_action_name):
+    name, tree = file
+
+    cursor_trail, tree = apply_actions(tree, list_of_action_names)
+
+    if last_action_name in actions.applicable_actions(cursor_trail, tree):
+        return
+
+    before = ast.dump(tree)
+    selected_node = core_logic.get_node_at_cursor(cursor_trail, tree)
+
+    cursor_trail, tree = apply_actions(tree, [last_action_name], cursor_trail)
+
+    assert ast.dump(tree) == before
+    assert core_logic.get_node_at_cursor(cursor_trail, tree) is selected_node
+
+
+def uncompiled_check(spec, nodes):
+    """What the validator with the spec says, checked like the validators
+    did before they were compiled: looking at the nodes on the way
+    from the module to the selected node (nodes) every time"""
+
+    kind = spec[0]
+    selected_node = nodes[-1]
+
+    if kind == "is_instance_of":
+        return isinstance(selected_node, spec[1])
+    if kind == "is_not_instance_of":
+        return not isinstance(selected_node, spec[1])
+    if kind == "is_within":
+        return any(type(node) == spec[1] for node in nodes[:-1])
+    if kind == "is_within_field":
+        return any(isinstance(parent, spec[1])
+                   and any(child is value or (isinstance(value, list) and child in value)
+                           for (field, value) in ast.iter_fields(parent) if field == spec[2])
+                   for (parent, child) in zip(nodes, nodes[1:]))
+    if kind in ("is_in_context", "is_not_in_context"):
+        # The ctx of the closest node that has one (The module doesn't count)
+        context = next((type(node.ctx) for node in reversed(nodes[1:])
+                        if getattr(node, "ctx", False)), None)
+        return (context == spec[1]) == (kind == "is_in_context")
+    if kind == "one_of":
+        return any(uncompiled_check(validator.spec, nodes) for validator in spec[1])
+    if kind == "all_of":
+        return all(uncompiled_check(validator.spec, nodes) for validator in spec[1])
+    if kind == "not":
+        return not uncompiled_check(spec[1].spec, nodes)
+
+    raise ValueError(kind)
+
+
+# The make_* entries of the applicability table (compiled validators,
+# remembered by the signature of the path) have to say the same as the
+# validators did before they were compiled, at any cursor position
+@settings(max_examples=300, deadline=None)
+@given(st.builds(deepcopy, st.sampled_from(trees)),
+       list_of_action_names_strategy,
+       st.lists(st.integers(min_value=0, max_value=20)))
+def applicability_matches_the_old_validators(file, list_of_action_names, descent):
+    name, tree = file
+
+    cursor_trail, tree = apply_actions(tree, list_of_action_names)
+
+    # Go further down from wherever the actions left the cursor
+    nodes = [tree]
+    for n in cursor_trail:
+        nodes.append(core_logic.get_nth_children_wrapping_around(nodes[-1], n))
+
+    for n in descent:
+        children = core_logic.list_children(nodes[-1])
+        if not children:
+            break
+
+        cursor_trail = cursor_trail + [n % len(children)]
+        nodes.append(children[n % len(children)])
+
+    for node_name, (validator, creator) in make_nodes.nodes.items():
+        can_make = actions.applicability["make_" + node_name](cursor_trail, tree)
+
+        should_make = (not isinstance(nodes[-1], ast.Module)
+                       and uncompiled_check(validator.spec, nodes))
+        assert can_make == should_make, node_name
+
+
+# Whatever the width, strender's output has to be the same code
+@settings(max_examples=300, deadline=None)
+@given(st.builds(deepcopy, st.sampled_from(trees)),
+       list_of_action_names_strategy,
+       st.integers(min_value=1, max_value=200))
+def strender_output_parses_back(file, list_of_action_names, window_width):
+    name, tree = file
+
+    cursor_trail, tree = apply_actions(tree, ["cursor_down"] + list_of_action_names)
+
+    rendered = strender.render_view(tree, None, window_width)
+    assert ast.dump(ast.parse(rendered)) == ast.dump(tree)
+
+    # Another width reuses the document, and has to look the same
+    # as building it from scratch
+    resized = strender.render_view(tree, None, window_width + 20)
+    strender.last_document = (None, None)
+    strender.statement_documents.clear()
+    assert resized == strender.render_view(tree, None, window_width + 20)
+
+
+# A group is only flat if it fits along with what follows it up to the next
+# line break, so when a statement fits with every group broken,
+# it has to fit at that width too
+@settings(max_examples=300, deadline=None)
+@given(st.builds(deepcopy, st.sampled_from(trees)),
+       list_of_action_names_strategy,
+       st.integers(min_value=1, max_value=120))
+@example(example_tree("closing_parenthesis.py", "def function(argument, another):\n    pass\n"),
+         [], len("def function(argument, another)"))
+def strender_lines_fit_when_they_can(file, list_of_action_names, window_width):
+    name, tree = file
+
+    cursor_trail, tree = apply_actions(tree, ["cursor_down"] + list_of_action_names)
+
+    for statement in tree.body:
+        document = strender.render(statement)
+        if max(map(len, strender.layout(document, 0).split("\n"))) > window_width:
+            continue
+
+        lines = strender.layout(document, window_width).split("\n")
+        assert max(map(len, lines)) <= window_width, lines
+
+
+# The lines in the viewport have to be the same as when rendering
+# everything, and the rest have to take as many lines as they would
+@settings(max_examples=300, deadline=None)
+@given(st.builds(deepcopy, st.sampled_from(trees)),
+       list_of_action_names_strategy,
+       st.integers(min_value=0, max_value=300),
+       st.integers(min_value=0, max_value=100))
+def viewport_has_the_same_lines(file, list_of_action_names, first_line, window_height):
+    name, tree = file
+
+    cursor_trail, tree = apply_actions(tree, ["cursor_down"] + list_of_action_names)
+
+    selected_node = core_logic.get_node_at_cursor(cursor_trail, tree)
+    last_line = first_line + window_height
+
+    lines = list(renderer.render_view_lines(tree, selected_node, 80))
+    viewport_lines = list(renderer.render_view_lines(
+            tree, selected_node, 80, (first_line, last_line)))
+
+    assert len(viewport_lines) == len(lines)
+    assert viewport_lines[first_line:last_line + 1] == lines[first_line:last_line + 1]
+
+
+# The span of the selected node has to be within the view,
+# and a name has to be there
+@settings(max_examples=300, deadline=None)
+@given(st.builds(deepcopy, st.sampled_from(trees)), list_of_action_names_strategy)
+def span_points_to_the_selected_node(file, list_of_action_names):
+    name, tree = file
+
+    cursor_trail, tree = apply_actions(tree, ["cursor_down"] + list_of_action_names)
+
+    selected_node = core_logic.get_node_at_cursor(cursor_trail, tree)
+    span = renderer.span_of(tree, selected_node)
+    if span is None:
+        return
+
+    lines = list(renderer.render_view_lines(tree, None, 80))
+    start_line, start_column, end_line, end_column = span
+
+    assert 0 <= start_line <= end_line <= len(lines)
+
+    if isinstance(selected_node, ast.Name):
+        line = lines[start_line].encode()
+        assert line[start_column:end_column].decode() == selected_node.id
+
+
+# The tokens of each line have to be for the text in the view,
+# and be what their category says
+@settings(max_examples=100, deadline=None)
+@given(st.builds(deepcopy, st.sampled_from(trees)), list_of_action_names_strategy)
+def tokens_match_the_view(file, list_of_action_names):
+    name, tree = file
+
+    cursor_trail, tree = apply_actions(tree, list_of_action_names)
+
+    lines = list(renderer.render_view_lines(tree, None, 80))
+
+    for line_number, line in enumerate(lines):
+        line_tokens = renderer.tokens_of_line(tree, line_number)
+        if line_tokens is None:
+            continue
+
+        text, tokens = line_tokens
+        assert text == line
+
+        for start, end, category in tokens:
+            token = line.encode()[start:end].decode()
+            if category == "keyword":
+                assert keyword.iskeyword(token)
+            elif category == "number":
+                assert token[0].isdigit() or token[0] == "."
+
+
+# A list that's too long is elided in the view unless the cursor is in it,
+# and is always whole in what gets saved
+@settings(max_examples=50, deadline=None)
+@given(st.integers(min_value=0, max_value=200), st.integers(min_value=0))
+def long_lists_are_elided(length, position):
+    tree = ast.parse("x = [" + ", ".join(map(str, range(length))) + "]\nprint(x)")
+    elements = tree.body[0].value.elts
+
+    view = renderer.render_view(tree, None, 80)
+    assert ("more elements" in view) == (length > renderers.standard.max_shown_elements)
+    assert renderer.render_standard(tree) == astor.to_source(tree)
+
+    if elements:
+        selected_node = elements[position % length]
+        view = renderer.render_view(tree, selected_node, 80)
+        assert "more elements" not in view
+        # (astor might break the line within the cursor)
+        assert "<<<" + str(position % length) + ">>>" in "".join(view.split())
+
+    # Changing the limit after rendering doesn't leave the old view in the cache
+    limits = (renderers.standard.max_shown_elements, renderers.standard.max_shown_characters)
+    renderer.elide_beyond(10, limits[1])
+    try:
+        view = renderer.render_view(tree, None, 80)
+        assert ("more elements" in view) == (length > 10)
+    finally:
+        renderer.elide_beyond(*limits)
+
+
+# A folded statement is a single line in the view (without its decorators),
+# and what gets saved doesn't change
+@settings(max_examples=100, deadline=None)
+@given(st.builds(deepcopy, st.sampled_from(trees)), list_of_action_names_strategy)
+def folds_are_one_line(file, list_of_action_names):
+    name, tree = file
+
+    cursor_trail, tree = apply_actions(tree, list_of_action_names)
+
+    saved = renderer.render_standard(tree)
+
+    index = core_logic.get_index(tree)
+    folds = core_logic.get_folds(tree)
+    for statement in tree.body:
+        if isinstance(statement, foldable_types) and statement not in folds:
+            folds.toggle(statement, index)
+
+    lines = list(renderer.render_view_lines(tree, None, 80))
+    assert renderer.render_standard(tree) == saved
+
+    for statement in tree.body:
+        if statement in folds:
+            span = renderer.span_of(tree, statement)
+            if span is not None:
+                decorators = len(getattr(statement, "decorator_list", []))
+                assert span[2] - span[0] == decorators
+                assert lines[span[2]].endswith(" ...")
+
+
+# The renderers' caches can't keep a tree alive after it's gone
+# (Like the copies :CompareBackends renders)
+@settings(max_examples=50, deadline=None)
+@given(st.sampled_from(trees), list_of_action_names_strategy)
+def caches_dont_keep_trees_alive(file, list_of_action_names):
+    name, tree = file
+
+    cursor_trail, tree = apply_actions(deepcopy(tree), list_of_action_names)
+    selected_node = core_logic.get_node_at_cursor(cursor_trail, tree)
+
+    for backend in renderer.backends.values():
+        backend.render_view(tree, selected_node, 80)
+        backend.render_view(tree, None, 80)
+        backend.render_standard(tree)
+
+    renderer.span_of(tree, selected_node)
+    renderer.tokens_of_line(tree, 0)
+
+    tree_reference = weakref.ref(tree)
+    node_reference = weakref.ref(selected_node)
+    del tree, selected_node
+    gc.collect()
+
+    assert tree_reference() is None
+    assert node_reference() is None
+
+
+# What every backend saves has to parse back to the same tree,
+# and its view has to be the same streamed or not
+@settings(max_examples=100, deadline=None)
+@given(st.builds(deepcopy, st.sampled_from(trees)), list_of_action_names_strategy)
+def backends_round_trip(file, list_of_action_names):
+    name, tree = file
+
+    cursor_trail, tree = apply_actions(tree, list_of_action_names)
+
+    selected_node = core_logic.get_node_at_cursor(cursor_trail, tree)
+
+    for backend_name, backend in renderer.backends.items():
+        source = backend.render_standard(tree)
+        assert ast.dump(ast.parse(source)) == ast.dump(tree), backend_name
+
+        # The lines come a statement at a time, but they're the same view
+        lines = backend.render_view_lines(tree, selected_node, 80)
+        assert "\n".join(lines) == backend.render_view(tree, selected_node, 80), backend_name
+
+
+# The views rendered ahead of time have to be the ones the
+# renderer gives, and an edit has to make them go away
+@settings(max_examples=100, deadline=None)
+@given(st.builds(deepcopy, st.sampled_from(trees)), list_of_action_names_strategy)
+def prerendered_views_match(file, list_of_action_names):
+    name, tree = file
+
+    cursor_trail, tree = apply_actions(tree, list_of_action_names)
+
+    prerenderer = Prerenderer()
+    prerenderer.start(tree, cursor_trail, 80, None)
+    while prerenderer.render_next(tree, 80, None):
+        pass
+
+    for node in prerender.neighbours_of(cursor_trail, tree):
+        view = prerenderer.view_of(tree, node, 80, None)
+        assert view == list(renderer.render_view_lines(tree, node, 80))
+
+        # A different window needs a different view
+        assert prerenderer.view_of(tree, node, 81, None) is None
+
+    core_logic.get_index(tree).touch(tree)
+    for node in prerender.neighbours_of(cursor_trail, tree):
+        assert prerenderer.view_of(tree, node, 80, None) is None
+
+
+# Saving in processes has to give the same text as saving in this one
+@settings(max_examples=20, deadline=None)
+@given(st.builds(deepcopy, st.sampled_from(trees)), list_of_action_names_strategy)
+def saving_in_processes_gives_the_same_text(file, list_of_action_names):
+    name, tree = file
+
+    cursor_trail, tree = apply_actions(tree, list_of_action_names)
+
+    source = renderer.render_standard(tree)
+
+    standard = renderers.standard
+    settings_before = (standard.min_statements_for_processes, standard.statements_per_chunk)
+
+    # Nothing cached, and small chunks, so they all get rendered in processes
+    standard.statement_cache = standard.StatementCache()
+    standard.min_statements_for_processes = 0
+    standard.statements_per_chunk = 3
+    renderer.save_in_processes(2)
+    try:
+        assert renderer.render_standard(tree) == source
+    finally:
+        renderer.save_in_processes(1)
+        standard.min_statements_for_processes, standard.statements_per_chunk = settings_before
+
+
+# The latency budget turns on one cheaper mode per keystroke over budget,
+# logs every switch, and only turns one off again after
+# enough rendered keystrokes with room to spare
+@settings(max_examples=200, deadline=None)
+@given(st.lists(st.tuples(st.floats(min_value=0, max_value=0.05), st.booleans())))
+def latency_budget_switches_one_mode_at_a_time(keystrokes):
+    log = []
+    budget = LatencyBudget(0.016, ["deferred_highlighting", "viewport_only"], log.append)
+
+    fast_keystrokes = 0
+    switches = 0
+    for seconds, rendered in keystrokes:
+        level_before = budget.level
+
+        budget.start()
+        budget.record("render", seconds)
+        budget.finish(rendered)
+
+        if seconds > budget.budget:
+            fast_keystrokes = 0
+            assert budget.level == min(level_before + 1, len(budget.modes))
+        elif seconds < budget.budget * latency_budget.headroom and rendered:
+            fast_keystrokes += 1
+            if fast_keystrokes >= latency_budget.keystrokes_to_recover and level_before > 0:
+                fast_keystrokes = 0
+                assert budget.level == level_before - 1
+            else:
+                assert budget.level == level_before
+        else:
+            if rendered:
+                fast_keystrokes = 0
+            assert budget.level == level_before
+
+        if budget.level != level_before:
+            switches += 1
+
+        # Every switch gets logged
+        assert len(log) == switches
+        assert 0 <= budget.level <= len(budget.modes)
+        assert budget.is_on("deferred_highlighting") == (budget.level >= 1)
+
+
+# The validators an action runs are timed as their own stage, and
+# the stage around the action doesn't count that time again
+@settings(max_examples=100, deadline=None)
+@given(st.builds(deepcopy, st.sampled_from(trees)), list_of_action_names_strategy)
+def validation_is_timed_apart(file, list_of_action_names):
+    name, tree = file
+
+    budget = LatencyBudget(None, [])
+    stage_before = validators.check_stage
+    validators.time_checks_with(budget.stage)
+
+    try:
+        cursor_trail = []
+        for action_name in list_of_action_names:
+            # (The make_* actions always run their validator, unless the Module is selected)
+            validates = action_name.startswith("make_") and cursor_trail != []
+
+            budget.start()
+            start = time.perf_counter()
+            with budget.stage("mutate"):
+                cursor_trail, tree = apply_actions(tree, [action_name], cursor_trail)
+            elapsed = time.perf_counter() - start
+            budget.finish()
+
+            if validates:
+                assert "validate" in budget.last_times, action_name
+            assert sum(budget.last_times.values()) <= elapsed, action_name
+    finally:
+        validators.time_checks_with(stage_before)
+
+
+class RecordingBuffer(list):
+    """A buffer that counts how many lines get written to it"""
+
+    written = 0
+
+    def __setitem__(self, key, value):
+        self.written += len(value) + (key.stop - key.start)
+        super().__setitem__(key, value)
+
+
+# The buffer has to end up with the new lines,
+# and changing a single line has to only write that line
+@settings(max_examples=500, deadline=None)
+@given(st.lists(st.text()), st.lists(st.text()), st.text(), st.integers(min_value=0))
+def buffer_gets_the_rendered_lines(old_lines, new_lines, changed_line, position):
+    buffer = RecordingBuffer(old_lines)
+    writer = buffer_writer.BufferWriter(buffer)
+
+    writer.write(new_lines)
+    assert buffer == new_lines
+
+    if not new_lines:
+        return
+
+    position %= len(new_lines)
+    changed_lines = list(new_lines)
+    changed_lines[position] = changed_line
+
+    buffer.written = 0
+    writer.write(iter(changed_lines))
+
+    assert buffer == changed_lines
+    assert buffer.written <= 2
+
+    # Something else changing the buffer gets it all written again
+    buffer.append("something else")
+    writer.write(iter(new_lines))
+    assert buffer == new_lines
+
+
 if __name__ == "__main__":
     # It takes me 5 minutes to run the total 30.000 tests.
     # Given that we currently have 22 actions
     # Testing every sequence of 5 actions would take me 15 hours
     # (That is the nature of exponential growth...)
     action_sequence_keeps_ast_valid()
+    index_matches_a_fresh_walk()
+    children_match_listing_them_again()
+    slots_match_going_through_the_fields()
+    ancestor_checks_match_going_up_again()
+    incremental_validity_matches_compiling()
+    contexts_match_fixing_all_of_them()
+    contexts_match_parsing()
+    undo_and_redo_restore_the_tree()
+    history_keeps_to_its_size()
+    yanked_nodes_dont_change()
+    inapplicable_actions_do_nothing()
+    applicability_matches_the_old_validators()
+    strender_output_parses_back()
+    strender_lines_fit_when_they_can()
+    viewport_has_the_same_lines()
+    span_points_to_the_selected_node()
+    tokens_match_the_view()
+    long_lists_are_elided()
+    folds_are_one_line()
+    caches_dont_keep_trees_alive()
+    backends_round_trip()
+    prerendered_views_match()
+    saving_in_processes_gives_the_same_text()
+    latency_budget_switches_one_mode_at_a_time()
+    validation_is_timed_apart()
+    buffer_gets_the_rendered_lines()
@@ -1,98 +1,127 @@
 import ast
+from contextlib import nullcontext
 
 import core_logic
 
+# The validators are combined into trees (with validate_both, validate_one_of...)
+# Instead of running the whole tree of closures on every action, each one
+# is compiled when it's built into a check over the AncestorPath of the cursor.
+# That path is built once for each cursor position, and whatever a check
+# looks at is summed up in its signature (see AncestorPath.signature),
+# so the results are remembered for each signature
 
-def is_instance_of(ast_node_type):
-    def validate(cursor_trail, tree):
-        selected_node = core_logic.get_node_at_cursor(cursor_trail, tree)
 
-        # make sure the node is allowed to be placed here
-        return isinstance(selected_node, ast_node_type)
+# Gives the context the validators run within when an action calls them
+# (Like LatencyBudget.stage, see time_checks_with)
+check_stage = lambda name: nullcontext()
 
-    return validate
 
+def time_checks_with(stage):
+    """Makes the validators the actions run be timed as the "validate" stage"""
 
-# TODO: Move the validators into their own module
-def is_not_instance_of(ast_node_type):
-    def validate(cursor_trail, tree):
-        selected_node = core_logic.get_node_at_cursor(cursor_trail, tree)
+    global check_stage
+    check_stage = stage
 
-        return not isinstance(selected_node, ast_node_type)
 
-    return validate
+class Validator:
+    """Called like the validators used to be: validator(cursor_trail, tree)
 
+    spec says what it checks, like ("is_within", ast.FunctionDef)
+    or ("one_of", [validators...]), so the validators can be inspected"""
 
-def is_within(ast_node_type):
-    def validate(cursor_trail, tree):
+    def __init__(self, spec, check):
+        self.spec = spec
+        # AncestorPath -> bool
+        self.check = check
+        # AncestorPath.signature -> bool
+        self.results = {}
 
-        return core_logic.core_is_within(cursor_trail, tree, ast_node_type)
+    def __call__(self, cursor_trail, tree):
+        with check_stage("validate"):
+            return self.check_path(core_logic.get_ancestor_path(cursor_trail, tree))
 
-    return validate
+    def check_path(self, path):
+        signature = path.signature()
 
+        try:
+            return self.results[signature]
+        except KeyError:
+            result = self.results[signature] = self.check(path)
+            return result
 
-def is_within_field(ast_node_type, fieldname):
-    def validate(cursor_trail, tree):
 
-        return core_logic.core_is_within_field(cursor_trail, tree, ast_node_type, fieldname)
+def is_instance_of(ast_node_type):
+    # make sure the node is allowed to be placed here
+    return Validator(
+            ("is_instance_of", ast_node_type),
+            lambda path: issubclass(path.selected_type, ast_node_type)
+            )
 
-    return validate
 
+# TODO: Move the validators into their own module
+def is_not_instance_of(ast_node_type):
+    return Validator(
+            ("is_not_instance_of", ast_node_type),
+            lambda path: not issubclass(path.selected_type, ast_node_type)
+            )
 
-def is_not_in_context(context):
-    def validate(cursor_trail, tree):
-        return core_logic.core_is_not_in_context(cursor_trail, tree, context)
 
-    return validate
+def is_within(ast_node_type):
+    return Validator(
+            ("is_within", ast_node_type),
+            lambda path: ast_node_type in path.ancestor_types
+            )
 
 
-def is_in_context(context):
-    def validate(cursor_trail, tree):
-        return core_logic.core_is_in_context(cursor_trail, tree, context)
+def is_within_field(ast_node_type, fieldname):
+    return Validator(
+            ("is_within_field", ast_node_type, fieldname),
+            lambda path: any(issubclass(node_type, ast_node_type) and field == fieldname
+                             for (node_type, field) in path.ancestor_fields)
+            )
 
-    return validate
 
+def is_not_in_context(context):
+    return Validator(
+            ("is_not_in_context", context),
+            lambda path: path.context_type != context
+            )
 
-def validate_both(first_validator, second_validator):
-    """Make sure both validators pass"""
 
-    def validate(cursor_trail, tree):
-        return (first_validator(cursor_trail, tree)
-                and second_validator(cursor_trail, tree))
+def is_in_context(context):
+    return Validator(
+            ("is_in_context", context),
+            lambda path: path.context_type == context
+            )
 
-    return validate
+
+def validate_both(first_validator, second_validator):
+    """Make sure both validators pass"""
+    return validate_all_of(first_validator, second_validator)
 
 
 def validate_one_of(*validators):
     """Make sure at lest one of the validators passess"""
 
-    def validate(cursor_trail, tree):
-        for validator in validators:
-            if validator(cursor_trail, tree):
-                return True
-            
-        return False
-
-    return validate
+    checks = [validator.check for validator in validators]
+    return Validator(
+            ("one_of", list(validators)),
+            lambda path: any(check(path) for check in checks)
+            )
 
 
 def validate_all_of(*list_of_validators):
-    def validate(cursor_trail, tree):
-        for validator in list_of_validators:
-            if not validator(cursor_trail, tree):
-                return False
-
-        return True
-
-    return validate
+    checks = [validator.check for validator in list_of_validators]
+    return Validator(
+            ("all_of", list(list_of_validators)),
+            lambda path: all(check(path) for check in checks)
+            )
 
 
 def validate_not(validator):
     """Negates the validator"""
-    def negated(*args, **kwargs):
-        return not validator(*args, **kwargs)
-
-    return negated
+    check = validator.check
+    return Validator(("not", validator), lambda path: not check(path))
 
 
 def is_in_loop():
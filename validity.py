@@ -0,0 +1,233 @@
+import ast
+import weakref
+
+# Instead of compiling the whole module, each definition is compiled on its own,
+# with the definitions inside of it replaced by stubs (Same header, but the
+# body is just a pass). The headers (decorators, defaults, annotations, bases)
+# run in the enclosing scope, so they are compiled with the enclosing code.
+#
+# The only thing inside a definition that depends on what's around it is a
+# nonlocal statement (It needs a binding in an enclosing function), so the
+# definitions that have one stay inlined in the enclosing code.
+#
+# At the module level each statement is compiled on its own too, unless there
+# is something that relates statements to each other (global statements and
+# __future__ imports). In that case the whole module is compiled.
+
+definition_types = (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)
+
+# The results are only reused while the node's version in the index stays the same
+# definition -> (version, (is_valid, exception), has_nonlocal)
+checked_definitions = weakref.WeakKeyDictionary()
+# top level statement (or the module) -> (version, (is_valid, exception))
+checked_statements = weakref.WeakKeyDictionary()
+# top level statement -> (version, whether it relates statements to each other)
+related_statements = weakref.WeakKeyDictionary()
+
+
+def compile_check(tree):
+    """Make sure an ast is valid by trying to compile it"""
+
+    try:
+        ast.fix_missing_locations(tree)
+        compile(tree, "<test-ast>", "exec")
+    except (SyntaxError, ValueError, TypeError) as e:
+        return (False, e)
+
+    return (True, None)
+
+
+def check_module(tree, index):
+    """Same as compile_check(tree), but only compiles what changed
+    since the last check"""
+
+    if not isinstance(tree, ast.Module):
+        return compile_check(tree)
+
+    if any(relates_statements(statement, index) for statement in tree.body):
+        return check_cached(checked_statements, tree, index,
+                            lambda: compile_check(copy_node(tree)))
+
+    for statement in tree.body:
+        result = check_top_level_statement(statement, index)
+        if not result[0]:
+            return result
+
+    return (True, None)
+
+
+def relates_statements(statement, index):
+    """Whether there's a global statement or a __future__ import anywhere
+    in the module level scope of the statement (Like in the body of an if)"""
+
+    return check_cached(related_statements, statement, index,
+                        lambda: any(map(relates_directly, module_level_statements(statement))))
+
+
+def relates_directly(statement):
+    return (isinstance(statement, ast.Global)
+            or (isinstance(statement, ast.ImportFrom) and statement.module == "__future__"))
+
+
+def module_level_statements(statement):
+    """The statement and the statements nested in it that run in the
+    module's scope (Not the ones in the body of a definition)"""
+
+    pending = [statement]
+    while pending:
+        node = pending.pop()
+        yield node
+
+        if not isinstance(node, definition_types):
+            pending.extend(child for child in ast.iter_child_nodes(node)
+                           if isinstance(child, (ast.stmt, ast.excepthandler, ast.match_case)))
+
+
+def check_cached(cache, node, index, check):
+    version = index.version_of(node)
+
+    cached = cache.get(node)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    result = check()
+    cache[node] = (version, result)
+    return result
+
+
+def check_top_level_statement(statement, index):
+    def check():
+        definition_results = []
+        copied = copy_for_compiling(statement, index, definition_results, [False])
+
+        return first_failure(
+                [compile_check(ast.Module(body=[copied], type_ignores=[]))]
+                + definition_results)
+
+    return check_cached(checked_statements, statement, index, check)
+
+
+def check_definition(definition, index):
+    """Compiles the body of the definition on its own.
+    Returns the result and whether there is a nonlocal in it"""
+
+    version = index.version_of(definition)
+
+    cached = checked_definitions.get(definition)
+    if cached is not None and cached[0] == version:
+        return cached[1], cached[2]
+
+    definition_results = []
+    has_nonlocal = [False]
+    body = [copy_for_compiling(statement, index, definition_results, has_nonlocal)
+            for statement in definition.body]
+
+    header = headless_copy(definition)
+    header.body = body
+
+    result = first_failure(
+            [compile_check(ast.Module(body=[header], type_ignores=[]))]
+            + definition_results)
+
+    checked_definitions[definition] = (version, result, has_nonlocal[0])
+    return result, has_nonlocal[0]
+
+
+def copy_for_compiling(node, index, definition_results, has_nonlocal):
+    """Copies the node, replacing the definitions in it with stubs.
+    The results of checking those definitions are added to definition_results"""
+
+    if isinstance(node, ast.Nonlocal):
+        has_nonlocal[0] = True
+
+    if isinstance(node, definition_types):
+        result, definition_has_nonlocal = check_definition(node, index)
+
+        if not definition_has_nonlocal:
+            definition_results.append(result)
+
+            stub = copy_node(node, lambda child: copy_for_compiling(
+                child, index, definition_results, has_nonlocal), skip="body")
+            stub.body = [ast.Pass()]
+            return stub
+
+        # Otherwise it has to be compiled along with the enclosing code
+        # (and so does the code enclosing this one)
+        has_nonlocal[0] = True
+
+    return copy_node(node, lambda child: copy_for_compiling(
+        child, index, definition_results, has_nonlocal))
+
+
+def copy_node(node, copy_child=None, skip=None):
+    """Copies the node, using copy_child to copy its children
+    (deep copy by default). The skip field isn't copied"""
+
+    if copy_child is None:
+        copy_child = copy_node
+
+    copied = type(node)()
+
+    for field_name in node._fields:
+        # Fields that are missing stay missing, so that compile complains the same way
+        if field_name == skip or not hasattr(node, field_name):
+            continue
+
+        value = getattr(node, field_name)
+        if isinstance(value, ast.AST):
+            value = copy_child(value)
+        elif isinstance(value, list):
+            value = [copy_child(x) if isinstance(x, ast.AST) else x for x in value]
+
+        setattr(copied, field_name, value)
+
+    for attribute in node._attributes:
+        if hasattr(node, attribute):
+            setattr(copied, attribute, getattr(node, attribute))
+
+    return copied
+
+
+def headless_copy(definition):
+    """A copy of the definition without what runs in the enclosing scope
+    (Those are compiled with the enclosing code). The body is left for the caller"""
+
+    if isinstance(definition, ast.ClassDef):
+        return ast.ClassDef(
+                name=definition.name,
+                bases=[],
+                keywords=[],
+                body=[],
+                decorator_list=[],
+                )
+
+    args = definition.args
+
+    # The names stay, because duplicated arguments are an error within the function
+    def bare(arg):
+        return None if arg is None else ast.arg(arg=arg.arg, annotation=None)
+
+    return type(definition)(
+            name=definition.name,
+            args=ast.arguments(
+                posonlyargs=list(map(bare, args.posonlyargs)),
+                args=list(map(bare, args.args)),
+                vararg=bare(args.vararg),
+                kwonlyargs=list(map(bare, args.kwonlyargs)),
+                kw_defaults=[None] * len(args.kwonlyargs),
+                kwarg=bare(args.kwarg),
+                defaults=[]
+                ),
+            body=[],
+            decorator_list=[],
+            returns=None,
+            type_comment=None,
+            )
+
+
+def first_failure(results):
+    for result in results:
+        if not result[0]:
+            return result
+
+    return (True, None)
@@ -0,0 +1,66 @@
+from collections import deque
+from copy import deepcopy
+
+# How many of the last yanks are kept for cycling through
+ring_size = 10
+
+
+class Yank:
+    """A yanked node, shared with the tree until one of them changes
+    (copy on write), so yanking doesn't copy anything.
+
+    It keeps the node itself, not a handle: a handle moves to whatever
+    replaces its node and stops resolving once the node leaves the tree,
+    and a yank has to outlive deleting what was yanked"""
+
+    def __init__(self, node, index):
+        self.node = node
+        index.watch(node, self.unshare)
+
+    def unshare(self, node):
+        # Something within the node is about to change in the tree,
+        # so keep how it was when it got yanked
+        if node is self.node:
+            self.node = deepcopy(node)
+
+    def take(self, index):
+        """Returns the node to put in the tree"""
+
+        # A node can only be in one place in the tree
+        if index.contains(self.node):
+            return deepcopy(self.node)
+
+        # It isn't in the tree anymore (like after yanking and deleting)
+        # so hand over the node itself, and keep sharing it
+        index.watch(self.node, self.unshare)
+        return self.node
+
+
+class YankRing:
+    """The last yanks (the newest one last) and the named registers.
+    Kept in tree.states_for_actions["yank_ring"]"""
+
+    def __init__(self, size=ring_size):
+        self.ring = deque(maxlen=size)
+        self.registers = {}
+
+        # (A weak reference to) the last node that was put,
+        # so cycling can replace it
+        self.last_put = None
+
+    def yank(self, node, index, register=None):
+        yank = Yank(node, index)
+        self.ring.append(yank)
+
+        if register is not None:
+            self.registers[register] = yank
+
+    def latest(self):
+        if not self.ring:
+            return None
+
+        return self.ring[-1]
+
+    def cycle(self):
+        """Makes the yank before the latest one the latest"""
+        self.ring.rotate(1)